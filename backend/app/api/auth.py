@@ -10,6 +10,7 @@ from ..models import User
 from ..schemas import UserCreate, UserResponse, LoginRequest, TokenResponse
 from ..config import settings
 from ..rate_limiter import check_rate_limit
+from ..offload import offload
 
 router = APIRouter()
 security = HTTPBearer()
@@ -88,6 +89,16 @@ def get_current_parent(
     return current_user
 
 
+def _get_user_by_email(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
+
+
+def _add_user(db: Session, user: User):
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+
+
 def _get_client_ip(request: Request) -> str:
     """Get client IP. Respects TRUST_PROXY env (see request_utils.get_client_ip)."""
     from ..request_utils import get_client_ip
@@ -110,7 +121,7 @@ async def register(request: Request, user_data: UserCreate, db: Session = Depend
         )
     
     # Check if user already exists
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    existing_user = await offload.run("db", _get_user_by_email, db, user_data.email)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -124,16 +135,14 @@ async def register(request: Request, user_data: UserCreate, db: Session = Depend
             detail="Role must be 'parent' or 'child'"
         )
     
-    # Create new user
-    hashed_password = get_password_hash(user_data.password)
+    # Create new user (hashing is deliberately slow - keep it off the event loop)
+    hashed_password = await offload.run("cpu", get_password_hash, user_data.password)
     new_user = User(
         email=user_data.email,
         password_hash=hashed_password,
         role=user_data.role
     )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await offload.run("db", _add_user, db, new_user)
     
     # Return access token (same as login)
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -160,8 +169,8 @@ async def login(request: Request, login_data: LoginRequest, db: Session = Depend
             headers={"Retry-After": str(retry_after)}
         )
     
-    user = db.query(User).filter(User.email == login_data.email).first()
-    if not user or not verify_password(login_data.password, user.password_hash):
+    user = await offload.run("db", _get_user_by_email, db, login_data.email)
+    if not user or not await offload.run("cpu", verify_password, login_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
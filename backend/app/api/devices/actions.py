@@ -6,7 +6,8 @@ from datetime import datetime, timedelta, timezone
 from ...database import get_db
 from ...models import Device, User, Rule
 from ..auth import get_current_parent, verify_password
-from ..websocket import send_command_to_device
+from ..websocket import send_command_to_device, push_rules_to_device
+from ...services.rule_version_service import bump_rules_version
 
 router = APIRouter()
 
@@ -46,9 +47,10 @@ async def lock_device(
         enabled=True
     )
     db.add(lock_rule)
+    bump_rules_version(db, device.id)
     db.commit()
     
-    await send_command_to_device(device.device_id, "LOCK_NOW")
+    await push_rules_to_device(db, device, fallback_command="LOCK_NOW")
     
     return {"status": "success", "message": "Lock command sent to device"}
 
@@ -69,9 +71,10 @@ async def unlock_device(
     
     for rule in lock_rules:
         db.delete(rule)
+    bump_rules_version(db, device.id)
     db.commit()
 
-    await send_command_to_device(device.device_id, "UNLOCK_NOW")
+    await push_rules_to_device(db, device, fallback_command="UNLOCK_NOW")
     
     return {"status": "success", "message": "Unlock command sent to device"}
 
@@ -108,9 +111,10 @@ async def pause_internet(
         schedule_end_time=end_time.strftime("%H:%M")
     )
     db.add(network_block_rule)
+    bump_rules_version(db, device.id)
     db.commit()
     
-    await send_command_to_device(device.device_id, "REFRESH_RULES")
+    await push_rules_to_device(db, device)
     
     return {
         "status": "success",
@@ -134,10 +138,11 @@ async def resume_internet(
         Rule.schedule_start_time.isnot(None),
         Rule.schedule_end_time.isnot(None)
     ).delete()
+    bump_rules_version(db, device.id)
     
     db.commit()
     
-    await send_command_to_device(device.device_id, "REFRESH_RULES")
+    await push_rules_to_device(db, device)
     
     return {
         "status": "success",
@@ -190,10 +195,11 @@ async def unlock_settings(
         schedule_end_time=(device_now + timedelta(minutes=duration_minutes)).strftime("%H:%M") 
     )
     db.add(unlock_rule)
+    bump_rules_version(db, device.id)
     db.commit()
     
-    # CRITICAL: Notify device to fetch new rules
-    await send_command_to_device(device.device_id, "REFRESH_RULES")
+    # CRITICAL: Push the new rules to the device
+    await push_rules_to_device(db, device)
     
     return {
         "status": "success",
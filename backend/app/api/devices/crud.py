@@ -4,10 +4,14 @@ from sqlalchemy.orm import Session
 from typing import List
 import uuid
 from ...database import get_db
-from ...models import Device, User, UsageLog, Rule, PairingToken
+from ...models import Device, User, UsageLog, UsageDailyRollup, UsageHourlyRollup, DeviceUsageTotals, Rule, PairingToken, DeviceRuleState
 from ...schemas import DeviceUpdate, DeviceResponse
 from ..auth import get_current_parent
 from ...services.cleanup_service import cleanup_device_data
+from ...heartbeat import heartbeat_store
+from ...services.rule_snapshot_service import rule_snapshots
+from ...services.today_usage_service import today_usage
+from ...write_queue import write_queue
 
 router = APIRouter()
 
@@ -19,6 +23,7 @@ async def get_devices(
 ):
     """Get all devices for current parent."""
     devices = db.query(Device).filter(Device.parent_id == current_user.id).all()
+    heartbeat_store.overlay(devices)
     return devices
 
 
@@ -40,6 +45,7 @@ async def get_device(
             detail="Device not found"
         )
     
+    heartbeat_store.overlay([device])
     return device
 
 
@@ -142,13 +148,22 @@ async def delete_device(
             detail="Device not found"
         )
     
+    # Queued usage rows would otherwise be written after the delete
+    await write_queue.discard_device(device_id)
     cleanup_device_data(db, device_id)
     
     db.query(PairingToken).filter(PairingToken.device_id == device_id).update({PairingToken.device_id: None})
     db.query(UsageLog).filter(UsageLog.device_id == device_id).delete()
+    db.query(UsageDailyRollup).filter(UsageDailyRollup.device_id == device_id).delete()
+    db.query(UsageHourlyRollup).filter(UsageHourlyRollup.device_id == device_id).delete()
+    db.query(DeviceUsageTotals).filter(DeviceUsageTotals.device_id == device_id).delete()
     db.query(Rule).filter(Rule.device_id == device_id).delete()
+    db.query(DeviceRuleState).filter(DeviceRuleState.device_id == device_id).delete()
     
     db.delete(device)
     db.commit()
+    heartbeat_store.forget(device_id)
+    rule_snapshots.forget(device_id)
+    today_usage.forget(device_id)
     
     return None
@@ -13,6 +13,7 @@ from ...services.pairing_service import (
 from ...config import settings
 from ...rate_limiter import check_rate_limit
 from ...request_utils import get_client_ip
+from ...offload import offload
 
 router = APIRouter()
 
@@ -41,10 +42,7 @@ async def get_pairing_qr_code(
     db: Session = Depends(get_db)
 ):
     """Get QR code image for pairing token."""
-    pairing_token = db.query(PairingToken).filter(
-        PairingToken.token == token,
-        PairingToken.parent_id == current_user.id
-    ).first()
+    pairing_token = await offload.run("db", _get_pairing_token, db, token, current_user.id)
     
     if not pairing_token:
         raise HTTPException(
@@ -52,11 +50,19 @@ async def get_pairing_qr_code(
             detail="Pairing token not found"
         )
     
-    qr_code_image = generate_qr_code(pairing_token, settings.BACKEND_URL)
+    # PNG rendering is CPU bound - keep it off the event loop
+    qr_code_image = await offload.run("cpu", generate_qr_code, pairing_token, settings.BACKEND_URL)
     
     return {"qr_code": qr_code_image, "token": token}
 
 
+def _get_pairing_token(db: Session, token: str, parent_id: int):
+    return db.query(PairingToken).filter(
+        PairingToken.token == token,
+        PairingToken.parent_id == parent_id
+    ).first()
+
+
 @router.post("/pair", response_model=PairingResponse)
 async def pair_device(
     request: Request,
@@ -5,7 +5,8 @@ from ...database import get_db
 from ...models import Device, User
 from ...schemas import DeviceSettingsProtectionUpdate
 from ..auth import get_current_parent
-from ..websocket import send_command_to_device
+from ..websocket import push_rules_to_device
+from ...services.rule_version_service import bump_rules_version
 
 router = APIRouter()
 
@@ -44,9 +45,10 @@ async def update_settings_protection(
     
     device.settings_protection = data.settings_protection
     device.settings_exceptions = data.settings_exceptions
+    bump_rules_version(db, device.id)
     db.commit()
     
-    await send_command_to_device(device.device_id, "REFRESH_RULES")
+    await push_rules_to_device(db, device)
     
     return {
         "status": "success",
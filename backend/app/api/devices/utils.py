@@ -1,8 +1,8 @@
 """Device utility functions."""
 from fastapi import HTTPException, status
 from sqlalchemy.orm import Session
-from datetime import datetime, timezone
 from ...models import Device
+from ...heartbeat import heartbeat_store
 
 
 def verify_device_api_key(device_id: str, api_key: str, db: Session) -> Device:
@@ -18,6 +18,7 @@ def verify_device_api_key(device_id: str, api_key: str, db: Session) -> Device:
             detail="Invalid device credentials"
         )
     
-    device.last_seen = datetime.now(timezone.utc)
+    # Liveness is kept in memory and flushed to devices.last_seen periodically
+    heartbeat_store.touch(device.id)
     
     return device
@@ -14,6 +14,7 @@ import os
 import uuid
 from datetime import datetime
 from ..config import settings
+from ..offload import offload
 
 router = APIRouter()
 security = HTTPBearer(auto_error=False) # Allow manual handling
@@ -143,10 +144,7 @@ async def upload_screenshot(
             detail=f"Screenshot too large. Max {MAX_SCREENSHOT_UPLOAD_BYTES // (1024*1024)} MB.",
         )
     # Verify Device
-    device = db.query(Device).filter(
-        Device.device_id == device_id,
-        Device.api_key == api_key
-    ).first()
+    device = await offload.run("db", _find_device, db, device_id, api_key)
     
     if not device:
         raise HTTPException(
@@ -154,9 +152,7 @@ async def upload_screenshot(
             detail="Invalid credentials"
         )
     
-    # Create device directory
     device_dir = os.path.join(SCREENSHOTS_DIR, str(device.device_id))
-    os.makedirs(device_dir, exist_ok=True)
     
     # Generate filename
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -176,23 +172,9 @@ async def upload_screenshot(
             detail="Invalid image file format. Only JPG, PNG, WEBP are allowed."
         )
 
-    # Save file (cap size to prevent DoS if Content-Length was spoofed)
+    # Save file in the files pool (disk writes off the event loop)
     try:
-        total = 0
-        with open(file_path, "wb") as buffer:
-            while True:
-                chunk = await file.read(65536)
-                if not chunk:
-                    break
-                total += len(chunk)
-                if total > MAX_SCREENSHOT_UPLOAD_BYTES:
-                    buffer.close()
-                    os.remove(file_path)
-                    raise HTTPException(
-                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                        detail=f"Screenshot too large. Max {MAX_SCREENSHOT_UPLOAD_BYTES // (1024*1024)} MB.",
-                    )
-                buffer.write(chunk)
+        await offload.run("files", _save_screenshot, file.file, device_dir, file_path)
     finally:
         file.file.close()
         
@@ -204,10 +186,37 @@ async def upload_screenshot(
     # Update device record (Store RELATIVE path for dynamism)
     device.last_screenshot = relative_path
     device.screenshot_requested = False
-    db.commit()
+    await offload.run("db", db.commit)
     
     return {
         "status": "success",
         "url": full_url,
         "filename": filename
     }
+
+
+def _find_device(db: Session, device_id: str, api_key: str) -> Optional[Device]:
+    return db.query(Device).filter(
+        Device.device_id == device_id,
+        Device.api_key == api_key
+    ).first()
+
+
+def _save_screenshot(source, device_dir: str, file_path: str):
+    """Copy the upload to file_path (cap size to prevent DoS if Content-Length was spoofed)."""
+    os.makedirs(device_dir, exist_ok=True)
+    total = 0
+    with open(file_path, "wb") as buffer:
+        while True:
+            chunk = source.read(65536)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > MAX_SCREENSHOT_UPLOAD_BYTES:
+                buffer.close()
+                os.remove(file_path)
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Screenshot too large. Max {MAX_SCREENSHOT_UPLOAD_BYTES // (1024*1024)} MB.",
+                )
+            buffer.write(chunk)
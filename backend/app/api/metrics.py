@@ -0,0 +1,142 @@
+"""Runtime metrics endpoints.
+
+- /api/metrics: Prometheus text format (request latency, DB queries per
+  request, ingest rows, rate-limit rejections, cache hit ratios, WebSocket
+  connections, connection and offload pools)
+- /api/internal/metrics: JSON snapshot of the stats() of pools, caches, queues
+
+Not meant for the parent dashboard: only loopback clients (e.g. a scraper
+on the same host) or requests with "Authorization: Bearer <METRICS_TOKEN>"
+get an answer, everyone else sees 404.
+"""
+import ipaddress
+import secrets
+
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
+
+from ..cache import stats_cache
+from ..config import settings
+from ..database import pool_stats
+from ..heartbeat import heartbeat_store
+from ..metrics import registry, render_samples
+from ..offload import offload
+from ..services.app_filter import app_filter
+from ..services.rule_snapshot_service import rule_snapshots
+from ..services.today_usage_service import today_usage
+from ..write_queue import write_queue
+from .websocket import manager
+
+router = APIRouter()
+
+
+def _is_loopback(ip: str) -> bool:
+    try:
+        return ipaddress.ip_address(ip).is_loopback
+    except ValueError:
+        return False
+
+
+# Set by reverse proxies; their presence means the peer address is the proxy, not the client
+_FORWARDING_HEADERS = ("forwarded", "x-forwarded-for", "x-real-ip")
+
+
+def require_metrics_access(request: Request):
+    """
+    Allow direct loopback clients and holders of METRICS_TOKEN.
+
+    The socket peer is checked, not get_client_ip(): X-Forwarded-For is
+    client-supplied, and a proxy on the same host makes every request
+    look like loopback, so forwarded requests always need the token.
+    """
+    peer = request.client.host if request.client else ""
+    if _is_loopback(peer) and not any(h in request.headers for h in _FORWARDING_HEADERS):
+        return
+    token = settings.METRICS_TOKEN
+    auth = request.headers.get("Authorization", "")
+    if token and auth.startswith("Bearer ") and secrets.compare_digest(auth[7:], token):
+        return
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+
+@router.get("/internal/metrics")
+async def get_internal_metrics(request: Request):
+    """Snapshot of connection pools, offload pools, caches, write queue and heartbeats."""
+    require_metrics_access(request)
+    return {
+        "db_pools": pool_stats(),
+        "offload": offload.stats(),
+        "stats_cache": stats_cache.stats(),
+        "rule_snapshots": rule_snapshots.stats(),
+        "today_usage": today_usage.stats(),
+        "write_queue": write_queue.stats(),
+        "heartbeat": heartbeat_store.stats(),
+    }
+
+
+def _snapshot_lines() -> list:
+    """Gauges and counters read from the components' stats() at scrape time."""
+    lines = []
+    cache = stats_cache.stats()
+    lines += render_samples("stats_cache_hits_total", "counter", "stats_cache lookups served from cache", [({}, cache["hits"])])
+    lines += render_samples("stats_cache_misses_total", "counter", "stats_cache lookups that had to compute", [({}, cache["misses"])])
+    lines += render_samples("stats_cache_hit_ratio", "gauge", "stats_cache hits / lookups since start", [({}, cache["hit_ratio"])])
+    lines += render_samples("stats_cache_entries", "gauge", "stats_cache entries", [({}, cache["size"])])
+
+    snapshots = rule_snapshots.stats()
+    lines += render_samples("rule_snapshot_hits_total", "counter", "Agent rule fetches served from a compiled snapshot", [({}, snapshots["hits"])])
+    lines += render_samples("rule_snapshot_misses_total", "counter", "Agent rule fetches that compiled a snapshot", [({}, snapshots["misses"])])
+    lines += render_samples("rule_snapshot_entries", "gauge", "Devices with a compiled rule snapshot", [({}, snapshots["size"])])
+
+    usage = today_usage.stats()
+    lines += render_samples("today_usage_hits_total", "counter", "Agent fetches answered from the in-memory today usage", [({}, usage["hits"])])
+    lines += render_samples("today_usage_loads_total", "counter", "Today usage loaded from usage_logs (miss, new day)", [({}, usage["loads"])])
+    lines += render_samples("today_usage_devices", "gauge", "Devices with today usage in memory", [({}, usage["devices"])])
+
+    filter_caches = {
+        "is_trackable": app_filter.is_trackable.cache_info(),
+        "get_category": app_filter.get_category.cache_info(),
+    }
+    lines += render_samples("app_filter_cache_hits_total", "counter", "app_filter lookup cache hits",
+                            [({"function": name}, info.hits) for name, info in filter_caches.items()])
+    lines += render_samples("app_filter_cache_misses_total", "counter", "app_filter lookup cache misses",
+                            [({"function": name}, info.misses) for name, info in filter_caches.items()])
+    lines += render_samples("app_filter_cache_hit_ratio", "gauge", "app_filter hits / lookups since start", [
+        ({"function": name}, round(info.hits / (info.hits + info.misses), 3) if info.hits + info.misses else 0.0)
+        for name, info in filter_caches.items()
+    ])
+
+    lines += render_samples("websocket_connections", "gauge", "Open WebSocket connections", [
+        ({"kind": "parent"}, sum(len(sockets) for sockets in list(manager.active_connections.values()))),
+        ({"kind": "device"}, len(manager.active_device_connections)),
+    ])
+
+    pools = [(name, p) for name, p in pool_stats().items() if "checked_out" in p]
+    for key, name, kind, help_text, scale in (
+        ("size", "db_pool_size", "gauge", "Connection pool size", 1),
+        ("checked_out", "db_pool_checked_out", "gauge", "Connections in use", 1),
+        ("overflow", "db_pool_overflow", "gauge", "Connections above the pool size", 1),
+        ("avg_wait_ms", "db_pool_checkout_wait_seconds_avg", "gauge", "Average wait for a connection (EMA)", 0.001),
+        ("timeouts", "db_pool_timeouts_total", "counter", "Checkouts that gave up waiting", 1),
+    ):
+        lines += render_samples(name, kind, help_text, [({"engine": n}, p[key] * scale) for n, p in pools])
+
+    categories = offload.stats()
+    for key, name, help_text, scale in (
+        ("active", "offload_active", "Tasks running in the offload pool", 1),
+        ("waiting", "offload_waiting", "Tasks queued for an offload thread", 1),
+        ("avg_queue_wait_ms", "offload_queue_wait_seconds_avg", "Average wait for an offload thread (EMA)", 0.001),
+    ):
+        lines += render_samples(name, "gauge", help_text, [({"category": c}, s[key] * scale) for c, s in categories.items()])
+
+    lines += render_samples("write_queue_depth", "gauge", "Rows waiting in the write-behind queue",
+                            [({}, write_queue.stats()["depth"])])
+    return lines
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint."""
+    require_metrics_access(request)
+    body = "\n".join(registry.render() + _snapshot_lines()) + "\n"
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
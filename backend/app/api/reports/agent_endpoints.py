@@ -11,11 +11,12 @@ from datetime import datetime, timedelta, timezone
 import logging
 import json
 
-from ...database import get_db
+from ...database import get_db, get_async_db, AsyncDb
 from ...models import UsageLog, Device, Rule
 from ...schemas import AgentReportRequest, CriticalEventRequest
 from ..devices.utils import verify_device_api_key
-from ...services.app_filter import app_filter
+from ...services import ingest_service
+from ...write_queue import write_queue
 from .device_endpoints import running_processes_cache
 
 router = APIRouter()
@@ -27,9 +28,14 @@ logger = logging.getLogger("agent_endpoints")
 @router.post("/agent/report", status_code=status.HTTP_201_CREATED)
 async def agent_report_usage(
     request: AgentReportRequest,
-    db: Session = Depends(get_db)
+    db: AsyncDb = Depends(get_async_db)
 ):
     """Agent endpoint to report usage statistics."""
+    return await db.run(_process_report, request)
+
+
+def _process_report(db: Session, request: AgentReportRequest) -> dict:
+    """Apply one agent report in one transaction (runs off the event loop via AsyncDb)."""
     device = verify_device_api_key(request.device_id, request.api_key, db)
     
     # Update last_seen timestamp
@@ -75,43 +81,14 @@ async def agent_report_usage(
         device.daily_usage_seconds = request.device_usage_today_seconds
         logger.debug(f"Updated device {device.id} daily usage: {device.daily_usage_seconds}s")
     
-    # Process usage logs
-    total_duration = 0
-    filtered_count = 0
-    trackable_duration = 0
-    
-    for log_data in request.usage_logs:
-        app_name = log_data.app_name
-        is_trackable = app_filter.is_trackable(app_name)
-        
-        if not is_trackable:
-            filtered_count += 1
-            logger.debug(f"Filtered non-trackable app: {app_name}")
-            continue
-        
-        friendly_name = app_filter.get_friendly_name(app_name)
-        category = app_filter.get_category(app_name)
-        
-        usage_log = UsageLog(
-            device_id=device.id,
-            app_name=app_name,
-            window_title=log_data.window_title,
-            exe_path=log_data.exe_path,
-            duration=log_data.duration,
-            is_focused=log_data.is_focused,
-            timestamp=log_data.timestamp or datetime.now(timezone.utc)
-        )
-        db.add(usage_log)
-        total_duration += log_data.duration
-        trackable_duration += log_data.duration
-        logger.debug(f"  - {friendly_name} ({category or 'unknown'}): {log_data.duration}s")
+    # Usage rows go to the write-behind queue, or are bulk inserted in this transaction
+    rows, filtered_count = ingest_service.build_usage_rows(device.id, request.usage_logs, now_utc)
+    queued = ingest_service.submit_usage_rows(db, rows, device.timezone_offset or 0)
+    trackable_duration = sum(row["duration"] for row in rows)
     
     if filtered_count > 0:
         logger.info(f"Filtered {filtered_count} non-trackable app entries (backend filter)")
     
-    db.commit()
-    logger.info(f"Saved {len(request.usage_logs) - filtered_count} usage logs, trackable duration: {trackable_duration}s ({trackable_duration // 60}m)")
-    
     # Store running processes
     if hasattr(request, 'running_processes') and request.running_processes is not None:
         processes_json = json.dumps(request.running_processes)
@@ -122,19 +99,21 @@ async def agent_report_usage(
             "updated_at": datetime.now(timezone.utc)
         }
         logger.debug(f"Saved {len(request.running_processes)} running processes for device {device.id}")
-        
-    db.add(device)
-    db.commit()
     
     # Check for pending commands
     commands = []
     if device.screenshot_requested:
         commands.append({"type": "screenshot"})
         device.screenshot_requested = False
-        db.add(device)
-        db.commit()
         logger.info(f"Sent screenshot command to device {device.id}")
     
+    # One transaction for usage rows + device row (last_seen, timezone, daily usage, processes)
+    db.add(device)
+    db.commit()
+    if not queued:
+        ingest_service.publish_usage_changed(rows)
+    logger.info(f"{'Queued' if queued else 'Saved'} {len(rows)} usage logs, trackable duration: {trackable_duration}s ({trackable_duration // 60}m)")
+    
     return {
         "status": "success", 
         "logs_received": len(request.usage_logs), 
@@ -167,44 +146,22 @@ async def agent_upload_screenshot(
 @router.post("/agent/critical-event", status_code=status.HTTP_201_CREATED)
 async def agent_critical_event(
     request: CriticalEventRequest = Body(...),
-    db: Session = Depends(get_db)
+    db: AsyncDb = Depends(get_async_db)
 ):
     """
     Agent endpoint for immediate critical event reporting.
     Called when: limit exceeded, app blocked, daily limit reached
     """
-    device = verify_device_api_key(request.device_id, request.api_key, db)
-    device.last_seen = datetime.now(timezone.utc)
+    device = await db.run(_verify_device, request.device_id, request.api_key)
     
     logger.warning(f"CRITICAL EVENT from device {device.id}: {request.event_type} - {request.app_name or 'N/A'}")
     
     # For limit_exceeded events, update usage log with actual time
     if request.event_type == 'limit_exceeded' and request.app_name and request.used_seconds:
-        offset_seconds = device.timezone_offset or 0
-        now_device = datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)
-        local_midnight = now_device.replace(hour=0, minute=0, second=0, microsecond=0)
-        today_start_utc = local_midnight - timedelta(seconds=offset_seconds)
-        today_end_utc = today_start_utc + timedelta(days=1)
-        
-        current_usage = db.query(func.sum(UsageLog.duration)).filter(
-            UsageLog.device_id == device.id,
-            func.lower(UsageLog.app_name) == request.app_name.lower(),
-            UsageLog.timestamp >= today_start_utc,
-            UsageLog.timestamp < today_end_utc
-        ).scalar() or 0
-        
-        diff = request.used_seconds - current_usage
-        if diff > 0:
-            usage_log = UsageLog(
-                device_id=device.id,
-                app_name=request.app_name,
-                duration=diff,
-                timestamp=request.timestamp or datetime.now(timezone.utc)
-            )
-            db.add(usage_log)
-            logger.info(f"Added {diff}s to {request.app_name} usage (total now: {request.used_seconds}s)")
-    
-    db.commit()
+        # Rows still buffered in the write-behind queue must be visible to the sum below
+        if write_queue.is_running:
+            await write_queue.flush()
+        await db.run(_record_limit_exceeded, device, request)
     
     return {
         "status": "received",
@@ -213,6 +170,43 @@ async def agent_critical_event(
     }
 
 
+def _verify_device(db: Session, device_id: str, api_key: str) -> Device:
+    return verify_device_api_key(device_id, api_key, db)
+
+
+def _record_limit_exceeded(db: Session, device: Device, request: CriticalEventRequest):
+    """Top up today's usage of the app to what the agent measured (off the event loop)."""
+    offset_seconds = device.timezone_offset or 0
+    now_device = datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)
+    local_midnight = now_device.replace(hour=0, minute=0, second=0, microsecond=0)
+    today_start_utc = local_midnight - timedelta(seconds=offset_seconds)
+    today_end_utc = today_start_utc + timedelta(days=1)
+    
+    current_usage = db.query(func.sum(UsageLog.duration)).filter(
+        UsageLog.device_id == device.id,
+        func.lower(UsageLog.app_name) == request.app_name.lower(),
+        UsageLog.timestamp >= today_start_utc,
+        UsageLog.timestamp < today_end_utc
+    ).scalar() or 0
+    
+    diff = request.used_seconds - current_usage
+    if diff > 0:
+        rows = [{
+            "device_id": device.id,
+            "app_name": request.app_name,
+            "window_title": None,
+            "exe_path": None,
+            "duration": diff,
+            "is_focused": False,
+            "timestamp": request.timestamp or datetime.now(timezone.utc)
+        }]
+        # last_seen is touched in memory by verify_device_api_key; only commit if the row was written inline
+        if not ingest_service.submit_usage_rows(db, rows, offset_seconds):
+            db.commit()
+            ingest_service.publish_usage_changed(rows)
+        logger.info(f"Added {diff}s to {request.app_name} usage (total now: {request.used_seconds}s)")
+
+
 def get_running_processes_cache():
     """Get the running processes cache for other modules."""
     return running_processes_cache
@@ -6,7 +6,7 @@ Split from monolithic reports.py for better maintainability.
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from typing import List, Dict
+from typing import List
 from datetime import datetime, timedelta, timezone
 import logging
 
@@ -14,16 +14,21 @@ from ...database import get_db
 from ...models import UsageLog, Device, User, Rule
 from ...schemas import UsageLogResponse
 from ..auth import get_current_parent
+from ...cache import publish_data_changed
+from ...services import rollup_service
 from ...services.app_filter import app_filter
+from ...services.today_usage_service import today_usage
+from ...state_backend import StateMap
 
 router = APIRouter()
 logger = logging.getLogger("device_endpoints")
 
-# In-memory cache for running processes
-running_processes_cache: Dict[int, dict] = {}
+# Latest running processes per device (device_id -> {"processes", "updated_at"}),
+# kept in the state backend so every worker sees the last agent report
+running_processes_cache = StateMap("running_processes")
 
 
-def get_running_processes_cache() -> Dict[int, dict]:
+def get_running_processes_cache() -> StateMap:
     """Get the running processes cache."""
     return running_processes_cache
 
@@ -84,18 +89,35 @@ async def cleanup_old_logs(
     current_user: User = Depends(get_current_parent),
     db: Session = Depends(get_db)
 ):
-    """Cleanup usage logs older than X days."""
+    """Cleanup usage logs older than X days (and the rollups / totals built from them)."""
     cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
     
-    device_ids = db.query(Device.id).filter(Device.parent_id == current_user.id).all()
-    device_ids = [d[0] for d in device_ids]
+    devices = db.query(Device).filter(Device.parent_id == current_user.id).all()
+    device_ids = [d.id for d in devices]
+    
+    # Oldest deleted log per device = start of the window whose cached stats change
+    oldest = dict(db.query(UsageLog.device_id, func.min(UsageLog.timestamp)).filter(
+        UsageLog.device_id.in_(device_ids),
+        UsageLog.timestamp < cutoff_date
+    ).group_by(UsageLog.device_id).all())
     
     deleted_count = db.query(UsageLog).filter(
         UsageLog.device_id.in_(device_ids),
         UsageLog.timestamp < cutoff_date
     ).delete(synchronize_session=False)
     
+    for device in devices:
+        if device.id in oldest:
+            rollup_service.trim_before(db, device.id, cutoff_date, device.timezone_offset or 0)
     db.commit()
+    
+    for device_id, since in oldest.items():
+        rollup_service.reconcile_totals(db, device_id)
+        since = since.replace(tzinfo=timezone.utc) if since.tzinfo is None else since.astimezone(timezone.utc)
+        publish_data_changed(device_id, since, cutoff_date)
+    # days < 1 can reach today's logs
+    for device_id in device_ids:
+        today_usage.forget(device_id)
     return {"status": "success", "deleted_count": deleted_count}
 
 
@@ -2,20 +2,27 @@
 Advanced statistics endpoints for charts and analytics.
 
 Thin API layer - common logic is in services/stats_service.py
+
+Each endpoint verifies ownership, then returns the cached response or
+builds it with stats_cache.get_or_compute(): the DB work runs in the
+"reports" offload pool with its own session (on the read replica if
+DATABASE_READ_URL is set) and concurrent requests for the same key share
+one computation. Within STATS_MAX_STALE[endpoint] seconds after
+expiry the previous response is served while it refreshes in the background.
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from datetime import datetime, timedelta, timezone
 import logging
 
-from ...database import get_db
-from ...models import UsageLog, Device, User
+from ...config import settings
+from ...database import get_db, read_bind
+from ...models import Device, User
 from ..auth import get_current_parent
 from ...cache import stats_cache
+from ...offload import offload
 from ...services import stats_service
 from ...services.app_filter import app_filter
-from ...db_utils import date_expr, hour_expr, day_range_utc
 
 router = APIRouter()
 logger = logging.getLogger("stats_endpoints")
@@ -24,6 +31,25 @@ logger = logging.getLogger("stats_endpoints")
 CZECH_DAYS = ["Pondeli", "Utery", "Streda", "Ctvrtek", "Patek", "Sobota", "Nedele"]
 
 
+def _run_in_session(bind, build, *args):
+    """Run build(db, *args) with its own session - the background refresh outlives the request."""
+    db = Session(bind=bind)
+    try:
+        return build(db, *args)
+    finally:
+        db.close()
+
+
+def _in_worker(db: Session, build, *args):
+    """get_or_compute() callable running build in the reports pool on db's (read) engine."""
+    bind = read_bind(db.get_bind())
+    return lambda: offload.run("reports", _run_in_session, bind, build, *args)
+
+
+def _max_stale(endpoint: str) -> float:
+    return settings.STATS_MAX_STALE.get(endpoint, 0)
+
+
 def verify_device_ownership(device_id: int, user_id: int, db: Session) -> Device:
     """Verify device belongs to the parent and return it."""
     device = db.query(Device).filter(
@@ -49,49 +75,37 @@ async def get_usage_by_hour(
     """Get usage data grouped by date and hour for heatmap visualization."""
     days = min(days, 14)
     
-    device = verify_device_ownership(device_id, current_user.id, db)
+    device = await offload.run("db", verify_device_ownership, device_id, current_user.id, db)
     offset_seconds = device.timezone_offset or 0
     cache_key = f"usage_by_hour:{device_id}:{days}:{offset_seconds}"
-    cached = stats_cache.get(cache_key)
-    if cached is not None:
-        return cached
-
-    now_utc = datetime.now(timezone.utc)
-    start_date = now_utc - timedelta(days=days)
-
-    results = db.query(
-        date_expr(db, UsageLog.timestamp).label('date'),
-        hour_expr(db, UsageLog.timestamp).label('hour'),
-        func.sum(UsageLog.duration).label('total_seconds')
-    ).filter(
-        UsageLog.device_id == device_id,
-        UsageLog.timestamp >= start_date
-    ).group_by(
-        date_expr(db, UsageLog.timestamp),
-        hour_expr(db, UsageLog.timestamp)
-    ).all()
-
-    heatmap_data = []
-    for row in results:
-        utc_dt = datetime.strptime(
-            f"{row.date} {int(row.hour):02d}:00:00", "%Y-%m-%d %H:%M:%S"
-        ).replace(tzinfo=timezone.utc)
-        local_dt = utc_dt + timedelta(seconds=offset_seconds)
-        heatmap_data.append({
-            "date": local_dt.strftime("%Y-%m-%d"),
-            "hour": local_dt.hour,
-            "duration_seconds": int(row.total_seconds or 0),
-            "duration_minutes": round((row.total_seconds or 0) / 60, 1)
-        })
+    start_date = datetime.now(timezone.utc) - timedelta(days=days)
     
-    response = {
+    return await stats_cache.get_or_compute(
+        cache_key,
+        _in_worker(db, _build_usage_by_hour, device_id, days, start_date, offset_seconds),
+        ttl=300, max_stale=_max_stale("usage_by_hour"), device_id=device_id, window=(start_date, None)
+    )
+
+
+def _build_usage_by_hour(db: Session, device_id: int, days: int, start_date: datetime, offset_seconds: int) -> dict:
+    """Heatmap response (runs in a worker thread)."""
+    heatmap_data = [
+        {
+            "date": date,
+            "hour": hour,
+            "duration_seconds": total_seconds,
+            "duration_minutes": round(total_seconds / 60, 1)
+        }
+        for date, hour, total_seconds in stats_service.get_local_hourly_usage(
+            db, device_id, start_date, offset_seconds
+        )
+    ]
+    
+    return {
         "device_id": device_id,
         "days_analyzed": days,
         "data": heatmap_data
     }
-    
-    stats_cache.set(cache_key, response, ttl=300)
-    return response
 
 
 @router.get("/device/{device_id}/usage-trends")
@@ -104,39 +118,38 @@ async def get_usage_trends(
     """Get daily usage trends for line chart visualization."""
     days = 7 if period == "week" else 30
     
+    device = await offload.run("db", verify_device_ownership, device_id, current_user.id, db)
+    offset_seconds = device.timezone_offset or 0
     cache_key = f"usage_trends:{device_id}:{period}"
-    cached = stats_cache.get(cache_key)
-    if cached is not None:
-        return cached
+    day_strs = stats_service.local_day_strings(offset_seconds, days)
     
-    verify_device_ownership(device_id, current_user.id, db)
-    
-    now_utc = datetime.now(timezone.utc)
+    return await stats_cache.get_or_compute(
+        cache_key,
+        _in_worker(db, _build_usage_trends, device_id, day_strs, offset_seconds),
+        ttl=300, max_stale=_max_stale("usage_trends"), device_id=device_id,
+        window=stats_service.local_days_window(day_strs[0], day_strs[-1], offset_seconds)
+    )
+
+
+def _build_usage_trends(db: Session, device_id: int, day_strs: list, offset_seconds: int) -> list:
+    """Daily trend rows for day_strs (runs in a worker thread)."""
+    # One range query for all days
+    series = stats_service.get_daily_usage_series(db, device_id, day_strs[0], day_strs[-1], offset_seconds)
     
     results = []
-    for i in range(days):
-        day = now_utc - timedelta(days=i)
-        day_str = day.strftime('%Y-%m-%d')
-        
-        # Use service functions
-        first_time, last_time = stats_service.get_activity_boundaries(db, device_id, day_str)
-        day_minutes = stats_service.calculate_day_usage_minutes(db, device_id, day_str)
-        apps_count, sessions_count = stats_service.get_day_stats(db, device_id, day_str)
-        
-        total_seconds = day_minutes * 60
+    for day_str in day_strs:
+        day = series.get(day_str)
+        total_seconds = day["minutes"] * 60 if day else 0
         
         results.append({
             "date": day_str,
             "total_seconds": total_seconds,
             "total_minutes": round(total_seconds / 60, 1),
-            "apps_count": apps_count,
-            "sessions_count": sessions_count,
-            "first_activity": first_time,
-            "last_activity": last_time
+            "apps_count": day["apps_count"] if day else 0,
+            "sessions_count": day["sessions_count"] if day else 0,
+            "first_activity": stats_service.format_local_time(day["first_activity"], offset_seconds) if day else None,
+            "last_activity": stats_service.format_local_time(day["last_activity"], offset_seconds) if day else None
         })
-    
-    results.reverse()
-    stats_cache.set(cache_key, results, ttl=300)
     return results
 
 
@@ -150,37 +163,32 @@ async def get_weekly_pattern(
     """Get average usage by day of week (Monday-Sunday)."""
     weeks = min(weeks, 8)
     
+    device = await offload.run("db", verify_device_ownership, device_id, current_user.id, db)
+    offset_seconds = device.timezone_offset or 0
     cache_key = f"weekly_pattern:{device_id}:{weeks}"
-    cached = stats_cache.get(cache_key)
-    if cached is not None:
-        return cached
-    
-    verify_device_ownership(device_id, current_user.id, db)
-    
-    now_utc = datetime.now(timezone.utc)
+    day_strs = stats_service.local_day_strings(offset_seconds, weeks * 7)
     
+    return await stats_cache.get_or_compute(
+        cache_key,
+        _in_worker(db, _build_weekly_pattern, device_id, day_strs, offset_seconds),
+        ttl=300, max_stale=_max_stale("weekly_pattern"), device_id=device_id,
+        window=stats_service.local_days_window(day_strs[0], day_strs[-1], offset_seconds)
+    )
+
+
+def _build_weekly_pattern(db: Session, device_id: int, day_strs: list, offset_seconds: int) -> list:
+    """Per-weekday averages over day_strs (runs in a worker thread)."""
     day_totals = {i: {"total_seconds": 0, "sessions": 0, "days_count": 0} for i in range(7)}
     
-    for i in range((weeks * 7)):
-        day = now_utc - timedelta(days=i)
-        day_str = day.strftime('%Y-%m-%d')
-        day_of_week = day.weekday()
-        
-        day_minutes = stats_service.calculate_day_usage_minutes(db, device_id, day_str)
-        day_usage = day_minutes * 60
+    series = stats_service.get_daily_usage_series(db, device_id, day_strs[0], day_strs[-1], offset_seconds)
+    for day_str, day in series.items():
+        day_of_week = datetime.strptime(day_str, '%Y-%m-%d').weekday()
         
-        if day_usage > 0:
-            day_totals[day_of_week]["total_seconds"] += day_usage
+        if day["minutes"] > 0:
+            day_totals[day_of_week]["total_seconds"] += day["minutes"] * 60
             day_totals[day_of_week]["days_count"] += 1
         
-        day_start, day_end = day_range_utc(day_str)
-        sessions = db.query(func.count(UsageLog.id)).filter(
-            UsageLog.device_id == device_id,
-            UsageLog.timestamp >= day_start,
-            UsageLog.timestamp < day_end
-        ).scalar() or 0
-        
-        day_totals[day_of_week]["sessions"] += sessions
+        day_totals[day_of_week]["sessions"] += day["sessions_count"]
     
     results = []
     for day_idx in range(7):
@@ -197,8 +205,6 @@ async def get_weekly_pattern(
             "total_seconds": data["total_seconds"],
             "days_with_data": data["days_count"]
         })
-    
-    stats_cache.set(cache_key, results, ttl=300)
     return results
 
 
@@ -209,26 +215,38 @@ async def get_weekly_current(
     db: Session = Depends(get_db)
 ):
     """Get daily usage for the current week (Monday-Sunday) with actual totals."""
+    device = await offload.run("db", verify_device_ownership, device_id, current_user.id, db)
+    offset_seconds = device.timezone_offset or 0
     cache_key = f"weekly_current:{device_id}"
-    cached = stats_cache.get(cache_key)
-    if cached is not None:
-        return cached
-    
-    verify_device_ownership(device_id, current_user.id, db)
     
-    now_utc = datetime.now(timezone.utc)
-    today_weekday = now_utc.weekday()
-    
-    monday = now_utc - timedelta(days=today_weekday)
-    monday = monday.replace(hour=0, minute=0, second=0, microsecond=0)
+    now_local = stats_service.device_local_now(offset_seconds)
+    monday = now_local - timedelta(days=now_local.weekday())
+    sunday = monday + timedelta(days=6)
+    
+    # Invalidated by ingest events, so the TTL only bounds the day rollover
+    return await stats_cache.get_or_compute(
+        cache_key,
+        _in_worker(db, _build_weekly_current, device_id, now_local, offset_seconds),
+        ttl=300, max_stale=_max_stale("weekly_current"), device_id=device_id,
+        window=stats_service.local_days_window(
+            monday.strftime('%Y-%m-%d'), sunday.strftime('%Y-%m-%d'), offset_seconds
+        )
+    )
+
+
+def _build_weekly_current(db: Session, device_id: int, now_local: datetime, offset_seconds: int) -> list:
+    """Current Monday-Sunday totals (runs in a worker thread)."""
+    today_weekday = now_local.weekday()
+    monday = now_local - timedelta(days=today_weekday)
+    sunday = monday + timedelta(days=6)
+    series = stats_service.get_daily_usage_series(
+        db, device_id, monday.strftime('%Y-%m-%d'), sunday.strftime('%Y-%m-%d'), offset_seconds
+    )
     
     results = []
     for day_idx in range(7):
-        day = monday + timedelta(days=day_idx)
-        day_str = day.strftime('%Y-%m-%d')
-        day_end = day + timedelta(days=1)
-        
-        day_minutes = stats_service.calculate_day_usage_range(db, device_id, day, day_end)
+        day_str = (monday + timedelta(days=day_idx)).strftime('%Y-%m-%d')
+        day_minutes = series[day_str]["minutes"] if day_str in series else 0
         total_seconds = day_minutes * 60
         
         results.append({
@@ -240,8 +258,6 @@ async def get_weekly_current(
             "is_today": day_idx == today_weekday,
             "is_future": day_idx > today_weekday
         })
-    
-    stats_cache.set(cache_key, results, ttl=60)
     return results
 
 
@@ -256,17 +272,33 @@ async def get_app_details(
     """Get detailed analysis of a specific application's usage."""
     days = min(days, 30)
     
-    device = verify_device_ownership(device_id, current_user.id, db)
+    device = await offload.run("db", verify_device_ownership, device_id, current_user.id, db)
     offset_seconds = device.timezone_offset or 0
     cache_key = f"app_details:{device_id}:{app_name}:{days}:{offset_seconds}"
-    cached = stats_cache.get(cache_key)
-    if cached is not None:
-        return cached
-    
-    now_utc = datetime.now(timezone.utc)
-    start_date = now_utc - timedelta(days=days)
-    start_str = start_date.strftime('%Y-%m-%d')
+    start_str = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d')
+    day_strs = stats_service.local_day_strings(offset_seconds, days)
+    window_start = min(
+        stats_service.day_range_utc(start_str, 0)[0],
+        stats_service.day_range_utc(day_strs[0], offset_seconds)[0]
+    )
     
+    return await stats_cache.get_or_compute(
+        cache_key,
+        _in_worker(db, _build_app_details, device_id, app_name, days, start_str, day_strs, offset_seconds),
+        ttl=300, max_stale=_max_stale("app_details"), device_id=device_id, window=(window_start, None)
+    )
+
+
+def _build_app_details(
+    db: Session,
+    device_id: int,
+    app_name: str,
+    days: int,
+    start_str: str,
+    day_strs: list,
+    offset_seconds: int
+) -> dict:
+    """App detail response (runs in a worker thread)."""
     app_names = stats_service.get_app_name_variants(app_name)
     
     # Total stats
@@ -280,16 +312,16 @@ async def get_app_details(
         db, device_id, app_names, start_str, offset_seconds
     )
     
-    # Daily breakdown
-    usage_by_day = []
-    for i in range(days):
-        day = now_utc - timedelta(days=i)
-        day_str = day.strftime('%Y-%m-%d')
-        day_duration = stats_service.get_app_day_duration(db, device_id, app_names, day_str)
-        usage_by_day.append({"date": day_str, "duration_seconds": int(day_duration)})
-    usage_by_day.reverse()
+    # Daily breakdown (one grouped query)
+    series = stats_service.get_app_daily_series(
+        db, device_id, app_names, day_strs[0], day_strs[-1], offset_seconds
+    )
+    usage_by_day = [
+        {"date": day_str, "duration_seconds": series[day_str]["total_seconds"] if day_str in series else 0}
+        for day_str in day_strs
+    ]
     
-    response = {
+    return {
         "app_name": app_name,
         "friendly_name": app_filter.get_friendly_name(app_name),
         "category": app_filter.get_category(app_name),
@@ -302,9 +334,6 @@ async def get_app_details(
         "usage_by_day": usage_by_day,
         "days_analyzed": days
     }
-    
-    stats_cache.set(cache_key, response, ttl=300)
-    return response
 
 
 @router.get("/device/{device_id}/app-trends")
@@ -318,36 +347,31 @@ async def get_app_trends(
     """Get usage trends for a specific application over time."""
     days = min(days, 60)
     
+    device = await offload.run("db", verify_device_ownership, device_id, current_user.id, db)
+    offset_seconds = device.timezone_offset or 0
     cache_key = f"app_trends:{device_id}:{app_name}:{days}"
-    cached = stats_cache.get(cache_key)
-    if cached is not None:
-        return cached
-    
-    verify_device_ownership(device_id, current_user.id, db)
+    day_strs = stats_service.local_day_strings(offset_seconds, days)
     
-    now_utc = datetime.now(timezone.utc)
+    return await stats_cache.get_or_compute(
+        cache_key,
+        _in_worker(db, _build_app_trends, device_id, app_name, day_strs, offset_seconds),
+        ttl=300, max_stale=_max_stale("app_trends"), device_id=device_id,
+        window=stats_service.local_days_window(day_strs[0], day_strs[-1], offset_seconds)
+    )
+
+
+def _build_app_trends(db: Session, device_id: int, app_name: str, day_strs: list, offset_seconds: int) -> list:
+    """Per-day usage of one app (runs in a worker thread)."""
     app_names = stats_service.get_app_name_variants(app_name)
+    series = stats_service.get_app_daily_series(
+        db, device_id, app_names, day_strs[0], day_strs[-1], offset_seconds
+    )
     
     results = []
-    for i in range(days):
-        day = now_utc - timedelta(days=i)
-        day_str = day.strftime('%Y-%m-%d')
-        
-        day_start, day_end = day_range_utc(day_str)
-        stats = db.query(
-            func.sum(UsageLog.duration).label('total_duration'),
-            func.count(UsageLog.id).label('sessions_count'),
-            func.min(UsageLog.timestamp).label('first_use'),
-            func.max(UsageLog.timestamp).label('last_use')
-        ).filter(
-            UsageLog.device_id == device_id,
-            func.lower(UsageLog.app_name).in_(app_names),
-            UsageLog.timestamp >= day_start,
-            UsageLog.timestamp < day_end
-        ).first()
-        
-        duration = int(stats.total_duration or 0)
-        sessions = int(stats.sessions_count or 0)
+    for day_str in day_strs:
+        day = series.get(day_str)
+        duration = day["total_seconds"] if day else 0
+        sessions = day["sessions_count"] if day else 0
         avg_session = int(duration / sessions) if sessions > 0 else 0
         
         results.append({
@@ -356,10 +380,7 @@ async def get_app_trends(
             "duration_minutes": round(duration / 60, 1),
             "sessions_count": sessions,
             "avg_session_duration": avg_session,
-            "first_use": stats_service.format_timestamp_to_time(stats.first_use),
-            "last_use": stats_service.format_timestamp_to_time(stats.last_use)
+            "first_use": stats_service.format_local_time(day["first_activity"], offset_seconds) if day else None,
+            "last_use": stats_service.format_local_time(day["last_activity"], offset_seconds) if day else None
         })
-    
-    results.reverse()
-    stats_cache.set(cache_key, results, ttl=300)
     return results
@@ -5,18 +5,21 @@ Thin API layer - business logic is in services/summary_service.py
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from datetime import datetime, timedelta, timezone
 import logging
 
 from ...database import get_db
-from ...models import UsageLog, Device, User, Rule
+from ...models import Device, User, Rule
 from ...api.auth import get_current_parent
 from ...services.app_filter import app_filter
 from ...services import summary_service
+from ...cache import stats_cache
+from ...offload import offload
+from ...heartbeat import heartbeat_store
 
 # Import running_processes_cache from sibling module
 from .device_endpoints import running_processes_cache
+from .stats_endpoints import _run_in_session
 
 router = APIRouter()
 logger = logging.getLogger("reports")
@@ -41,10 +44,7 @@ async def get_device_summary(
     logger.info(f"get_device_summary called for device_id={device_id}")
     
     # Verify device belongs to parent
-    device = db.query(Device).filter(
-        Device.id == device_id,
-        Device.parent_id == current_user.id
-    ).first()
+    device = await offload.run("db", _get_owned_device, db, device_id, current_user.id)
     
     if not device:
         raise HTTPException(
@@ -52,18 +52,38 @@ async def get_device_summary(
             detail="Device not found"
         )
     
+    heartbeat_store.overlay([device])
+    
+    # Not cached (live fields), but concurrent identical requests share one computation.
+    # It uses its own session: it keeps running for the others if this request is cancelled.
+    return await stats_cache.single_flight(
+        f"summary:{device_id}:{date or ''}",
+        lambda: offload.run("reports", _run_in_session, db.get_bind(), _compute_summary, device, device_id, date)
+    )
+
+
+def _get_owned_device(db: Session, device_id: int, parent_id: int):
+    return db.query(Device).filter(
+        Device.id == device_id,
+        Device.parent_id == parent_id
+    ).first()
+
+
+def _compute_summary(db: Session, device: Device, device_id: int, date: str = None) -> dict:
+    """Compute the summary response (runs in the reports offload pool)."""
     # Calculate time boundaries
     time_bounds = _calculate_time_boundaries(device, date)
     
-    # Get precise usage
-    today_usage, elapsed_today_seconds = summary_service.calculate_precise_usage(
+    # One fetch of the day's usage rows, shared by all sub-computations
+    day_logs = summary_service.fetch_day_logs(
         db, device_id, time_bounds['today_start_utc'], time_bounds['today_end_utc']
     )
     
+    # Get precise usage
+    today_usage, elapsed_today_seconds = summary_service.calculate_precise_usage(day_logs)
+    
     # Get top apps and apply consistency check
-    top_apps_query = _get_top_apps_query(
-        db, device_id, time_bounds['today_start_utc'], time_bounds['today_end_utc']
-    )
+    top_apps_query = summary_service.get_top_apps(day_logs)
     
     # Consistency check
     if top_apps_query:
@@ -80,7 +100,8 @@ async def get_device_summary(
         time_bounds=time_bounds,
         today_usage=today_usage,
         elapsed_today_seconds=elapsed_today_seconds,
-        top_apps_query=top_apps_query
+        top_apps_query=top_apps_query,
+        day_logs=day_logs
     )
 
 
@@ -111,27 +132,11 @@ def _calculate_time_boundaries(device: Device, date: str = None) -> dict:
         'today_start_utc': today_start_utc,
         'today_end_utc': today_end_utc,
         'today_str': today_str,
-        'yesterday_start_utc': today_start_utc - timedelta(days=1),
-        'yesterday_end_utc': today_start_utc,
         'is_historical': is_historical,
         'offset_seconds': offset_seconds
     }
 
 
-def _get_top_apps_query(db: Session, device_id: int, start_utc: datetime, end_utc: datetime):
-    """Get top apps by usage duration."""
-    return db.query(
-        UsageLog.app_name,
-        func.sum(UsageLog.duration).label('total_duration')
-    ).filter(
-        UsageLog.device_id == device_id,
-        UsageLog.timestamp >= start_utc,
-        UsageLog.timestamp < end_utc
-    ).group_by(UsageLog.app_name).order_by(
-        func.sum(UsageLog.duration).desc()
-    ).limit(100).all()
-
-
 def _build_summary_response(
     db: Session,
     device: Device,
@@ -139,12 +144,11 @@ def _build_summary_response(
     time_bounds: dict,
     today_usage: int,
     elapsed_today_seconds: int,
-    top_apps_query
+    top_apps_query,
+    day_logs
 ) -> dict:
     """Build the complete summary response."""
     
-    start_utc = time_bounds['today_start_utc']
-    end_utc = time_bounds['today_end_utc']
     is_historical = time_bounds['is_historical']
     offset_seconds = time_bounds['offset_seconds']
     
@@ -152,28 +156,29 @@ def _build_summary_response(
     first_report_iso = _get_first_report_iso(device, time_bounds)
     
     # Window titles
-    latest_titles = summary_service.get_latest_window_titles(db, device_id, start_utc, end_utc)
+    latest_titles = summary_service.get_latest_window_titles(day_logs)
     
-    # Stats
+    # Stats (enabled rules fetched once, split by type below)
+    rules = db.query(Rule).filter(Rule.device_id == device_id, Rule.enabled == True).all()
     apps_today = len(set(log.app_name for log in top_apps_query))
-    active_rules = db.query(Rule).filter(Rule.device_id == device_id, Rule.enabled == True).count()
-    total_usage_all = db.query(func.sum(UsageLog.duration)).filter(UsageLog.device_id == device_id).scalar() or 0
-    last_usage = db.query(func.max(UsageLog.timestamp)).filter(UsageLog.device_id == device_id).scalar()
+    active_rules = len(rules)
+    total_usage_all, last_usage = summary_service.get_usage_totals(db, device_id)
     
-    # Historical comparisons
-    yesterday_usage = summary_service.calculate_day_usage(
-        db, device_id, time_bounds['yesterday_start_utc'], time_bounds['yesterday_end_utc']
+    # Historical comparisons (one grouped query for the previous 7 days)
+    history = summary_service.get_week_history(
+        db, device_id, time_bounds['today_str'], offset_seconds
     )
-    week_avg = summary_service.calculate_week_average(db, device_id, start_utc)
+    yesterday_usage = summary_service.calculate_yesterday_usage(history, time_bounds['today_str'])
+    week_avg = summary_service.calculate_week_average(history)
     
     # Rules and limits
-    apps_with_limits = summary_service.get_apps_with_limits(db, device_id, start_utc, end_utc)
-    daily_limit_info = summary_service.get_daily_limit_info(db, device_id, today_usage)
-    active_schedules = summary_service.get_active_schedules(db, device_id)
+    apps_with_limits = summary_service.get_apps_with_limits(rules, day_logs)
+    daily_limit_info = summary_service.get_daily_limit_info(rules, today_usage)
+    active_schedules = summary_service.get_active_schedules(rules)
     
     # Smart Insights
     insights = summary_service.calculate_smart_insights(
-        db, device_id, start_utc, end_utc, today_usage, apps_with_limits
+        day_logs, history, today_usage, apps_with_limits
     )
     
     # Running processes (only for today)
@@ -213,7 +218,7 @@ def _build_summary_response(
         "insights": insights,
         "running_processes": running_processes,
         "running_processes_updated": running_processes_updated.isoformat() if running_processes_updated else None,
-        "activity_timeline": summary_service.get_activity_timeline(db, device_id, start_utc, end_utc)
+        "activity_timeline": summary_service.get_activity_timeline(day_logs)
     }
 
 
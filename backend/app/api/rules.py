@@ -1,18 +1,29 @@
 """Rules management endpoints."""
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from pydantic_core import to_json
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session, contains_eager
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Tuple
 import logging
-from ..database import get_db
-from ..models import Rule, Device, User
-from ..schemas import RuleCreate, RuleResponse, AgentRulesRequest, AgentRulesResponse
+from ..database import get_db, get_async_db, AsyncDb
+from ..models import Rule, Device, User, UsageLog
+from ..schemas import (
+    RuleCreate, RuleResponse, RuleBulkRequest, RuleBulkResponse, AgentRulesRequest, AgentRulesResponse
+)
 from ..api.auth import get_current_parent
 from ..api.devices.utils import verify_device_api_key
-from ..api.websocket import send_command_to_device
+from ..db_utils import minute_bucket
+from ..api.websocket import push_rules_to_device
+from ..services.rule_snapshot_service import rule_snapshots
+from ..services.rule_version_service import bump_rules_version, bump_rules_versions, get_rules_version
+from ..services.today_usage_service import today_usage
 
 router = APIRouter()
 logger = logging.getLogger("rules")
 
+MAX_BULK_RULES = 1000  # upserts + deletes per bulk request
+
 
 @router.post("/", response_model=RuleResponse, status_code=status.HTTP_201_CREATED)
 async def create_rule(
@@ -74,25 +85,152 @@ async def create_rule(
         logger.info(f"Updating existing rule id={existing_rule.id}: type={rule_data.rule_type}, app={rule_data.app_name}, time_limit={rule_data.time_limit}")
         for key, value in rule_data.dict().items():
             setattr(existing_rule, key, value)
+        bump_rules_version(db, device.id)
         
         db.commit()
         db.refresh(existing_rule)
         logger.info(f"Rule updated successfully: id={existing_rule.id}")
-        # Notify agent
-        await send_command_to_device(device.device_id, "REFRESH_RULES")
+        # Push the new rule set to the agent
+        await push_rules_to_device(db, device)
         return existing_rule
 
     new_rule = Rule(**rule_data.dict())
     db.add(new_rule)
+    bump_rules_version(db, device.id)
     db.commit()
     db.refresh(new_rule)
     
     logger.info(f"Created new rule: id={new_rule.id}, type={new_rule.rule_type}, device_id={new_rule.device_id}, app={new_rule.app_name}, time_limit={new_rule.time_limit}")
-    # Notify agent
-    await send_command_to_device(device.device_id, "REFRESH_RULES")
+    # Push the new rule set to the agent
+    await push_rules_to_device(db, device)
     return new_rule
 
 
+def _upsert_key(rule_data: RuleCreate) -> Optional[Tuple]:
+    """Which existing rule create_rule() overwrites; None = always a new rule (device schedules)."""
+    if rule_data.app_name:
+        return ("app", rule_data.device_id, rule_data.rule_type, rule_data.app_name)
+    if rule_data.website_url:
+        return ("web", rule_data.device_id, rule_data.rule_type, rule_data.website_url)
+    if rule_data.rule_type == "schedule":
+        return None
+    return ("device", rule_data.device_id, rule_data.rule_type)
+
+
+def _existing_keys(rule: Rule) -> List[Tuple]:
+    """Upsert keys an existing rule answers to (see _upsert_key)."""
+    keys = []
+    if rule.app_name:
+        keys.append(("app", rule.device_id, rule.rule_type, rule.app_name))
+    if rule.website_url:
+        keys.append(("web", rule.device_id, rule.rule_type, rule.website_url))
+    if rule.app_name is None and rule.website_url is None:
+        keys.append(("device", rule.device_id, rule.rule_type))
+    return keys
+
+
+@router.post("/bulk", response_model=RuleBulkResponse)
+async def bulk_rules(
+    request: RuleBulkRequest,
+    current_user: User = Depends(get_current_parent),
+    db: Session = Depends(get_db)
+):
+    """
+    Upsert and delete rules on several devices in one transaction.
+
+    Upserts overwrite the same rules as POST /api/rules/ would, deletes are
+    applied first. Every affected device gets one version bump and, after
+    the single commit, one push.
+    """
+    if len(request.upsert) + len(request.delete) > MAX_BULK_RULES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BULK_RULES} rules per request"
+        )
+
+    device_ids = {rule_data.device_id for rule_data in request.upsert}
+    devices = {}
+    if device_ids:
+        devices = {
+            device.id: device for device in db.query(Device).filter(
+                Device.id.in_(device_ids),
+                Device.parent_id == current_user.id
+            )
+        }
+    if len(devices) != len(device_ids):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Device not found"
+        )
+
+    # Rules to match upserts against and rules to delete, in one query
+    delete_ids = set(request.delete)
+    conditions = []
+    if device_ids:
+        conditions.append(Rule.device_id.in_(device_ids))
+    if delete_ids:
+        conditions.append(Rule.id.in_(delete_ids))
+    rules = []
+    if conditions:
+        rules = db.query(Rule).join(Rule.device).options(contains_eager(Rule.device)).filter(
+            Device.parent_id == current_user.id,
+            or_(*conditions)
+        ).order_by(Rule.id).all()
+
+    to_delete = [rule for rule in rules if rule.id in delete_ids]
+    if len(to_delete) != len(delete_ids):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Rule not found"
+        )
+
+    affected = dict(devices)
+    for rule in to_delete:
+        affected[rule.device_id] = rule.device
+        db.delete(rule)
+
+    existing = {}
+    for rule in rules:
+        if rule.id not in delete_ids:
+            for key in _existing_keys(rule):
+                existing.setdefault(key, rule)
+
+    upserted = []
+    created = 0
+    for rule_data in request.upsert:
+        key = _upsert_key(rule_data)
+        rule = existing.get(key) if key else None
+        if rule is not None:
+            for field, value in rule_data.model_dump().items():
+                setattr(rule, field, value)
+        else:
+            rule = Rule(**rule_data.model_dump())
+            db.add(rule)
+            created += 1
+            if key:
+                # A later entry with the same key updates this one, as sequential creates would
+                existing[key] = rule
+        upserted.append(rule)
+
+    bump_rules_versions(db, affected)
+    db.flush()
+    rule_ids = [rule.id for rule in upserted]
+    db.commit()
+
+    # Reload the expired rules and devices with one query each, not per object
+    if rule_ids:
+        db.query(Rule).filter(Rule.id.in_(rule_ids)).all()
+    if affected:
+        db.query(Device).filter(Device.id.in_(affected)).all()
+
+    logger.info(f"Bulk rules: {created} created, {len(upserted) - created} updated, "
+                f"{len(delete_ids)} deleted on {len(affected)} devices")
+    for device_id in sorted(affected):
+        await push_rules_to_device(db, affected[device_id])
+
+    return {"rules": upserted, "deleted": sorted(delete_ids), "devices": sorted(affected)}
+
+
 @router.get("/device/{device_id}", response_model=List[RuleResponse])
 async def get_device_rules(
     device_id: int,
@@ -160,15 +298,23 @@ async def update_rule(
             detail="Rule not found"
         )
     
+    previous_device_id = rule.device_id
     for key, value in rule_data.dict().items():
         setattr(rule, key, value)
+    bump_rules_version(db, previous_device_id)
+    if rule.device_id != previous_device_id:
+        bump_rules_version(db, rule.device_id)
     
     db.commit()
     db.refresh(rule)
     
-    # Notify agent
+    # Push the new rule set to the agent (and the previous one if the rule moved)
     if rule.device:
-        await send_command_to_device(rule.device.device_id, "REFRESH_RULES")
+        await push_rules_to_device(db, rule.device)
+    if rule.device_id != previous_device_id:
+        previous_device = db.get(Device, previous_device_id)
+        if previous_device:
+            await push_rules_to_device(db, previous_device)
 
     return rule
 
@@ -191,15 +337,16 @@ async def delete_rule(
             detail="Rule not found"
         )
     
-    # Save device_id before deletion to notify agent after commit
-    device_id_for_agent = rule.device.device_id if rule.device else None
+    # Keep the device to notify its agent after commit
+    device = rule.device
     
+    bump_rules_version(db, rule.device_id)
     db.delete(rule)
     db.commit()
     
-    # Notify agent
-    if device_id_for_agent:
-        await send_command_to_device(device_id_for_agent, "REFRESH_RULES")
+    # Push the new rule set to the agent
+    if device:
+        await push_rules_to_device(db, device)
 
     return None
 
@@ -208,46 +355,46 @@ async def delete_rule(
 @router.post("/agent/fetch", response_model=AgentRulesResponse)
 async def agent_fetch_rules(
     request: AgentRulesRequest,
-    db: Session = Depends(get_db)
+    db: AsyncDb = Depends(get_async_db)
 ):
-    """Agent endpoint to fetch rules for device."""
+    """Agent endpoint to fetch rules for device.
+
+    The body is assembled from the device's precompiled rule snapshot
+    (already JSON) instead of going through response_model validation.
+    """
+    body = await db.run(_build_agent_rules, request)
+    return Response(content=body, media_type="application/json")
+
+
+def _build_agent_rules(db: Session, request: AgentRulesRequest) -> bytes:
+    """Rules and today's usage for the agent as JSON (runs off the event loop via AsyncDb)."""
     device = verify_device_api_key(request.device_id, request.api_key, db)
-    db.commit()  # Persist last_seen update from verify_device_api_key
-    
-    rules_db = db.query(Rule).filter(
-        Rule.device_id == device.id,
-        Rule.enabled == True
-    ).all()
-    
-    # Debug: Log what rules are returned to agent
-    time_limit_rules = [r for r in rules_db if r.rule_type == "time_limit"]
-    logger.info(f"Agent fetch for device_id={device.device_id} (db_id={device.id}): {len(rules_db)} total rules, {len(time_limit_rules)} time_limit rules")
-    for r in time_limit_rules:
-        logger.info(f"  - TIME_LIMIT: app={r.app_name}, limit={r.time_limit}min, enabled={r.enabled}")
+    version = get_rules_version(db, device.id)
+    unchanged = request.known_version is not None and request.known_version == version
 
-    # Pre-process rules to fix schedule format for agent (expand '0-6' to '0,1,2...')
-    rules = []
-    for r in rules_db:
-        # Pydantic v2 uses model_validate, fallback to from_orm if needed
-        try:
-            rule_model = RuleResponse.model_validate(r)
-        except AttributeError:
-            rule_model = RuleResponse.from_orm(r)
-
-        if rule_model.schedule_days and '-' in rule_model.schedule_days and ',' not in rule_model.schedule_days:
-            try:
-                parts = rule_model.schedule_days.split('-')
-                if len(parts) == 2:
-                    start, end = int(parts[0]), int(parts[1])
-                    if start <= end:
-                        rule_model.schedule_days = ",".join(str(i) for i in range(start, end + 1))
-            except (ValueError, TypeError):
-                pass
-        rules.append(rule_model)
-    
+    daily_usage, usage_by_app = _today_usage(db, device)
+    # Unchanged: the agent keeps its cached rules, only usage and time are refreshed
+    rules_json = b"[]" if unchanged else rule_snapshots.get(db, device, version).rules_json
+    rest = to_json({
+        "daily_usage": daily_usage,
+        "usage_by_app": usage_by_app,
+        "server_time": datetime.now(timezone.utc),
+        "settings_protection": device.settings_protection or "full",
+        "settings_exceptions": device.settings_exceptions,
+        "rules_version": version,
+        "unchanged": unchanged
+    })
+    return b'{"rules":' + rules_json + b"," + rest[1:]
+
+
+def _today_usage(db: Session, device: Device) -> Tuple[int, Dict[str, int]]:
+    """(daily_usage seconds, usage_by_app) for the device's current local day."""
+    if today_usage.enabled:
+        return today_usage.get(db, device)
+
+    # Several workers: no shared accumulator, query usage_logs
     # Calculate daily usage as COUNT of unique MINUTES (truncated to minute level)
     # This ensures all apps logged in same minute count as 1 minute, not N
-    from datetime import datetime, timezone, timedelta
     
     # Calculate "Today" based on DEVICE'S local time
     # This aligns backend limits with agent's local daily reset
@@ -263,10 +410,6 @@ async def agent_fetch_rules(
     # If DB stores naive UTC, we need naive query_start_utc.
     # reporter.py sends datetime.utcnow(), so it's naive UTC.
     query_start_utc = query_start_utc.replace(tzinfo=None)
-    
-    from ..models import UsageLog
-    from sqlalchemy import func
-    from ..db_utils import minute_bucket
 
     # Count unique report minutes - truncate timestamp to minute level
     unique_minutes = db.query(
@@ -289,13 +432,4 @@ async def agent_fetch_rules(
     ).group_by(UsageLog.app_name).all()
     
     usage_by_app = {row[0]: row[1] for row in usage_by_app_rows}
-    
-    return {
-        "rules": rules,
-        "daily_usage": int(total_usage),
-        "usage_by_app": usage_by_app,
-        "server_time": datetime.now(timezone.utc),
-        "settings_protection": device.settings_protection or "full",
-        "settings_exceptions": device.settings_exceptions
-    }
-
+    return int(total_usage), usage_by_app
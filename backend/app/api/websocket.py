@@ -1,10 +1,14 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from typing import Dict, List
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from typing import Dict, FrozenSet, List
 import json
 from ..api.auth import get_current_user
 from ..models import User
-from ..database import get_db
+from ..database import run_db
 from sqlalchemy.orm import Session
+from ..heartbeat import heartbeat_store
+from ..state_backend import get_state_backend
+from ..offload import offload
+from ..services.rule_snapshot_service import build_rules_push
 import logging
 from datetime import datetime, timezone
 
@@ -14,22 +18,31 @@ logger = logging.getLogger(__name__)
 # A device with invalid or expired API key may retry very frequently (e.g. every second),
 # which would flood the log with "WS Auth Failed" and "connection closed" lines.
 # We log at most once per device per interval so the issue is still visible without
-# filling the log.
-_ws_auth_fail_last: Dict[str, float] = {}
+# filling the log. The marker lives in the state backend so that with several
+# workers the interval holds across all of them.
+_WS_AUTH_FAIL_NAMESPACE = "ws_auth_fail"
 _WS_AUTH_FAIL_LOG_INTERVAL = 60.0  # seconds
 
 
 def _should_log_auth_fail(device_id: str) -> bool:
-    now = datetime.now(timezone.utc).timestamp()
-    last = _ws_auth_fail_last.get(device_id, 0)
-    if now - last >= _WS_AUTH_FAIL_LOG_INTERVAL:
-        _ws_auth_fail_last[device_id] = now
-        return True
-    return False
+    # Set only if absent/expired: True once per device per interval
+    return get_state_backend().add(
+        _WS_AUTH_FAIL_NAMESPACE, device_id, datetime.now(timezone.utc).timestamp(),
+        ttl=_WS_AUTH_FAIL_LOG_INTERVAL
+    )
+
+# Optional agent capabilities, announced in the X-Agent-Features header on connect
+FEATURE_RULES_PUSH = "rules-push"  # applies {"type": "rules"} messages without a fetch
+FEATURE_RULES_DELTA = "rules-delta"  # ...including base_version / upsert / remove deltas
 
 router = APIRouter()
 
 
+def parse_agent_features(value: str) -> FrozenSet[str]:
+    """'rules-push, rules-delta' -> {'rules-push', 'rules-delta'}"""
+    return frozenset(f.strip().lower() for f in (value or "").split(",") if f.strip())
+
+
 class ConnectionManager:
     """Manages WebSocket connections."""
     
@@ -37,6 +50,7 @@ class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[int, List[WebSocket]] = {}  # user_id -> list of websockets
         self.active_device_connections: Dict[str, WebSocket] = {} # device_id (str/UUID) -> websocket
+        self.device_features: Dict[str, FrozenSet[str]] = {}  # device_id -> announced features
 
     async def connect(self, websocket: WebSocket, user_id: int):
         """Connect a WebSocket for a user."""
@@ -45,12 +59,13 @@ class ConnectionManager:
             self.active_connections[user_id] = []
         self.active_connections[user_id].append(websocket)
     
-    async def connect_device(self, websocket: WebSocket, device_id: str):
+    async def connect_device(self, websocket: WebSocket, device_id: str, features: FrozenSet[str] = frozenset()):
         """Connect a WebSocket for a device."""
         await websocket.accept()
         # Ensure only one connection per device? Or kick old one?
         # For now, overwrite
         self.active_device_connections[device_id] = websocket
+        self.device_features[device_id] = features
         if device_id:
              print(f"Device {device_id[:8]}... connected via WebSocket")
 
@@ -64,6 +79,7 @@ class ConnectionManager:
                 
     def disconnect_device(self, device_id: str):
         """Disconnect a device."""
+        self.device_features.pop(device_id, None)
         if device_id in self.active_device_connections:
             del self.active_device_connections[device_id]
             print(f"Device {device_id[:8]}... disconnected")
@@ -95,6 +111,22 @@ class ConnectionManager:
                 return False
         return False
     
+    def supports(self, device_id: str, feature: str) -> bool:
+        """Whether the device's current connection announced a feature."""
+        return feature in self.device_features.get(str(device_id), ())
+
+    async def send_text_to_device(self, text: str, device_id: str) -> bool:
+        """Send a pre-serialized JSON message to a device. Returns True if sent."""
+        did = str(device_id)
+        if did in self.active_device_connections:
+            try:
+                await self.active_device_connections[did].send_text(text)
+                return True
+            except:
+                self.disconnect_device(did)
+                return False
+        return False
+
     async def broadcast_to_user(self, message: dict, user_id: int):
         """Broadcast message to all connections of a user."""
         await self.send_personal_message(message, user_id)
@@ -125,8 +157,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
 async def websocket_device_endpoint(
     websocket: WebSocket, 
     device_id: str, 
-    api_key: str = None,
-    db: Session = Depends(get_db)
+    api_key: str = None
 ):
     """WebSocket endpoint for Device Agent.
     
@@ -146,13 +177,9 @@ async def websocket_device_endpoint(
         await websocket.close(code=4001, reason="API key required")
         return
     
-    # 1. Verify Device
-    from ..models import Device
-    
-    device = db.query(Device).filter(
-        Device.device_id == device_id,
-        Device.api_key == effective_api_key
-    ).first()
+    # 1. Verify Device (short-lived session, off the event loop - the
+    # connection then lives for hours and must not hold a DB connection)
+    device = await run_db(_authenticate_device, device_id, effective_api_key)
     
     if not device:
         if _should_log_auth_fail(device_id):
@@ -163,7 +190,8 @@ async def websocket_device_endpoint(
     logger.info(f"WS Auth Success: {device.name}")
 
     # 2. Accept & Connect
-    await manager.connect_device(websocket, device_id)
+    features = parse_agent_features(websocket.headers.get("x-agent-features", ""))
+    await manager.connect_device(websocket, device_id, features)
     
     try:
         while True:
@@ -174,39 +202,9 @@ async def websocket_device_endpoint(
             try:
                 msg = json.loads(data)
                 if msg.get("type") == "ping":
-                    # Update Last Seen (Real-time Online Status) with retry
-                    try:
-                        device.last_seen = datetime.now(timezone.utc)
-                        db.add(device)
-                        
-                        # Retry logika pro SQLite locked errors
-                        max_retries = 3
-                        delay = 0.05  # 50ms
-                        committed = False
-                        
-                        for attempt in range(max_retries):
-                            try:
-                                db.commit()
-                                committed = True
-                                break
-                            except Exception as commit_err:
-                                error_str = str(commit_err).lower()
-                                if ("locked" in error_str or "database is locked" in error_str) and attempt < max_retries - 1:
-                                    import time
-                                    wait_time = delay * (2 ** attempt)  # Exponential backoff: 50ms, 100ms, 200ms
-                                    logger.debug(f"Database locked on ping, retrying in {wait_time*1000:.0f}ms (attempt {attempt + 1}/{max_retries})")
-                                    time.sleep(wait_time)
-                                    continue
-                                raise
-                        
-                        if not committed:
-                            logger.warning("Failed to update last_seen after retries")
-                            db.rollback()
-                    except Exception as db_err:
-                        # Log but don't crash connection
-                        logger.error(f"Failed to update last_seen: {db_err}")
-                        db.rollback()
-                        
+                    # Update Last Seen (Real-time Online Status) in the in-memory
+                    # liveness table; persisted by the periodic heartbeat flush
+                    heartbeat_store.touch(device.id)
                     await websocket.send_json({"type": "pong"})
             except:
                 pass
@@ -217,6 +215,16 @@ async def websocket_device_endpoint(
         manager.disconnect_device(device_id)
 
 
+def _authenticate_device(db: Session, device_id: str, api_key: str):
+    """Row (id, name) of the device for valid credentials, else None."""
+    from ..models import Device
+    
+    return db.query(Device.id, Device.name).filter(
+        Device.device_id == device_id,
+        Device.api_key == api_key
+    ).first()
+
+
 async def notify_user(user_id: int, message: dict):
     """Helper function to notify a user via WebSocket."""
     await manager.broadcast_to_user(message, user_id)
@@ -227,3 +235,20 @@ async def send_command_to_device(device_id: str, command: str, payload: dict = N
     return await manager.send_to_device({"type": "command", "cmd": command, "payload": payload or {}}, str(device_id))
 
 
+
+
+async def push_rules_to_device(db: Session, device, fallback_command: str = "REFRESH_RULES") -> bool:
+    """
+    Send a device its current rule set after a change (call after commit).
+
+    Agents with the rules-push feature get the compiled rules (or a delta) in
+    the message and need no fetch; older agents get fallback_command and fetch
+    as before. Nothing is compiled when the device is not connected.
+    """
+    did = str(device.device_id)
+    if did not in manager.active_device_connections:
+        return False
+    if not manager.supports(did, FEATURE_RULES_PUSH):
+        return await send_command_to_device(did, fallback_command)
+    message = await offload.run("db", build_rules_push, db, device, manager.supports(did, FEATURE_RULES_DELTA))
+    return await manager.send_text_to_device(message, did)
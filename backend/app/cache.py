@@ -2,108 +2,596 @@
 
 This provides a lightweight in-memory cache to reduce database load
 for frequently accessed statistics endpoints. No external dependencies needed.
+
+Entries can be tagged with the device and the UTC time window they were
+computed from. Ingest publishes "device X got data for [since, until]"
+events (publish_data_changed) and only entries whose window overlaps are
+dropped, so windows that ended before the new data stay cached.
+
+With a shared state backend (STATE_BACKEND=sqlite, several workers) the
+in-process LRU stays the first tier; values are also written to the
+backend so other workers reuse them, and invalidations are replayed in
+every worker from the backend's event log.
 """
+import asyncio
 import time
 import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
 from functools import wraps
-from typing import Any, Dict, Optional, Callable
+from typing import Any, Awaitable, Dict, List, Optional, Callable, Set, Tuple
 import logging
 
+from .config import settings
+from .state_backend import StateBackend, get_state_backend
+
 logger = logging.getLogger(__name__)
 
+# (start, end) in UTC; end None = open-ended (up to now)
+CacheWindow = Tuple[datetime, Optional[datetime]]
+
+
+class _Entry:
+    """Cached value with its expiry and invalidation tags."""
+
+    __slots__ = ("value", "lifetime", "expires_at", "stale_until", "device_id", "window")
+
+    def __init__(
+        self,
+        value: Any,
+        lifetime: float,
+        expires_at: float,
+        stale_until: float,
+        device_id: Optional[int],
+        window: Optional[CacheWindow]
+    ):
+        self.value = value
+        self.lifetime = lifetime  # ttl + max_stale, selects the expiry queue
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.device_id = device_id
+        self.window = window
+
 
 class SimpleCache:
     """Thread-safe in-memory cache with TTL support.
     
     Designed for minimal resource usage:
     - No external dependencies (no Redis)
-    - Automatic cleanup of expired entries
-    - Thread-safe operations
+    - O(1) get/set: LRU order in an OrderedDict, full cache evicts the
+      least recently used entry
+    - Expiry queues per lifetime (a bucketed timer): entries with the same
+      TTL expire in insertion order, so expired entries are popped from the
+      queue fronts without scanning or sorting
+    - device_id -> keys index, so per-device invalidation does not scan
+    - Thread-safe operations, hit/miss/eviction counters in stats()
+    - get_or_compute(): single-flight - concurrent misses for one key
+      await a single computation (event loop side); with max_stale an
+      expired value is served while a background task refreshes it
+      (stale-while-revalidate)
+    - Optional shared second tier (backend with shared=True): a local miss
+      reads the backend, invalidations bump a per-device generation there
+      (so any change of a device retires its shared entries) and are
+      replayed in the other processes within sync_interval seconds
     """
     
-    def __init__(self, default_ttl: int = 300, max_size: int = 1000):
+    def __init__(
+        self,
+        default_ttl: int = 300,
+        max_size: int = 1000,
+        historical_ttl: int = 0,
+        backend: Optional[StateBackend] = None,
+        namespace: str = "stats",
+        sync_interval: float = 1.0
+    ):
         """
         Initialize cache.
         
         Args:
             default_ttl: Default time-to-live in seconds (5 minutes)
             max_size: Maximum number of cached items (prevents memory bloat)
+            historical_ttl: Minimum TTL for entries whose window already ended
+                (only new data for that window invalidates them); 0 = off
+            backend: State backend; only used when it is shared between processes
+            namespace: Backend namespace for values, generations and events
+            sync_interval: Max seconds between reads of other processes' invalidations
         """
-        self._cache: Dict[str, tuple] = {}
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._expiry: Dict[float, "OrderedDict[str, None]"] = {}
+        self._by_device: Dict[int, Set[str]] = {}
         self._lock = threading.Lock()
+        
+        # Single-flight: key -> task of the computation in progress (kept until done)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._refresh_tasks: Set[asyncio.Task] = set()
+        # Bumped on invalidation so in-flight results computed before it are not stored
+        self._generation = 0
+        self._device_generation: Dict[int, int] = {}
         self.default_ttl = default_ttl
         self.max_size = max_size
+        self.historical_ttl = historical_ttl
+        
+        # Shared tier
+        self._backend = backend if backend is not None and backend.shared else None
+        self._namespace = namespace
+        self._generation_ns = f"{namespace}:gen"
+        self._channel = f"{namespace}:invalidate"
+        self.sync_interval = sync_interval
+        self._sync_lock = threading.Lock()
+        self._next_sync = 0.0
+        self._event_id: Optional[int] = None
+        
+        # Counters
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+        self._coalesced = 0
+        self._stale_served = 0
+        self._refreshes = 0
+        self._shared_hits = 0
     
     def get(self, key: str) -> Optional[Any]:
         """Get value from cache if exists and not expired."""
+        value, fresh = self._lookup(key)
+        return value if fresh else None
+    
+    def _lookup(self, key: str) -> Tuple[Optional[Any], bool]:
+        """(value, fresh); an expired value still within its max_stale is returned with fresh=False."""
+        if self._backend is None:
+            return self._local_lookup(key)
+        self._sync()
+        value, fresh = self._local_lookup(key)
+        if not fresh:
+            shared_value, shared_fresh = self._shared_lookup(key)
+            if shared_value is not None and (shared_fresh or value is None):
+                return shared_value, shared_fresh
+        return value, fresh
+    
+    def _local_lookup(self, key: str) -> Tuple[Optional[Any], bool]:
         with self._lock:
-            if key in self._cache:
-                value, expires_at = self._cache[key]
-                if time.time() < expires_at:
+            entry = self._cache.get(key)
+            if entry is not None:
+                now = time.monotonic()
+                if now < entry.expires_at:
+                    self._cache.move_to_end(key)
+                    self._hits += 1
                     logger.debug(f"Cache HIT: {key}")
-                    return value
+                    return entry.value, True
+                if now < entry.stale_until:
+                    self._misses += 1
+                    logger.debug(f"Cache STALE: {key}")
+                    return entry.value, False
                 # Expired - remove it
-                del self._cache[key]
+                self._remove(key)
+                self._expirations += 1
                 logger.debug(f"Cache EXPIRED: {key}")
-        return None
+            self._misses += 1
+        return None, False
+    
+    def set(
+        self,
+        key: str,
+        value: Any,
+        ttl: int = None,
+        device_id: Optional[int] = None,
+        window: Optional[CacheWindow] = None,
+        max_stale: float = 0
+    ):
+        """
+        Set value in cache with TTL.
+        
+        device_id / window tag the entry for invalidate_window(); an entry
+        with a device but no window is dropped by any change on that device.
+        max_stale keeps the value after expiry for get_or_compute() to
+        serve while it refreshes.
+        """
+        self._set(key, value, ttl, device_id, window, max_stale)
+    
+    def _set(
+        self,
+        key: str,
+        value: Any,
+        ttl: Optional[int],
+        device_id: Optional[int],
+        window: Optional[CacheWindow],
+        max_stale: float,
+        shared_generation: Optional[Tuple[int, int]] = None
+    ):
+        ttl = ttl or self.default_ttl
+        if window is not None and window[1] is not None and self.historical_ttl:
+            if window[1] <= datetime.now(timezone.utc):
+                ttl = max(ttl, self.historical_ttl)
+        now = time.monotonic()
+        lifetime = ttl + max_stale
+        self._store_local(key, value, lifetime, now + ttl, now + lifetime, device_id, window)
+        if self._backend is not None:
+            self._shared_store(key, value, ttl, lifetime, device_id, window, shared_generation)
     
-    def set(self, key: str, value: Any, ttl: int = None):
-        """Set value in cache with TTL."""
+    def _store_local(
+        self,
+        key: str,
+        value: Any,
+        lifetime: float,
+        expires_at: float,
+        stale_until: float,
+        device_id: Optional[int],
+        window: Optional[CacheWindow]
+    ):
+        """Insert into the in-process tier (monotonic expiry times)."""
         with self._lock:
-            # Prevent unbounded growth
-            if len(self._cache) >= self.max_size:
-                self._cleanup_expired()
-                # If still too large, remove oldest 10%
-                if len(self._cache) >= self.max_size:
-                    self._evict_oldest(int(self.max_size * 0.1))
+            now = time.monotonic()
+            if key in self._cache:
+                self._remove(key)
+            else:
+                # Prevent unbounded growth
+                self._purge_expired(now)
+                while len(self._cache) >= self.max_size:
+                    oldest = next(iter(self._cache))
+                    self._remove(oldest)
+                    self._evictions += 1
             
-            self._cache[key] = (value, time.time() + (ttl or self.default_ttl))
+            self._cache[key] = _Entry(value, lifetime, expires_at, stale_until, device_id, window)
+            queue = self._expiry.get(lifetime)
+            if queue is None:
+                queue = self._expiry[lifetime] = OrderedDict()
+            queue[key] = None
+            if device_id is not None:
+                self._by_device.setdefault(device_id, set()).add(key)
             logger.debug(f"Cache SET: {key}")
     
     def delete(self, key: str):
         """Remove specific key from cache."""
+        self._delete_local(key)
+        if self._backend is not None:
+            try:
+                self._backend.delete(self._namespace, key)
+            except Exception as e:
+                logger.warning(f"Shared cache delete failed: {e}")
+            self._broadcast(("delete", key))
+    
+    def _delete_local(self, key: str):
         with self._lock:
             if key in self._cache:
-                del self._cache[key]
+                self._remove(key)
     
     def clear(self):
         """Clear entire cache."""
+        self._clear_local()
+        self._broadcast(("clear",))
+    
+    def _clear_local(self):
         with self._lock:
             self._cache.clear()
+            self._expiry.clear()
+            self._by_device.clear()
+            self._generation += 1
             logger.info("Cache cleared")
     
     def clear_pattern(self, pattern: str):
-        """Clear all keys matching a pattern (simple prefix match)."""
+        """Clear all keys matching a pattern (simple prefix match).
+        
+        Scans every key - per-device invalidation should use
+        invalidate_device() / invalidate_window() instead.
+        """
+        self._clear_pattern_local(pattern)
+        self._broadcast(("pattern", pattern))
+    
+    def _clear_pattern_local(self, pattern: str):
         with self._lock:
             keys_to_delete = [k for k in self._cache.keys() if k.startswith(pattern)]
             for key in keys_to_delete:
-                del self._cache[key]
+                self._remove(key)
             logger.debug(f"Cleared {len(keys_to_delete)} keys matching '{pattern}'")
     
-    def _cleanup_expired(self):
-        """Remove all expired entries (called within lock)."""
+    def invalidate_device(self, device_id: int) -> int:
+        """Drop every entry tagged with device_id. Returns number removed."""
+        removed = self._invalidate_device_local(device_id)
+        self._broadcast(("device", device_id), device_id)
+        return removed
+    
+    def _invalidate_device_local(self, device_id: int) -> int:
+        with self._lock:
+            self._bump_device(device_id)
+            keys = list(self._by_device.get(device_id, ()))
+            for key in keys:
+                self._remove(key)
+            self._invalidations += len(keys)
+            return len(keys)
+    
+    def invalidate_window(self, device_id: int, since: datetime, until: datetime) -> int:
+        """
+        Drop entries of a device whose window overlaps [since, until] (UTC).
+        
+        Returns number of entries removed.
+        """
+        removed = self._invalidate_window_local(device_id, since, until)
+        self._broadcast(("window", device_id, since, until), device_id)
+        return removed
+    
+    def _invalidate_window_local(self, device_id: int, since: datetime, until: datetime) -> int:
+        with self._lock:
+            self._bump_device(device_id)
+            keys_to_delete = []
+            for key in self._by_device.get(device_id, ()):
+                window = self._cache[key].window
+                if window is None or (window[0] <= until and (window[1] is None or since < window[1])):
+                    keys_to_delete.append(key)
+            for key in keys_to_delete:
+                self._remove(key)
+            self._invalidations += len(keys_to_delete)
+        if keys_to_delete:
+            logger.debug(f"Invalidated {len(keys_to_delete)} entries for device {device_id} ({since} - {until})")
+        return len(keys_to_delete)
+    
+    async def single_flight(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run compute() once for concurrent callers with the same key.
+        
+        compute() runs in a task owned by the cache and every caller,
+        including the one that started it, awaits that task (or its
+        exception). Cancelling a caller therefore never cancels the
+        computation the others are waiting for. Nothing is cached here.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self._coalesced += 1
+        else:
+            task = asyncio.get_running_loop().create_task(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish_flight(key, t))
+        return await asyncio.shield(task)
+    
+    def _finish_flight(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Retrieve the exception even if every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+    
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        ttl: int = None,
+        device_id: Optional[int] = None,
+        window: Optional[CacheWindow] = None,
+        max_stale: float = 0
+    ) -> Any:
+        """
+        Cached value for key, or the result of compute() stored with set().
+        
+        Concurrent misses are coalesced (single_flight). A result is not
+        stored if the device was invalidated while it was being computed.
+        
+        With max_stale, a value that expired less than max_stale seconds
+        ago is returned immediately and compute() runs in a background
+        task - it must not depend on request-scoped resources (DB session).
+        """
+        async def compute_and_store():
+            generation = self._current_generation(device_id)
+            result = await compute()
+            if result is not None and generation == self._current_generation(device_id):
+                self._set(key, result, ttl, device_id, window, max_stale, generation[2])
+            return result
+        
+        value, fresh = self._lookup(key)
+        if value is not None:
+            if not fresh:
+                self._stale_served += 1
+                self._refresh_in_background(key, compute_and_store)
+            return value
+        
+        return await self.single_flight(key, compute_and_store)
+    
+    def _refresh_in_background(self, key: str, compute: Callable[[], Awaitable[Any]]):
+        """Start one background recomputation of key (no-op if already in flight)."""
+        if key in self._inflight:
+            return
+        self._refreshes += 1
+        
+        async def refresh():
+            try:
+                await self.single_flight(key, compute)
+            except Exception as e:
+                logger.warning(f"Background refresh of {key} failed: {e}")
+        
+        task = asyncio.get_running_loop().create_task(refresh())
+        # Keep a reference until done (the loop holds tasks weakly)
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+    
+    def _current_generation(self, device_id: Optional[int]) -> Tuple[int, int, Optional[Tuple[int, int]]]:
+        shared = self._shared_generation(device_id) if self._backend is not None else None
+        return self._generation, self._device_generation.get(device_id, 0), shared
+    
+    # Shared tier
+    
+    def _shared_generation(self, device_id: Optional[int]) -> Optional[Tuple[int, int]]:
+        """(global, device) invalidation counters in the backend; None if unreadable."""
+        try:
+            device_generation = 0
+            if device_id is not None:
+                device_generation = self._backend.get(self._generation_ns, str(device_id), 0)
+            return self._backend.get(self._generation_ns, "*", 0), device_generation
+        except Exception as e:
+            logger.warning(f"Shared cache generation read failed: {e}")
+            return None
+    
+    def _shared_store(
+        self,
+        key: str,
+        value: Any,
+        ttl: float,
+        lifetime: float,
+        device_id: Optional[int],
+        window: Optional[CacheWindow],
+        generation: Optional[Tuple[int, int]]
+    ):
+        """Write an entry to the backend tagged with the generation it was computed at."""
+        if generation is None:
+            generation = self._shared_generation(device_id)
+            if generation is None:
+                return
+        now = time.time()
+        item = (value, device_id, window, lifetime, now + ttl, now + lifetime, generation)
+        try:
+            self._backend.set(self._namespace, key, item, ttl=lifetime)
+        except Exception as e:
+            logger.warning(f"Shared cache write of {key} failed: {e}")
+    
+    def _shared_lookup(self, key: str) -> Tuple[Optional[Any], bool]:
+        """Read key from the backend and copy it into the local tier; (value, fresh)."""
+        try:
+            item = self._backend.get(self._namespace, key)
+        except Exception as e:
+            logger.warning(f"Shared cache read of {key} failed: {e}")
+            return None, False
+        if item is None:
+            return None, False
+        value, device_id, window, lifetime, expires_at, stale_until, generation = item
+        if generation != self._shared_generation(device_id):
+            return None, False
         now = time.time()
-        expired_keys = [k for k, (_, exp) in self._cache.items() if now >= exp]
-        for key in expired_keys:
-            del self._cache[key]
+        if now >= stale_until:
+            return None, False
+        # Keep the original lifetime bucket; expiry times are checked per entry anyway
+        mono = time.monotonic()
+        self._store_local(key, value, lifetime, mono + expires_at - now, mono + stale_until - now, device_id, window)
+        self._shared_hits += 1
+        return value, now < expires_at
+    
+    def _broadcast(self, message: Tuple, device_id: Optional[int] = None):
+        """Retire shared entries (generation bump) and tell other processes to drop theirs."""
+        if self._backend is None:
+            return
+        try:
+            self._backend.incr(self._generation_ns, "*" if device_id is None else str(device_id))
+            self._backend.publish(self._channel, message)
+        except Exception as e:
+            logger.warning(f"Shared cache invalidation failed: {e}")
     
-    def _evict_oldest(self, count: int):
-        """Evict oldest entries (called within lock)."""
-        sorted_items = sorted(self._cache.items(), key=lambda x: x[1][1])
-        for key, _ in sorted_items[:count]:
-            del self._cache[key]
+    def _sync(self):
+        """Replay invalidations published by other processes (at most every sync_interval)."""
+        if time.monotonic() < self._next_sync or not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sync = time.monotonic() + self.sync_interval
+            self._event_id, messages = self._backend.poll(self._channel, self._event_id)
+        except Exception as e:
+            logger.warning(f"Shared cache sync failed: {e}")
+            return
+        finally:
+            self._sync_lock.release()
+        if messages is None:
+            logger.info("Missed shared cache invalidations, clearing local cache")
+            self._clear_local()
+            return
+        for message in messages:
+            kind = message[0]
+            if kind == "window":
+                self._invalidate_window_local(*message[1:])
+            elif kind == "device":
+                self._invalidate_device_local(message[1])
+            elif kind == "delete":
+                self._delete_local(message[1])
+            elif kind == "pattern":
+                self._clear_pattern_local(message[1])
+            else:
+                self._clear_local()
+    
+    def _bump_device(self, device_id: int):
+        """Mark device data as changed (called within lock)."""
+        self._device_generation[device_id] = self._device_generation.get(device_id, 0) + 1
+    
+    def _remove(self, key: str):
+        """Remove key with its expiry queue and device index entries (called within lock)."""
+        entry = self._cache.pop(key)
+        queue = self._expiry.get(entry.lifetime)
+        if queue is not None:
+            queue.pop(key, None)
+            if not queue:
+                del self._expiry[entry.lifetime]
+        if entry.device_id is not None:
+            keys = self._by_device.get(entry.device_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_device[entry.device_id]
+    
+    def _purge_expired(self, now: float):
+        """Remove entries whose expiry has passed (called within lock)."""
+        for queue in list(self._expiry.values()):
+            while queue:
+                key = next(iter(queue))
+                if self._cache[key].stale_until > now:
+                    break
+                self._remove(key)
+                self._expirations += 1
     
     @property
     def size(self) -> int:
         """Current number of items in cache."""
         return len(self._cache)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Size and hit/miss/eviction counters."""
+        lookups = self._hits + self._misses
+        return {
+            "size": len(self._cache),
+            "max_size": self.max_size,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_ratio": round(self._hits / lookups, 3) if lookups else 0.0,
+            "evictions": self._evictions,
+            "expirations": self._expirations,
+            "invalidations": self._invalidations,
+            "coalesced": self._coalesced,
+            "stale_served": self._stale_served,
+            "background_refreshes": self._refreshes,
+            "in_flight": len(self._inflight),
+            "backend": self._backend.name if self._backend is not None else "memory",
+            "shared_hits": self._shared_hits,
+        }
 
 
 # Global cache instances for different use cases
-stats_cache = SimpleCache(default_ttl=300, max_size=500)  # 5 min TTL for stats
+stats_cache = SimpleCache(
+    default_ttl=300,  # 5 min TTL for stats
+    max_size=500,
+    historical_ttl=settings.STATS_CACHE_HISTORICAL_TTL,
+    backend=get_state_backend(),
+    sync_interval=settings.STATE_SYNC_INTERVAL
+)
+
 
+# Ingest -> cache "data changed" events
+_data_changed_listeners: List[Callable[[int, datetime, datetime], Any]] = []
 
-def cache_response(ttl: int = 300, key_prefix: str = ""):
+
+def subscribe_data_changed(listener: Callable[[int, datetime, datetime], Any]):
+    """Register listener(device_id, since, until) for new usage data."""
+    _data_changed_listeners.append(listener)
+
+
+def publish_data_changed(device_id: int, since: datetime, until: datetime):
+    """
+    Announce committed usage data for a device between since and until (UTC).
+    
+    Called by the ingest paths after their transaction is committed.
+    """
+    for listener in list(_data_changed_listeners):
+        try:
+            listener(device_id, since, until)
+        except Exception as e:
+            logger.warning(f"Data changed listener failed: {e}")
+
+
+subscribe_data_changed(stats_cache.invalidate_window)
+
+
+def cache_response(ttl: int = 300, key_prefix: str = "", max_stale: float = 0):
     """
     Decorator to cache endpoint responses.
     
@@ -111,6 +599,9 @@ def cache_response(ttl: int = 300, key_prefix: str = ""):
         @cache_response(ttl=300, key_prefix="usage_by_hour")
         async def get_usage_by_hour(device_id: int, days: int, ...):
             ...
+    
+    max_stale > 0 re-runs the function in a background task after the
+    request finished - only use it when the function opens its own DB session.
     """
     def decorator(func: Callable):
         @wraps(func)
@@ -127,25 +618,19 @@ def cache_response(ttl: int = 300, key_prefix: str = ""):
             
             cache_key = ":".join(key_parts)
             
-            # Try to get from cache
-            cached = stats_cache.get(cache_key)
-            if cached is not None:
-                return cached
-            
-            # Execute function and cache result
-            result = await func(*args, **kwargs)
-            stats_cache.set(cache_key, result, ttl)
-            
-            return result
+            # Cached value, or one shared execution for concurrent misses
+            return await stats_cache.get_or_compute(
+                cache_key,
+                lambda: func(*args, **kwargs),
+                ttl,
+                device_id=device_id if isinstance(device_id, int) else None,
+                max_stale=max_stale
+            )
         return wrapper
     return decorator
 
 
 def invalidate_device_cache(device_id: int):
     """Invalidate all cached stats for a specific device."""
-    stats_cache.clear_pattern(f"usage_by_hour:{device_id}")
-    stats_cache.clear_pattern(f"usage_trends:{device_id}")
-    stats_cache.clear_pattern(f"weekly_pattern:{device_id}")
-    stats_cache.clear_pattern(f"app_details:{device_id}")
-    stats_cache.clear_pattern(f"app_trends:{device_id}")
-    logger.info(f"Invalidated cache for device {device_id}")
+    removed = stats_cache.invalidate_device(device_id)
+    logger.info(f"Invalidated cache for device {device_id} ({removed} entries)")
@@ -56,6 +56,18 @@ def _get_secret_key() -> str:
     )
     return generated_key
 
+def _parse_seconds_map(value: str) -> dict:
+    """Parse "name=seconds,name2=seconds" into {name: float}; bad items are skipped."""
+    result = {}
+    for item in value.split(","):
+        name, _, seconds = item.partition("=")
+        try:
+            result[name.strip()] = float(seconds)
+        except ValueError:
+            if item.strip():
+                logger.warning(f"Ignoring invalid entry '{item.strip()}'")
+    return result
+
 class Settings:
     """Application settings."""
     
@@ -91,6 +103,23 @@ class Settings:
     UPLOAD_DIR: str = os.path.join(_db_dir, "uploads")
 
     DATABASE_URL: str = os.getenv("DATABASE_URL", f"sqlite:///{_default_db_path}")
+    # Agent hot paths on the async driver (aiosqlite / asyncpg, see database.AsyncDb);
+    # off or driver missing = same code in worker threads
+    ASYNC_DB_ENABLED: bool = os.getenv("ASYNC_DB_ENABLED", "0").lower() in ("1", "true", "yes")
+    # Optional read replica for the statistics endpoints (empty = use DATABASE_URL)
+    DATABASE_READ_URL: str = os.getenv("DATABASE_READ_URL", "")
+    # Connection pool (server databases, e.g. PostgreSQL; SQLite keeps SQLAlchemy defaults)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds waiting for a connection
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, -1 = never
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+    # Log statements slower than this with their normalized SQL (0 = off)
+    SLOW_QUERY_MS: float = float(os.getenv("SLOW_QUERY_MS", "250"))
+    # Debug mode: X-DB-Queries / X-DB-Time-Ms headers on every response
+    DEBUG: bool = os.getenv("DEBUG", "0").lower() in ("1", "true", "yes")
+    # /api/internal/metrics: loopback clients always, others with "Authorization: Bearer <token>"
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
     
     # Server
     HOST: str = os.getenv("BACKEND_HOST", os.getenv("HOST", "0.0.0.0"))  # Listen on all interfaces
@@ -165,6 +194,51 @@ class Settings:
     # Pairing
     PAIRING_TOKEN_EXPIRE_MINUTES: int = 5
 
+    # Write-behind ingest queue (single DB writer task for usage rows)
+    WRITE_BEHIND_ENABLED: bool = os.getenv("WRITE_BEHIND_ENABLED", "1").lower() in ("1", "true", "yes")
+    WRITE_BEHIND_MAX_BATCH: int = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))  # rows; flush when reached
+    WRITE_BEHIND_FLUSH_INTERVAL: float = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))  # seconds
+    WRITE_BEHIND_MAX_QUEUE: int = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "50000"))  # rows; producers write inline above this
+    WRITE_BEHIND_MAX_ATTEMPTS: int = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "3"))  # failed flushes before a bad row is dropped
+
+    # Serve daily charts and hourly heatmaps from usage_daily_rollup / usage_hourly_rollup
+    USAGE_ROLLUP_ENABLED: bool = os.getenv("USAGE_ROLLUP_ENABLED", "1").lower() in ("1", "true", "yes")
+    # Check device_usage_totals against usage_logs and repair drift (0 = off)
+    USAGE_TOTALS_RECONCILE_INTERVAL: float = float(os.getenv("USAGE_TOTALS_RECONCILE_INTERVAL", str(6 * 3600)))  # seconds
+
+    # Stats cache: entries for windows that already ended are only dropped by new data for them
+    STATS_CACHE_HISTORICAL_TTL: int = int(os.getenv("STATS_CACHE_HISTORICAL_TTL", str(6 * 3600)))  # seconds
+    # Stale-while-revalidate: per endpoint, how long (s) after TTL expiry a cached
+    # stat may still be served while it refreshes in the background (missing / 0 = off)
+    STATS_MAX_STALE: dict = _parse_seconds_map(os.getenv(
+        "STATS_MAX_STALE",
+        "usage_by_hour=300,usage_trends=600,weekly_pattern=1800,weekly_current=300,app_details=600,app_trends=600"
+    ))
+
+    # Today's usage per device kept in memory for the agent rules fetch. Opt-in: each process
+    # only sees its own writes, so enable it only for a single worker (run_https.py and the
+    # Windows service do); ignored when WEB_CONCURRENCY > 1 or with a shared STATE_BACKEND
+    TODAY_USAGE_ENABLED: bool = os.getenv("TODAY_USAGE_ENABLED", "0").lower() in ("1", "true", "yes")
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", "1") or "1")
+    # Save on shutdown, restore / rebuild for all devices at startup (0 = each day loads on its first fetch)
+    TODAY_USAGE_PERSIST: bool = os.getenv("TODAY_USAGE_PERSIST", "1").lower() in ("1", "true", "yes")
+    TODAY_USAGE_SNAPSHOT_PATH: str = os.getenv("TODAY_USAGE_SNAPSHOT_PATH", os.path.join(_db_dir, "today_usage.json"))
+
+    # Heartbeat (last_seen) flush from the in-memory liveness table to devices
+    HEARTBEAT_FLUSH_INTERVAL: float = float(os.getenv("HEARTBEAT_FLUSH_INTERVAL", "60"))  # seconds
+
+    # Thread pools for blocking work from async endpoints (app/offload.py): "category=threads,..."
+    OFFLOAD_LIMITS: dict = {
+        name: int(threads) for name, threads in _parse_seconds_map(os.getenv("OFFLOAD_LIMITS", "")).items()
+    }
+
+    # State shared by worker processes (stats cache, running processes, rate limits):
+    # "memory" = per process (single worker), "sqlite" = file shared by the workers on one node
+    STATE_BACKEND: str = os.getenv("STATE_BACKEND", "memory").strip().lower()
+    STATE_BACKEND_PATH: str = os.getenv("STATE_BACKEND_PATH", os.path.join(_db_dir, "shared_state.db"))
+    # Max delay before a worker drops cache entries invalidated by another worker
+    STATE_SYNC_INTERVAL: float = float(os.getenv("STATE_SYNC_INTERVAL", "1.0"))  # seconds
+
 
 settings = Settings()
 
@@ -1,41 +1,147 @@
-"""Database initialization and session management."""
-from sqlalchemy import create_engine, event
+"""Database initialization and session management.
+
+get_db() yields a synchronous Session - every query made with it from an
+async endpoint blocks the event loop. Hot paths (agent ingest, rules
+fetch, WebSocket auth) use get_async_db() / run_db() instead: they run
+the same synchronous ORM code in short-lived sessions either on the async driver
+(ASYNC_DB_ENABLED, aiosqlite / asyncpg via AsyncSession.run_sync) or in
+the bounded "db" thread pool (app/offload.py) with a regular Session.
+
+Server databases use a QueuePool sized by DB_POOL_* settings; pool_stats()
+reports its usage and checkout wait times. Historical statistics can be
+routed to a read replica (DATABASE_READ_URL, see read_bind()).
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+from sqlalchemy import create_engine, event, exc as sqlalchemy_exc
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
 import os
+import logging
 
 from .config import settings
+from .offload import offload
+
+logger = logging.getLogger(__name__)
 
 # SQLite database path
 DATABASE_URL = settings.DATABASE_URL
 
-# Configure engine with WAL mode for SQLite
-if "sqlite" in DATABASE_URL:
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={
-            "check_same_thread": False,
-            "timeout": 20.0  # busy_timeout v sekundách (20000ms)
-        }
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a free connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.last_wait_ms = 0.0
+        self.avg_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sqlalchemy_exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            wait_ms = (time.perf_counter() - start) * 1000
+            with self._stats_lock:
+                self.checkouts += 1
+                self.last_wait_ms = wait_ms
+                self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+                self.avg_wait_ms = wait_ms if self.checkouts == 1 else self.avg_wait_ms * 0.9 + wait_ms * 0.1
+
+    def stats(self) -> Dict[str, Any]:
+        """Usage gauges and checkout wait times."""
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "max_overflow": self._max_overflow,
+                "checked_out": self.checkedout(),
+                "idle": self.checkedin(),
+                "overflow": max(0, self.overflow()),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "last_wait_ms": round(self.last_wait_ms, 2),
+                "avg_wait_ms": round(self.avg_wait_ms, 2),
+                "max_wait_ms": round(self.max_wait_ms, 2),
+            }
+
+
+def set_sqlite_pragma(dbapi_conn, connection_record):
+    """Nastavit SQLite PRAGMA při každém připojení."""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=20000")  # 20 sekund
+    cursor.close()
+
+
+def _create_engine(url: str):
+    """Engine for url with WAL mode on SQLite and the DB_POOL_* settings on server databases."""
+    if "sqlite" in url:
+        engine = create_engine(
+            url,
+            poolclass=None if ":memory:" in url else TimedQueuePool,
+            connect_args={
+                "check_same_thread": False,
+                "timeout": 20.0  # busy_timeout v sekundách (20000ms)
+            }
+        )
+        # Zapnout WAL mode při každém připojení
+        event.listen(engine, "connect", set_sqlite_pragma)
+        return engine
+    return create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING
     )
-    
-    # Zapnout WAL mode při každém připojení
-    @event.listens_for(engine, "connect")
-    def set_sqlite_pragma(dbapi_conn, connection_record):
-        """Nastavit SQLite PRAGMA při každém připojení."""
-        cursor = dbapi_conn.cursor()
-        cursor.execute("PRAGMA journal_mode=WAL")
-        cursor.execute("PRAGMA synchronous=NORMAL")
-        cursor.execute("PRAGMA busy_timeout=20000")  # 20 sekund
-        cursor.close()
-else:
-    engine = create_engine(DATABASE_URL)
+
+
+engine = _create_engine(DATABASE_URL)
+# Statistics endpoints read from the replica when DATABASE_READ_URL is set
+read_engine = _create_engine(settings.DATABASE_READ_URL) if settings.DATABASE_READ_URL else engine
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 
+def read_bind(bind):
+    """
+    Engine for read-only reporting queries issued by a session bound to bind.
+
+    The replica (DATABASE_READ_URL) replaces the primary engine; any other
+    bind (tests, benchmarks) is returned unchanged. Replica lag means a
+    just-written row may be missing for a moment - use it only where
+    slightly stale data is fine (historical charts), not for live fields.
+    """
+    return read_engine if bind is engine else bind
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Connection pool gauges per engine (primary, read replica if configured)."""
+    engines = {"primary": engine}
+    if read_engine is not engine:
+        engines["read"] = read_engine
+    result = {}
+    for name, eng in engines.items():
+        pool = eng.pool
+        result[name] = pool.stats() if isinstance(pool, TimedQueuePool) else {"pool": type(pool).__name__}
+    return result
+
+
 def get_db():
     """Dependency for getting database session."""
     db = SessionLocal()
@@ -45,6 +151,91 @@ def get_db():
         db.close()
 
 
+def async_database_url(url: str) -> Optional[str]:
+    """DATABASE_URL with its async driver (aiosqlite / asyncpg), None if there is none."""
+    scheme, sep, rest = url.partition("://")
+    dialect = scheme.split("+")[0]
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if dialect in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return None
+
+
+def _create_async_sessionmaker():
+    """Async engine + session factory if ASYNC_DB_ENABLED and the driver is installed."""
+    if not settings.ASYNC_DB_ENABLED:
+        return None
+    url = async_database_url(DATABASE_URL)
+    if url is None:
+        logger.warning("ASYNC_DB_ENABLED: no async driver for this DATABASE_URL, using worker threads")
+        return None
+    try:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        if url.startswith("sqlite"):
+            async_engine = create_async_engine(url, connect_args={"timeout": 20.0})
+            event.listen(async_engine.sync_engine, "connect", set_sqlite_pragma)
+        else:
+            async_engine = create_async_engine(url)
+    except ImportError as e:
+        logger.warning(f"ASYNC_DB_ENABLED but the async driver is not installed ({e}), using worker threads")
+        return None
+    logger.info(f"Async database engine: {async_engine.dialect.name}+{async_engine.dialect.driver}")
+    return async_sessionmaker(async_engine, autoflush=False)
+
+
+# None = async engine disabled; AsyncDb then runs sessions in worker threads
+AsyncSessionLocal = _create_async_sessionmaker()
+
+
+class AsyncDb:
+    """
+    DB access for async endpoints that does not block the event loop.
+
+    await db.run(fn, *args) calls fn(session, *args) with a synchronous
+    Session, so services and helpers written for get_db are reused as is.
+    Each run() uses its own short-lived session (fn commits itself), so no
+    pool connection is held while the endpoint awaits something else.
+    With the async engine the session is the sync view of an AsyncSession
+    (driver I/O awaited on the event loop), otherwise a regular Session
+    in the "db" offload pool.
+
+    ORM objects returned from run() are detached; read only attributes
+    that were loaded inside run().
+    """
+
+    def __init__(self, session_factory: Optional[Callable[[], Session]] = None):
+        # An explicit (sync) factory forces the worker-thread mode - tests, benchmarks
+        self._session_factory = session_factory
+
+    @property
+    def is_async(self) -> bool:
+        return self._session_factory is None and AsyncSessionLocal is not None
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        if self.is_async:
+            async with AsyncSessionLocal() as session:
+                return await session.run_sync(fn, *args)
+        return await offload.run("db", self._run_in_session, fn, *args)
+
+    def _run_in_session(self, fn: Callable[..., Any], *args) -> Any:
+        db = (self._session_factory or SessionLocal)()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+
+
+def get_async_db() -> AsyncDb:
+    """Dependency for non-blocking database access (see AsyncDb)."""
+    return AsyncDb()
+
+
+async def run_db(fn: Callable[..., Any], *args) -> Any:
+    """Run fn(session, *args) in a short-lived session without blocking the event loop."""
+    return await AsyncDb().run(fn, *args)
+
+
 def init_db():
     """Initialize database tables."""
     Base.metadata.create_all(bind=engine)
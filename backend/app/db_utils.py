@@ -7,12 +7,14 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 
 
-def day_range_utc(day_str: str):
+def day_range_utc(day_str: str, offset_seconds: int = 0):
     """
     Return (day_start_utc, day_end_utc) for filtering logs by date string 'YYYY-MM-DD'.
     Use: timestamp >= day_start, timestamp < day_end (works for SQLite and PostgreSQL).
+    With offset_seconds (device local - UTC) the date is a device-local day.
     """
     day_start = datetime.strptime(day_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    day_start -= timedelta(seconds=offset_seconds or 0)
     day_end = day_start + timedelta(days=1)
     return day_start, day_end
 
@@ -33,23 +35,39 @@ def minute_bucket(session: Session, column):
     return func.date_trunc("minute", column)
 
 
-def date_expr(session: Session, column):
+def _pg_local(column, offset_seconds: int):
+    """PostgreSQL: timestamptz -> UTC wall clock shifted by offset_seconds."""
+    local = func.timezone("UTC", column)
+    if offset_seconds:
+        local = local + func.make_interval(0, 0, 0, 0, 0, 0, offset_seconds)
+    return local
+
+
+def _sqlite_modifiers(offset_seconds: int):
+    """SQLite date function modifiers for a fixed offset (e.g. '+19800 seconds')."""
+    return (f"{int(offset_seconds):+d} seconds",) if offset_seconds else ()
+
+
+def date_expr(session: Session, column, offset_seconds: int = 0):
     """
     Expression for date part (YYYY-MM-DD) for grouping/label.
-    SQLite: strftime('%Y-%m-%d', col)
-    PostgreSQL: to_char(col, 'YYYY-MM-DD')
+    With offset_seconds (device local - UTC) groups by device-local day.
+    SQLite: strftime('%Y-%m-%d', col[, '+N seconds'])
+    PostgreSQL: to_char(timezone('UTC', col)[ + interval], 'YYYY-MM-DD')
     """
     if _is_sqlite(session):
-        return func.strftime("%Y-%m-%d", column)
-    return func.to_char(column, "YYYY-MM-DD")
+        return func.strftime("%Y-%m-%d", column, *_sqlite_modifiers(offset_seconds))
+    return func.to_char(_pg_local(column, offset_seconds), "YYYY-MM-DD")
 
 
-def hour_expr(session: Session, column):
+def hour_expr(session: Session, column, offset_seconds: int = 0):
     """
     Expression for hour part (0-23) for grouping/label.
-    SQLite: strftime('%H', col)  -> string
-    PostgreSQL: extract(hour from col) -> numeric, int() in Python works
+    With offset_seconds (device local - UTC) gives the device-local hour,
+    correct for half-hour offsets too.
+    SQLite: strftime('%H', col[, '+N seconds'])  -> string
+    PostgreSQL: extract(hour from timezone('UTC', col)[ + interval]) -> numeric, int() in Python works
     """
     if _is_sqlite(session):
-        return func.strftime("%H", column)
-    return func.extract("hour", column)
+        return func.strftime("%H", column, *_sqlite_modifiers(offset_seconds))
+    return func.extract("hour", _pg_local(column, offset_seconds))
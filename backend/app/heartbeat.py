@@ -0,0 +1,131 @@
+"""In-memory liveness table for devices.
+
+Agent pings (WebSocket, every ~30 s) and every authenticated agent HTTP call
+used to UPDATE devices.last_seen. Liveness now lives here, keyed by device
+DB id, and is flushed to the devices table periodically with a single bulk
+UPDATE. Device.is_online and the device endpoints read the in-memory value
+first, so online status stays real-time between flushes.
+"""
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional
+import logging
+
+from sqlalchemy import bindparam, update
+
+logger = logging.getLogger(__name__)
+
+
+def _as_utc(value: datetime) -> datetime:
+    """SQLite returns naive datetimes; treat them as UTC."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+class HeartbeatStore:
+    """Thread-safe device_id -> last_seen table with dirty tracking."""
+
+    def __init__(self):
+        self._seen: Dict[int, datetime] = {}
+        self._dirty: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+        self._touches = 0
+        self._rows_flushed = 0
+
+    def touch(self, device_id: int, seen_at: datetime = None):
+        """Record that a device is alive (no DB write)."""
+        seen_at = _as_utc(seen_at) if seen_at else datetime.now(timezone.utc)
+        with self._lock:
+            self._touches += 1
+            current = self._seen.get(device_id)
+            if current is None or seen_at > current:
+                self._seen[device_id] = seen_at
+                self._dirty[device_id] = seen_at
+
+    def get(self, device_id: int) -> Optional[datetime]:
+        """Latest in-memory last_seen for a device (UTC), or None."""
+        return self._seen.get(device_id)
+
+    def effective_last_seen(self, device_id: int, db_value: Optional[datetime]) -> Optional[datetime]:
+        """Newer of the in-memory value and the persisted column (UTC)."""
+        memory_value = self._seen.get(device_id)
+        if db_value is None:
+            return memory_value
+        db_value = _as_utc(db_value)
+        if memory_value is None or db_value > memory_value:
+            return db_value
+        return memory_value
+
+    def overlay(self, devices: Iterable):
+        """
+        Show in-memory last_seen on loaded Device objects (for API responses).
+
+        Uses set_committed_value so the session does not see the change as
+        dirty and never writes it back on an unrelated commit.
+        """
+        from sqlalchemy.orm.attributes import set_committed_value
+
+        for device in devices:
+            value = self.effective_last_seen(device.id, device.last_seen)
+            if value is not None and value != device.last_seen:
+                set_committed_value(device, "last_seen", value)
+
+    def forget(self, device_id: int):
+        """Drop a device (e.g. after deletion)."""
+        with self._lock:
+            self._seen.pop(device_id, None)
+            self._dirty.pop(device_id, None)
+
+    def flush(self, session_factory: Optional[Callable] = None) -> int:
+        """
+        Persist dirty entries with one bulk UPDATE (executemany by primary key).
+
+        Returns number of device rows written. On failure entries stay dirty
+        and are retried on the next flush.
+        """
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = {}
+        if not dirty:
+            return 0
+
+        if session_factory is None:
+            from .database import SessionLocal
+            session_factory = SessionLocal
+        from .models import Device
+
+        # Core statement (not ORM bulk-by-PK) so devices deleted meanwhile are simply skipped
+        devices = Device.__table__
+        stmt = update(devices).where(devices.c.id == bindparam("b_id")).values(last_seen=bindparam("b_seen"))
+
+        db = session_factory()
+        try:
+            db.execute(stmt, [{"b_id": device_id, "b_seen": seen_at} for device_id, seen_at in dirty.items()])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            with self._lock:
+                for device_id, seen_at in dirty.items():
+                    self._dirty.setdefault(device_id, seen_at)
+            logger.warning(f"Heartbeat flush failed for {len(dirty)} devices, will retry: {e}")
+            return 0
+        finally:
+            db.close()
+
+        self._rows_flushed += len(dirty)
+        logger.debug(f"Heartbeat flush: {len(dirty)} devices")
+        return len(dirty)
+
+    def stats(self) -> Dict[str, int]:
+        """Liveness table counters."""
+        return {
+            "devices": len(self._seen),
+            "dirty": len(self._dirty),
+            "touches": self._touches,
+            "rows_flushed": self._rows_flushed,
+        }
+
+
+# Global liveness table
+heartbeat_store = HeartbeatStore()
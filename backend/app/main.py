@@ -4,12 +4,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from .database import init_db, get_db
+from .offload import offload
 from .config import settings
 from . import models
 import logging
 import sys
 import asyncio
 import re
+import time
 
 # Setup logging to an OS-appropriate writable directory with rotation
 import os
@@ -132,8 +134,31 @@ class PublicRateLimitMiddleware(BaseHTTPMiddleware):
             )
         return await call_next(request)
 
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """Latency and SQL statements per route template for /api/metrics (+ debug headers)."""
+    async def dispatch(self, request: Request, call_next):
+        from . import metrics, query_profiler
+        queries, token = query_profiler.start_request_queries(request.url.path)
+        start = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            if settings.DEBUG:
+                response.headers["X-DB-Queries"] = str(queries.count)
+                response.headers["X-DB-Time-Ms"] = f"{queries.seconds * 1000:.1f}"
+            return response
+        finally:
+            query_profiler.end_request_queries(token)
+            route = request.scope.get("route")
+            metrics.observe_request(
+                request.method, getattr(route, "path", "unmatched"), status_code,
+                time.perf_counter() - start, queries
+            )
+
 app.add_middleware(PublicRateLimitMiddleware)
 app.add_middleware(SecurityHeadersMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Security
 security = HTTPBearer()
@@ -163,6 +188,124 @@ async def startup_event():
     # Start automated cleanup task
     asyncio.create_task(run_daily_cleanup())
 
+    # Start single DB writer for agent ingest (usage rows)
+    if settings.WRITE_BEHIND_ENABLED:
+        from .write_queue import write_queue
+        write_queue.start()
+
+    # Persist in-memory liveness (last_seen) periodically
+    asyncio.create_task(run_heartbeat_flush())
+
+    # First start after upgrade: build usage rollups from existing usage_logs
+    if settings.USAGE_ROLLUP_ENABLED:
+        asyncio.create_task(run_rollup_backfill())
+
+    # Today's usage for the agent fetch: shutdown snapshot or rebuild from usage_logs
+    asyncio.create_task(run_today_usage_restore())
+
+    # Periodic repair of the incremental all-time usage counters
+    if settings.USAGE_TOTALS_RECONCILE_INTERVAL > 0:
+        asyncio.create_task(run_usage_totals_reconcile())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush buffered writes before exit."""
+    from .write_queue import write_queue
+    from .heartbeat import heartbeat_store
+    from .state_backend import get_state_backend
+    await write_queue.stop()
+    await offload.run("maintenance", heartbeat_store.flush)
+    await persist_today_usage()
+    get_state_backend().close()
+    offload.shutdown()
+
+
+async def run_heartbeat_flush():
+    """Flush device last_seen from the liveness table with one bulk UPDATE per interval."""
+    from .heartbeat import heartbeat_store
+    while True:
+        try:
+            await asyncio.sleep(settings.HEARTBEAT_FLUSH_INTERVAL)
+            await offload.run("maintenance", heartbeat_store.flush)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"Error in heartbeat flush task: {e}")
+
+
+async def run_today_usage_restore():
+    """Load today's usage per device once at startup (see today_usage_service)."""
+    from .database import SessionLocal
+    from .services import today_usage_service
+
+    if not (today_usage_service.today_usage.enabled and settings.TODAY_USAGE_PERSIST):
+        return
+    try:
+        source = await offload.run("maintenance", today_usage_service.restore_or_rebuild, SessionLocal)
+        logger.info(f"Today usage accumulators ready ({source})")
+    except Exception as e:
+        logger.error(f"Today usage restore failed: {e}")
+
+
+async def persist_today_usage():
+    """Write today's usage accumulators on shutdown (after the write-behind flush)."""
+    from .database import SessionLocal
+    from .services import today_usage_service
+
+    if not (today_usage_service.today_usage.enabled and settings.TODAY_USAGE_PERSIST):
+        return
+    try:
+        days = await offload.run("maintenance", today_usage_service.persist, SessionLocal)
+        logger.info(f"Today usage saved ({days} devices)")
+    except Exception as e:
+        logger.warning(f"Today usage not saved: {e}")
+
+
+async def run_rollup_backfill():
+    """Backfill usage rollups once if the table is empty but raw logs exist."""
+    from .database import SessionLocal
+    from .services import rollup_service
+
+    def _backfill():
+        db = SessionLocal()
+        try:
+            if rollup_service.needs_backfill(db):
+                logger.info("Usage rollup table empty, backfilling from usage_logs...")
+                total = rollup_service.rebuild_all(db)
+                logger.info(f"Usage rollup backfill finished ({total} logs)")
+        finally:
+            db.close()
+
+    try:
+        await offload.run("maintenance", _backfill)
+    except Exception as e:
+        logger.error(f"Usage rollup backfill failed: {e}")
+
+
+async def run_usage_totals_reconcile():
+    """Reconcile device_usage_totals with usage_logs every USAGE_TOTALS_RECONCILE_INTERVAL."""
+    from .database import SessionLocal
+    from .services import rollup_service
+
+    def _reconcile():
+        db = SessionLocal()
+        try:
+            repaired = rollup_service.reconcile_totals(db)
+            if repaired:
+                logger.info(f"Usage totals reconciled ({repaired} devices repaired)")
+        finally:
+            db.close()
+
+    while True:
+        try:
+            await asyncio.sleep(settings.USAGE_TOTALS_RECONCILE_INTERVAL)
+            await offload.run("maintenance", _reconcile)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"Error in usage totals reconcile task: {e}")
+
 
 async def run_daily_cleanup():
     """Run daily cleanup task in background."""
@@ -215,7 +358,7 @@ async def get_server_info():
 
 
 # Import routers
-from .api import auth, devices, rules, reports, websocket, trust, files, shield
+from .api import auth, devices, rules, reports, websocket, trust, files, shield, metrics
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
 import os
@@ -251,6 +394,7 @@ app.include_router(websocket.router, tags=["websocket"]) # No prefix, so it rout
 app.include_router(trust.router, prefix="/api/trust", tags=["trust"])
 app.include_router(files.router, prefix="/api/files", tags=["files"])
 app.include_router(shield.router, prefix="/api", tags=["shield"]) # Note: Router has "/shield" prefix internaly
+app.include_router(metrics.router, prefix="/api", tags=["metrics"])
 
 # Uploads directory (screenshots via authenticated /api/files/screenshots); single source in config
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
@@ -1,5 +1,5 @@
 """SQLAlchemy database models."""
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Float, Text, Index
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Float, Text, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -56,23 +56,26 @@ class Device(Base):
     child = relationship("User", foreign_keys=[child_id], back_populates="child_devices")
     rules = relationship("Rule", back_populates="device", cascade="all, delete-orphan")
     usage_logs = relationship("UsageLog", back_populates="device", cascade="all, delete-orphan")
+    daily_rollups = relationship("UsageDailyRollup", back_populates="device", cascade="all, delete-orphan")
+    hourly_rollups = relationship("UsageHourlyRollup", back_populates="device", cascade="all, delete-orphan")
+    usage_totals = relationship("DeviceUsageTotals", back_populates="device", uselist=False, cascade="all, delete-orphan")
     shield_keywords = relationship("ShieldKeyword", back_populates="device", cascade="all, delete-orphan")
     shield_alerts = relationship("ShieldAlert", back_populates="device", cascade="all, delete-orphan")
     
     @property
     def is_online(self) -> bool:
         """Check if device is online (seen in last 5 minutes)."""
-        if not self.last_seen:
-            return False
-            
         from datetime import datetime, timezone, timedelta
+        from .heartbeat import heartbeat_store
+        
+        # In-memory liveness (agent pings) is newer than the periodically flushed column
+        last_seen = heartbeat_store.effective_last_seen(self.id, self.last_seen)
+        if not last_seen:
+            return False
         
         # Current time in UTC
         now = datetime.now(timezone.utc)
         
-        # Process last_seen
-        last_seen = self.last_seen
-        
         # SQLite often stores naive datetimes. If naive, assume it implies UTC.
         if last_seen.tzinfo is None:
             last_seen = last_seen.replace(tzinfo=timezone.utc)
@@ -151,6 +154,76 @@ class UsageLog(Base):
     )
 
 
+class UsageDailyRollup(Base):
+    """Pre-aggregated usage per device, device-local day and app.
+
+    Maintained incrementally at ingest (services/rollup_service.py) so stats
+    endpoints read O(days) rows instead of scanning usage_logs.
+    """
+    __tablename__ = "usage_daily_rollup"
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), nullable=False)
+    local_date = Column(String, nullable=False)  # YYYY-MM-DD in device local time
+    app_name = Column(String, nullable=False)
+    total_seconds = Column(Integer, default=0)  # SUM(duration)
+    session_count = Column(Integer, default=0)  # Number of usage_logs rows
+    first_activity = Column(DateTime(timezone=True), nullable=True)  # UTC
+    last_activity = Column(DateTime(timezone=True), nullable=True)  # UTC
+    minute_bitmap = Column(LargeBinary, nullable=True)  # 1440 bits, bit N = local minute N had a log
+    
+    # Relationships
+    device = relationship("Device", back_populates="daily_rollups")
+    
+    __table_args__ = (
+        UniqueConstraint('device_id', 'local_date', 'app_name', name='uq_daily_rollup_key'),
+        Index('idx_daily_rollup_device_date', 'device_id', 'local_date'),
+    )
+
+
+class UsageHourlyRollup(Base):
+    """Pre-aggregated usage per device, UTC hour and app.
+
+    Backs the usage-by-hour heatmap and per-app hourly distribution; local
+    hours are derived from hour_start and the device offset at read time.
+    """
+    __tablename__ = "usage_hourly_rollup"
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), nullable=False)
+    hour_start = Column(DateTime(timezone=True), nullable=False)  # UTC, truncated to the hour
+    app_name = Column(String, nullable=False)
+    total_seconds = Column(Integer, default=0)  # SUM(duration)
+    session_count = Column(Integer, default=0)  # Number of usage_logs rows
+    
+    # Relationships
+    device = relationship("Device", back_populates="hourly_rollups")
+    
+    __table_args__ = (
+        UniqueConstraint('device_id', 'hour_start', 'app_name', name='uq_hourly_rollup_key'),
+        Index('idx_hourly_rollup_device_hour', 'device_id', 'hour_start'),
+    )
+
+
+class DeviceUsageTotals(Base):
+    """All-time usage counters per device.
+
+    Incremented at ingest together with the rollups so the dashboard
+    summary reads one row instead of summing usage_logs; the periodic
+    reconciliation in rollup_service repairs any drift.
+    """
+    __tablename__ = "device_usage_totals"
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), unique=True, nullable=False)
+    total_usage_seconds = Column(Integer, default=0)  # SUM(usage_logs.duration)
+    last_usage_at = Column(DateTime(timezone=True), nullable=True)  # MAX(usage_logs.timestamp), UTC
+    reconciled_at = Column(DateTime(timezone=True), nullable=True)  # Last check against usage_logs
+    
+    # Relationships
+    device = relationship("Device", back_populates="usage_totals")
+
+
 class PairingToken(Base):
     """Temporary pairing tokens for device registration."""
     __tablename__ = "pairing_tokens"
@@ -253,3 +326,18 @@ class DeviceOwnerSettings(Base):
     device = relationship("Device", backref="device_owner_settings")
 
 
+
+
+class DeviceRuleState(Base):
+    """Version of a device's rule set.
+
+    Bumped in the same transaction as every change the agent's rules
+    response depends on (rules, settings protection), so agents that already
+    hold the current version get an "unchanged" answer without the rules.
+    """
+    __tablename__ = "device_rule_state"
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), unique=True, nullable=False)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=True)  # UTC of the last bump
@@ -0,0 +1,171 @@
+"""Bounded thread pools for blocking work called from async endpoints.
+
+Blocking calls (SQLAlchemy sessions, bcrypt, QR rendering, file writes)
+must not run on the event loop - it also serves every WebSocket and the
+health check. asyncio.to_thread() moves them off the loop but shares one
+default executor, so a burst of heavy reports could occupy every thread
+and queue the agents' DB work behind it. Work is therefore submitted per
+category, each with its own small pool:
+
+    result = await offload.run("cpu", verify_password, plain, hashed)
+
+Categories and default limits (OFFLOAD_LIMITS, e.g. "db=4,reports=2"):
+- db:          agent hot paths and other short DB work (database.AsyncDb)
+- reports:     dashboard summary / statistics builders (heavy reads)
+- cpu:         bcrypt, QR code rendering
+- files:       screenshot uploads and other file I/O
+- maintenance: write-behind flush, heartbeat flush, rollup backfill, reconcile
+
+stats() reports per category: active / waiting tasks and how long tasks
+waited for a thread (queue time) and ran.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+import logging
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {"db": 4, "reports": 2, "cpu": 2, "files": 2, "maintenance": 2}
+# Pool size for a category missing from the limits
+FALLBACK_LIMIT = 2
+
+
+class _Category:
+    """One bounded pool and its counters."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"offload-{name}")
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.active = 0
+        self.started_count = 0
+        self.last_wait_ms = 0.0
+        self.avg_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.avg_run_ms = 0.0
+        self.max_run_ms = 0.0
+
+    def started(self, wait_ms: float):
+        with self.lock:
+            self.active += 1
+            self.started_count += 1
+            self.last_wait_ms = wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            self.avg_wait_ms = wait_ms if self.started_count == 1 else self.avg_wait_ms * 0.9 + wait_ms * 0.1
+
+    def finished(self, run_ms: float, ok: bool):
+        with self.lock:
+            self.active -= 1
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.max_run_ms = max(self.max_run_ms, run_ms)
+            self.avg_run_ms = run_ms if self.completed + self.failed == 1 else self.avg_run_ms * 0.9 + run_ms * 0.1
+
+    def never_started(self, future):
+        if future.cancelled():
+            with self.lock:
+                self.cancelled += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "limit": self.limit,
+                "active": self.active,
+                "waiting": self.submitted - self.completed - self.failed - self.cancelled - self.active,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "last_queue_wait_ms": round(self.last_wait_ms, 2),
+                "avg_queue_wait_ms": round(self.avg_wait_ms, 2),
+                "max_queue_wait_ms": round(self.max_wait_ms, 2),
+                "avg_run_ms": round(self.avg_run_ms, 2),
+                "max_run_ms": round(self.max_run_ms, 2),
+            }
+
+
+class Offload:
+    """Per-category bounded thread pools with queue-time metrics."""
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            limits: category -> max threads (missing categories get FALLBACK_LIMIT)
+        """
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self._categories: Dict[str, _Category] = {}
+        self._lock = threading.Lock()
+
+    def _category(self, name: str) -> _Category:
+        category = self._categories.get(name)
+        if category is None:
+            with self._lock:
+                category = self._categories.get(name)
+                if category is None:
+                    limit = max(1, int(self.limits.get(name, FALLBACK_LIMIT)))
+                    category = self._categories[name] = _Category(name, limit)
+        return category
+
+    async def run(self, category: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run fn(*args, **kwargs) in the category's pool and await the result.
+
+        Like asyncio.to_thread(): context variables are propagated and
+        exceptions are re-raised in the caller.
+        """
+        pool = self._category(category)
+        submitted_at = time.perf_counter()
+        context = contextvars.copy_context()
+
+        def call():
+            started_at = time.perf_counter()
+            pool.started((started_at - submitted_at) * 1000)
+            ok = False
+            try:
+                result = context.run(fn, *args, **kwargs)
+                ok = True
+                return result
+            finally:
+                pool.finished((time.perf_counter() - started_at) * 1000, ok)
+
+        with pool.lock:
+            pool.submitted += 1
+        try:
+            future = pool.executor.submit(call)
+        except RuntimeError:
+            # Pool already shut down (interpreter exit): never started
+            with pool.lock:
+                pool.submitted -= 1
+            raise
+        # Cancelling the awaiting task cancels the call if it has not started yet
+        future.add_done_callback(pool.never_started)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Counters per category that has been used."""
+        return {name: category.stats() for name, category in list(self._categories.items())}
+
+    def shutdown(self, wait: bool = False):
+        """Stop all pools (queued work that has not started is cancelled)."""
+        with self._lock:
+            categories, self._categories = self._categories, {}
+        for category in categories.values():
+            category.executor.shutdown(wait=wait, cancel_futures=True)
+
+
+# Global instance
+offload = Offload(settings.OFFLOAD_LIMITS)
@@ -0,0 +1,139 @@
+"""
+SQL query profiler on SQLAlchemy cursor events.
+
+- Per request: MetricsMiddleware starts a QueryStats in a context variable;
+  every statement executed in that context (also in offload threads, which
+  copy the context) adds to its count and DB time. They feed the
+  /api/metrics histograms and, with DEBUG=1, the X-DB-Queries /
+  X-DB-Time-Ms response headers.
+- Slow queries: statements slower than SLOW_QUERY_MS are logged with their
+  normalized SQL (literals and IN lists collapsed, so repeats group together).
+- count_queries(): collects statements on an engine from any thread - the
+  tests use it to bound the queries per endpoint (N+1 regressions).
+"""
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .config import settings
+
+logger = logging.getLogger("slow_query")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+|\$\d+|\(?__\[POSTCOMPILE_\w+\]\)?)"
+_IN_LIST = re.compile(rf"\bIN\s*\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})*\s*\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+MAX_LOGGED_SQL = 1000
+
+
+def normalize_sql(statement: str) -> str:
+    """SQL with literals replaced by ?, IN lists collapsed and whitespace squeezed."""
+    sql = _STRING.sub("?", statement)
+    sql = _NUMBER.sub("?", sql)
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return sql[:MAX_LOGGED_SQL]
+
+
+class QueryStats:
+    """SQL statements and driver time of one request (mutated from any thread)."""
+
+    __slots__ = ("count", "seconds", "path")
+
+    def __init__(self, path: str = ""):
+        self.count = 0
+        self.seconds = 0.0
+        self.path = path
+
+
+_current_queries: contextvars.ContextVar[Optional[QueryStats]] = contextvars.ContextVar(
+    "current_queries", default=None)
+
+
+def start_request_queries(path: str = "") -> Tuple[QueryStats, contextvars.Token]:
+    """Start counting queries for the current request (context)."""
+    stats = QueryStats(path)
+    return stats, _current_queries.set(stats)
+
+
+def end_request_queries(token: contextvars.Token):
+    _current_queries.reset(token)
+
+
+class QueryLog:
+    """Statements collected by count_queries()."""
+
+    def __init__(self, engine: Optional[Engine]):
+        self.engine = engine
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def summary(self) -> str:
+        return "\n".join(f"  {i + 1}. {sql}" for i, sql in enumerate(self.statements))
+
+
+_collectors: List[QueryLog] = []
+_collectors_lock = threading.Lock()
+
+
+@contextmanager
+def count_queries(engine: Optional[Engine] = None) -> Iterator[QueryLog]:
+    """
+    Collect the (normalized) statements executed inside the block.
+
+    Args:
+        engine: Only count statements on this engine (None = every engine).
+            Works across threads, e.g. requests handled by TestClient.
+    """
+    log = QueryLog(engine)
+    with _collectors_lock:
+        _collectors.append(log)
+    try:
+        yield log
+    finally:
+        with _collectors_lock:
+            _collectors.remove(log)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats = _current_queries.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+    if settings.SLOW_QUERY_MS and elapsed * 1000 >= settings.SLOW_QUERY_MS:
+        where = f" ({stats.path})" if stats is not None and stats.path else ""
+        logger.warning(f"Slow query {elapsed * 1000:.0f} ms{where}: {normalize_sql(statement)}")
+    if _collectors:
+        with _collectors_lock:
+            for log in _collectors:
+                if log.engine is None or log.engine is conn.engine:
+                    log.statements.append(normalize_sql(statement))
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # Failed statements never reach after_cursor_execute
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
@@ -1,35 +1,36 @@
 """
 Rate limiting utility for FamilyEye API.
-Simple in-memory rate limiter for standalone deployments.
+Sliding-window limiter; the windows live in the state backend, so with
+STATE_BACKEND=sqlite all workers of a node share one limit per client.
 """
-import time
-from collections import defaultdict
-from threading import Lock
-from typing import Dict, Tuple
+from typing import Optional, Tuple
 import logging
 
+from .metrics import rate_limit_rejections
+from .state_backend import StateBackend, get_state_backend
+
 logger = logging.getLogger(__name__)
 
 
 class RateLimiter:
     """
-    Simple in-memory rate limiter.
-    Thread-safe using locks.
+    Sliding-window rate limiter on top of a StateBackend.
+    Thread-safe (the backend serializes updates).
     """
     
-    def __init__(self):
-        # Store: {ip: [(timestamp1, count1), ...]}
-        self._requests: Dict[str, list] = defaultdict(list)
-        self._lock = Lock()
+    NAMESPACE = "ratelimit"
+    
+    def __init__(self, backend: Optional[StateBackend] = None):
+        # None = the process-wide backend (resolved on use)
+        self._backend = backend
     
-    def _cleanup_old_entries(self, ip: str, window_seconds: int):
-        """Remove entries older than the window."""
-        current_time = time.time()
-        cutoff = current_time - window_seconds
-        self._requests[ip] = [
-            ts for ts in self._requests[ip] 
-            if ts > cutoff
-        ]
+    @property
+    def backend(self) -> StateBackend:
+        return self._backend or get_state_backend()
+    
+    def check(self, key: str, max_requests: int, window_seconds: int) -> Tuple[bool, int, int]:
+        """Record a request for key. Returns (is_allowed, remaining, retry_after)."""
+        return self.backend.hit(self.NAMESPACE, key, max_requests, window_seconds)
     
     def is_allowed(self, ip: str, max_requests: int, window_seconds: int) -> Tuple[bool, int]:
         """
@@ -43,32 +44,13 @@ class RateLimiter:
         Returns:
             Tuple of (is_allowed, remaining_requests)
         """
-        with self._lock:
-            current_time = time.time()
-            
-            # Cleanup old entries
-            self._cleanup_old_entries(ip, window_seconds)
-            
-            # Count requests in window
-            request_count = len(self._requests[ip])
-            
-            if request_count >= max_requests:
-                remaining = 0
-                return False, remaining
-            
-            # Record this request
-            self._requests[ip].append(current_time)
-            remaining = max_requests - request_count - 1
-            return True, remaining
+        is_allowed, remaining, _ = self.check(ip, max_requests, window_seconds)
+        return is_allowed, remaining
     
     def get_retry_after(self, ip: str, window_seconds: int) -> int:
         """Get seconds until the oldest request expires from the window."""
-        with self._lock:
-            if not self._requests[ip]:
-                return 0
-            oldest = min(self._requests[ip])
-            retry_after = int(window_seconds - (time.time() - oldest)) + 1
-            return max(0, retry_after)
+        # Limit 0 only reads the window
+        return self.backend.hit(self.NAMESPACE, ip, 0, window_seconds)[2]
 
 
 # Global rate limiter instance
@@ -96,11 +78,11 @@ def check_rate_limit(
     # Create unique key for IP + endpoint
     key = f"{ip}:{endpoint}"
     
-    is_allowed, remaining = rate_limiter.is_allowed(key, max_requests, window_seconds)
+    is_allowed, remaining, retry_after = rate_limiter.check(key, max_requests, window_seconds)
     
     if not is_allowed:
-        retry_after = rate_limiter.get_retry_after(key, window_seconds)
         logger.warning(f"Rate limit exceeded for {ip} on {endpoint}")
+        rate_limit_rejections.inc(endpoint=endpoint)
         return False, 0, retry_after
     
     return True, remaining, 0
@@ -125,6 +125,17 @@ class RuleResponse(BaseModel):
         from_attributes = True
 
 
+class RuleBulkRequest(BaseModel):
+    upsert: List[RuleCreate] = []  # same matching as POST /api/rules/
+    delete: List[int] = []  # rule ids
+
+
+class RuleBulkResponse(BaseModel):
+    rules: List[RuleResponse]  # in upsert order
+    deleted: List[int]
+    devices: List[int]  # devices whose rules changed (one push each)
+
+
 # Usage log schemas
 class UsageLogCreate(BaseModel):
     device_id: int
@@ -179,6 +190,7 @@ class PairingStatusResponse(BaseModel):
 class AgentRulesRequest(BaseModel):
     device_id: str
     api_key: str
+    known_version: Optional[int] = None  # rules_version the agent already holds
 
 
 class AgentRulesResponse(BaseModel):
@@ -188,6 +200,8 @@ class AgentRulesResponse(BaseModel):
     server_time: Optional[datetime] = None  # Server UTC time
     settings_protection: str = "full"  # 'full', 'partial', or 'off'
     settings_exceptions: Optional[str] = None
+    rules_version: int = 0  # Send back as known_version on the next fetch
+    unchanged: bool = False  # True = known_version is current, rules omitted (keep the cached ones)
 
 
 class AgentUsageLogCreate(BaseModel):
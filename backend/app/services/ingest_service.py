@@ -0,0 +1,126 @@
+"""
+Usage ingest service.
+
+Bulk write path for agent usage reports: filters non-trackable apps,
+builds plain row dicts and inserts the whole batch with a single
+executemany INSERT instead of one ORM object per entry, and keeps
+the daily/hourly rollups in step in the same transaction. When the write-behind
+queue is running, rows are handed to its writer task. After commit the
+writer publishes the covered time range per device (publish_usage_changed)
+so cached stats for that window are invalidated.
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import insert
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+import logging
+
+from ..models import UsageLog
+from ..cache import publish_data_changed
+from ..metrics import ingest_rows
+from .app_filter import app_filter
+from . import rollup_service
+
+logger = logging.getLogger("ingest_service")
+
+
+def build_usage_rows(
+    device_id: int,
+    usage_logs: list,
+    default_timestamp: datetime
+) -> Tuple[List[Dict], int]:
+    """
+    Build insertable rows from agent usage log entries.
+
+    Non-trackable apps (blacklisted / system processes) are dropped.
+
+    Returns:
+        Tuple of (rows, filtered_count)
+    """
+    rows = []
+    filtered_count = 0
+
+    for log_data in usage_logs:
+        if not app_filter.is_trackable(log_data.app_name):
+            filtered_count += 1
+            logger.debug(f"Filtered non-trackable app: {log_data.app_name}")
+            continue
+
+        rows.append({
+            "device_id": device_id,
+            "app_name": log_data.app_name,
+            "window_title": log_data.window_title,
+            "exe_path": log_data.exe_path,
+            "duration": log_data.duration,
+            "is_focused": log_data.is_focused,
+            "timestamp": log_data.timestamp or default_timestamp
+        })
+
+    return rows, filtered_count
+
+
+def bulk_insert_usage_logs(db: Session, rows: List[Dict]) -> int:
+    """
+    Insert usage rows in a single statement (executemany).
+
+    Does not commit - the caller owns the transaction so the device row
+    update can be committed together with the batch.
+    """
+    if not rows:
+        return 0
+    db.execute(insert(UsageLog), rows)
+    return len(rows)
+
+
+def write_usage_rows(db: Session, rows: List[Dict], offset_seconds: int = 0) -> int:
+    """
+    Insert usage rows and fold them into the rollup tables (no commit).
+
+    Args:
+        offset_seconds: Device timezone offset used to bucket local days
+    """
+    inserted = bulk_insert_usage_logs(db, rows)
+    if inserted:
+        rollup_service.RollupBatch().add_rows(rows, offset_seconds).apply(db)
+        ingest_rows.inc(inserted)
+    return inserted
+
+
+def usage_changed_ranges(rows: List[Dict]) -> Dict[int, Tuple[datetime, datetime]]:
+    """Per-device (first timestamp, last timestamp + duration) of a batch, UTC."""
+    ranges: Dict[int, Tuple[datetime, datetime]] = {}
+    for row in rows:
+        ts = row["timestamp"]
+        ts = ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+        end = ts + timedelta(seconds=row.get("duration") or 0)
+        current = ranges.get(row["device_id"])
+        if current is None:
+            ranges[row["device_id"]] = (ts, end)
+        else:
+            ranges[row["device_id"]] = (min(current[0], ts), max(current[1], end))
+    return ranges
+
+
+def publish_usage_changed(rows: List[Dict]):
+    """Publish "data changed" events for committed rows (invalidates stats_cache)."""
+    for device_id, (since, until) in usage_changed_ranges(rows).items():
+        publish_data_changed(device_id, since, until)
+
+
+def submit_usage_rows(db: Session, rows: List[Dict], offset_seconds: int = 0) -> bool:
+    """
+    Hand usage rows to the write-behind queue.
+
+    Falls back to writing into the caller's transaction when the writer
+    task is not running or the queue is full.
+
+    Returns:
+        True if the rows were queued, False if they were added to `db`
+        (caller must commit).
+    """
+    from ..write_queue import write_queue
+
+    if write_queue.enqueue_usage(rows, offset_seconds):
+        return True
+    write_usage_rows(db, rows, offset_seconds)
+    return False
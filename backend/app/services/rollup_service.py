@@ -0,0 +1,601 @@
+"""
+Usage rollup service.
+
+Maintains usage_daily_rollup, usage_hourly_rollup and the all-time
+device_usage_totals incrementally at ingest time and serves per-day
+series and per-hour totals to the stats endpoints.
+
+Unique minutes use the same definition as the raw queries
+(COUNT DISTINCT of the minute the log was written in), stored as a
+1440-bit bitmap per (device, local day, app). Per-day totals OR the
+app bitmaps together, so a minute used by two apps counts once.
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+from ..models import Device, UsageLog, UsageDailyRollup, UsageHourlyRollup, DeviceUsageTotals
+from ..db_utils import date_expr, hour_expr
+
+logger = logging.getLogger("rollup_service")
+
+MINUTES_PER_DAY = 1440
+BITMAP_BYTES = MINUTES_PER_DAY // 8
+
+# (device_id, local_date, app_name)
+RollupKey = Tuple[int, str, str]
+# (device_id, UTC hour_start, app_name)
+HourlyKey = Tuple[int, datetime, str]
+
+
+def _as_utc(ts: datetime) -> datetime:
+    """Naive timestamps in usage_logs are UTC."""
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc)
+
+
+def bitmap_to_bytes(bitmap: int) -> bytes:
+    """Serialize minute bitmap (bit N = minute N) to fixed-size bytes."""
+    return bitmap.to_bytes(BITMAP_BYTES, "little")
+
+
+def bitmap_from_bytes(data: Optional[bytes]) -> int:
+    """Deserialize minute bitmap stored in minute_bitmap."""
+    if not data:
+        return 0
+    return int.from_bytes(data, "little")
+
+
+def count_minutes(bitmap: int) -> int:
+    """Number of active minutes in a bitmap."""
+    return bin(bitmap).count("1")
+
+
+class RollupDelta:
+    """Accumulated change for one rollup row."""
+
+    __slots__ = ("total_seconds", "session_count", "first_activity", "last_activity", "bitmap")
+
+    def __init__(self):
+        self.total_seconds = 0
+        self.session_count = 0
+        self.first_activity: Optional[datetime] = None
+        self.last_activity: Optional[datetime] = None
+        self.bitmap = 0
+
+    def add(self, ts_utc: datetime, minute_of_day: int, duration: int):
+        self.total_seconds += duration or 0
+        self.session_count += 1
+        if self.first_activity is None or ts_utc < self.first_activity:
+            self.first_activity = ts_utc
+        if self.last_activity is None or ts_utc > self.last_activity:
+            self.last_activity = ts_utc
+        self.bitmap |= 1 << minute_of_day
+
+    def merge(self, other: "RollupDelta"):
+        self.total_seconds += other.total_seconds
+        self.session_count += other.session_count
+        if other.first_activity and (self.first_activity is None or other.first_activity < self.first_activity):
+            self.first_activity = other.first_activity
+        if other.last_activity and (self.last_activity is None or other.last_activity > self.last_activity):
+            self.last_activity = other.last_activity
+        self.bitmap |= other.bitmap
+
+
+class HourlyDelta:
+    """Accumulated change for one hourly rollup row."""
+
+    __slots__ = ("total_seconds", "session_count")
+
+    def __init__(self):
+        self.total_seconds = 0
+        self.session_count = 0
+
+    def add(self, duration: int):
+        self.total_seconds += duration or 0
+        self.session_count += 1
+
+    def merge(self, other: "HourlyDelta"):
+        self.total_seconds += other.total_seconds
+        self.session_count += other.session_count
+
+
+def aggregate_rows(
+    rows: Iterable[dict],
+    offset_seconds: int,
+    into: Optional[Dict[RollupKey, RollupDelta]] = None
+) -> Dict[RollupKey, RollupDelta]:
+    """
+    Fold usage rows (dicts with device_id, app_name, duration, timestamp)
+    into rollup deltas keyed by device-local day.
+
+    Args:
+        rows: Usage rows as built by ingest_service.build_usage_rows
+        offset_seconds: Device timezone offset (local - UTC) at ingest
+        into: Existing delta dict to merge into (coalescing across reports)
+    """
+    deltas = into if into is not None else {}
+    offset = timedelta(seconds=offset_seconds or 0)
+
+    for row in rows:
+        ts_utc = _as_utc(row["timestamp"])
+        local = ts_utc + offset
+        key = (row["device_id"], local.strftime("%Y-%m-%d"), row["app_name"])
+        delta = deltas.get(key)
+        if delta is None:
+            delta = deltas[key] = RollupDelta()
+        delta.add(ts_utc, local.hour * 60 + local.minute, row["duration"])
+
+    return deltas
+
+
+def apply_deltas(db: Session, deltas: Dict[RollupKey, RollupDelta]) -> int:
+    """
+    Merge deltas into usage_daily_rollup (read-modify-write, no commit).
+
+    Must run in the same transaction as the usage_logs insert it describes.
+    Returns number of rollup rows touched.
+    """
+    if not deltas:
+        return 0
+
+    # Load existing rows: one query per device covering its dates and apps
+    by_device: Dict[int, List[RollupKey]] = {}
+    for key in deltas:
+        by_device.setdefault(key[0], []).append(key)
+
+    existing: Dict[RollupKey, UsageDailyRollup] = {}
+    for device_id, keys in by_device.items():
+        dates = {k[1] for k in keys}
+        apps = {k[2] for k in keys}
+        rows = db.query(UsageDailyRollup).filter(
+            UsageDailyRollup.device_id == device_id,
+            UsageDailyRollup.local_date.in_(dates),
+            UsageDailyRollup.app_name.in_(apps)
+        ).all()
+        for row in rows:
+            existing[(row.device_id, row.local_date, row.app_name)] = row
+
+    for key, delta in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            db.add(UsageDailyRollup(
+                device_id=key[0],
+                local_date=key[1],
+                app_name=key[2],
+                total_seconds=delta.total_seconds,
+                session_count=delta.session_count,
+                first_activity=delta.first_activity,
+                last_activity=delta.last_activity,
+                minute_bitmap=bitmap_to_bytes(delta.bitmap)
+            ))
+            continue
+
+        row.total_seconds = (row.total_seconds or 0) + delta.total_seconds
+        row.session_count = (row.session_count or 0) + delta.session_count
+        if row.first_activity is None or delta.first_activity < _as_utc(row.first_activity):
+            row.first_activity = delta.first_activity
+        if row.last_activity is None or delta.last_activity > _as_utc(row.last_activity):
+            row.last_activity = delta.last_activity
+        row.minute_bitmap = bitmap_to_bytes(bitmap_from_bytes(row.minute_bitmap) | delta.bitmap)
+
+    db.flush()
+    return len(deltas)
+
+
+def hour_start_utc(ts: datetime) -> datetime:
+    """UTC hour bucket for a timestamp."""
+    return _as_utc(ts).replace(minute=0, second=0, microsecond=0)
+
+
+def aggregate_hourly_rows(
+    rows: Iterable[dict],
+    into: Optional[Dict[HourlyKey, HourlyDelta]] = None
+) -> Dict[HourlyKey, HourlyDelta]:
+    """Fold usage rows into hourly deltas keyed by UTC hour bucket."""
+    deltas = into if into is not None else {}
+    for row in rows:
+        key = (row["device_id"], hour_start_utc(row["timestamp"]), row["app_name"])
+        delta = deltas.get(key)
+        if delta is None:
+            delta = deltas[key] = HourlyDelta()
+        delta.add(row["duration"])
+    return deltas
+
+
+def apply_hourly_deltas(db: Session, deltas: Dict[HourlyKey, HourlyDelta]) -> int:
+    """
+    Merge hourly deltas into usage_hourly_rollup (read-modify-write, no commit).
+
+    Returns number of rollup rows touched.
+    """
+    if not deltas:
+        return 0
+
+    by_device: Dict[int, List[HourlyKey]] = {}
+    for key in deltas:
+        by_device.setdefault(key[0], []).append(key)
+
+    existing: Dict[HourlyKey, UsageHourlyRollup] = {}
+    for device_id, keys in by_device.items():
+        hours = [k[1] for k in keys]
+        apps = {k[2] for k in keys}
+        rows = db.query(UsageHourlyRollup).filter(
+            UsageHourlyRollup.device_id == device_id,
+            UsageHourlyRollup.hour_start >= min(hours),
+            UsageHourlyRollup.hour_start <= max(hours),
+            UsageHourlyRollup.app_name.in_(apps)
+        ).all()
+        for row in rows:
+            existing[(row.device_id, _as_utc(row.hour_start), row.app_name)] = row
+
+    for key, delta in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            db.add(UsageHourlyRollup(
+                device_id=key[0],
+                hour_start=key[1],
+                app_name=key[2],
+                total_seconds=delta.total_seconds,
+                session_count=delta.session_count
+            ))
+            continue
+        row.total_seconds = (row.total_seconds or 0) + delta.total_seconds
+        row.session_count = (row.session_count or 0) + delta.session_count
+
+    db.flush()
+    return len(deltas)
+
+
+def apply_totals(db: Session, deltas: Dict[RollupKey, RollupDelta]) -> int:
+    """
+    Add daily deltas to device_usage_totals (read-modify-write, no commit).
+
+    Returns number of devices touched.
+    """
+    if not deltas:
+        return 0
+
+    totals: Dict[int, List] = {}
+    for (device_id, _, _), delta in deltas.items():
+        pending = totals.get(device_id)
+        if pending is None:
+            totals[device_id] = [delta.total_seconds, delta.last_activity]
+        else:
+            pending[0] += delta.total_seconds
+            pending[1] = max(pending[1], delta.last_activity)
+
+    existing = {
+        row.device_id: row
+        for row in db.query(DeviceUsageTotals).filter(DeviceUsageTotals.device_id.in_(totals.keys())).all()
+    }
+    for device_id, (seconds, last_activity) in totals.items():
+        row = existing.get(device_id)
+        if row is None:
+            db.add(DeviceUsageTotals(
+                device_id=device_id,
+                total_usage_seconds=seconds,
+                last_usage_at=last_activity
+            ))
+            continue
+        row.total_usage_seconds = (row.total_usage_seconds or 0) + seconds
+        if row.last_usage_at is None or last_activity > _as_utc(row.last_usage_at):
+            row.last_usage_at = last_activity
+
+    db.flush()
+    return len(totals)
+
+
+class RollupBatch:
+    """Daily and hourly deltas for one batch of usage rows.
+
+    Coalesces any number of reports; apply() writes both rollup tables and
+    the device totals in the caller's transaction.
+    """
+
+    __slots__ = ("daily", "hourly")
+
+    def __init__(self):
+        self.daily: Dict[RollupKey, RollupDelta] = {}
+        self.hourly: Dict[HourlyKey, HourlyDelta] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.daily or self.hourly)
+
+    def add_rows(self, rows: Iterable[dict], offset_seconds: int = 0) -> "RollupBatch":
+        rows = rows if isinstance(rows, list) else list(rows)
+        aggregate_rows(rows, offset_seconds, into=self.daily)
+        aggregate_hourly_rows(rows, into=self.hourly)
+        return self
+
+    def merge(self, other: "RollupBatch"):
+        """Merge another batch into this one."""
+        for target, source in ((self.daily, other.daily), (self.hourly, other.hourly)):
+            for key, delta in source.items():
+                pending = target.get(key)
+                if pending is None:
+                    target[key] = delta
+                else:
+                    pending.merge(delta)
+
+    def apply(self, db: Session) -> int:
+        """Write both rollup tables and device totals (no commit). Returns rows touched."""
+        return (
+            apply_deltas(db, self.daily)
+            + apply_hourly_deltas(db, self.hourly)
+            + apply_totals(db, self.daily)
+        )
+
+
+def rebuild_device(db: Session, device_id: int, batch_size: int = 5000) -> int:
+    """
+    Rebuild a device's daily and hourly rollups and its usage totals from
+    raw usage_logs (backfill / repair).
+
+    Deletes first so the write lock is held before raw rows are read -
+    concurrent ingest then applies its deltas on top of the rebuilt rows.
+    Commits. Returns number of usage_logs rows folded in.
+    """
+    device = db.query(Device).filter(Device.id == device_id).first()
+    if not device:
+        return 0
+    offset_seconds = device.timezone_offset or 0
+
+    db.query(UsageDailyRollup).filter(UsageDailyRollup.device_id == device_id).delete(synchronize_session=False)
+    db.query(UsageHourlyRollup).filter(UsageHourlyRollup.device_id == device_id).delete(synchronize_session=False)
+    db.query(DeviceUsageTotals).filter(DeviceUsageTotals.device_id == device_id).delete(synchronize_session=False)
+
+    batch = RollupBatch()
+    count = 0
+    logs = db.query(
+        UsageLog.device_id, UsageLog.app_name, UsageLog.duration, UsageLog.timestamp
+    ).filter(
+        UsageLog.device_id == device_id,
+        UsageLog.timestamp.isnot(None)
+    ).yield_per(batch_size)
+
+    for log in logs:
+        batch.add_rows([log._asdict()], offset_seconds)
+        count += 1
+
+    batch.apply(db)
+    totals = db.query(DeviceUsageTotals).filter(DeviceUsageTotals.device_id == device_id).first()
+    if totals is not None:
+        totals.reconciled_at = datetime.now(timezone.utc)
+    db.commit()
+    logger.info(
+        f"Rebuilt rollups for device {device_id}: {count} logs -> "
+        f"{len(batch.daily)} daily, {len(batch.hourly)} hourly rows"
+    )
+    return count
+
+
+def trim_before(db: Session, device_id: int, cutoff: datetime, offset_seconds: int = 0) -> int:
+    """
+    Drop a device's rollup rows for usage before cutoff, after its usage_logs
+    older than cutoff were deleted (no commit).
+
+    Hours and local days entirely before cutoff are deleted; the hour and
+    the local day containing cutoff are rebuilt from the remaining logs.
+    Totals are not touched - follow with reconcile_totals().
+    Returns number of usage_logs rows folded back in.
+    """
+    cutoff = _as_utc(cutoff)
+    offset = timedelta(seconds=offset_seconds or 0)
+    boundary_hour = hour_start_utc(cutoff)
+    local = cutoff + offset
+    boundary_date = local.strftime("%Y-%m-%d")
+    day_end = local.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1) - offset
+    hour_end = boundary_hour + timedelta(hours=1)
+
+    db.query(UsageHourlyRollup).filter(
+        UsageHourlyRollup.device_id == device_id,
+        UsageHourlyRollup.hour_start <= boundary_hour
+    ).delete(synchronize_session=False)
+    db.query(UsageDailyRollup).filter(
+        UsageDailyRollup.device_id == device_id,
+        UsageDailyRollup.local_date <= boundary_date
+    ).delete(synchronize_session=False)
+
+    logs = [
+        log._asdict() for log in db.query(
+            UsageLog.device_id, UsageLog.app_name, UsageLog.duration, UsageLog.timestamp
+        ).filter(
+            UsageLog.device_id == device_id,
+            UsageLog.timestamp >= cutoff,
+            UsageLog.timestamp < max(day_end, hour_end)
+        )
+    ]
+    apply_deltas(db, aggregate_rows([log for log in logs if _as_utc(log["timestamp"]) < day_end], offset_seconds))
+    apply_hourly_deltas(db, aggregate_hourly_rows([log for log in logs if _as_utc(log["timestamp"]) < hour_end]))
+    return len(logs)
+
+
+def rebuild_all(db: Session) -> int:
+    """Rebuild rollups for every device. Returns total logs folded in."""
+    total = 0
+    for (device_id,) in db.query(Device.id).all():
+        total += rebuild_device(db, device_id)
+    return total
+
+
+def needs_backfill(db: Session) -> bool:
+    """True when usage_logs has data but a rollup table is empty (fresh upgrade)."""
+    has_daily = db.query(UsageDailyRollup.id).first() is not None
+    has_hourly = db.query(UsageHourlyRollup.id).first() is not None
+    if has_daily and has_hourly:
+        return False
+    return db.query(UsageLog.id).first() is not None
+
+
+def reconcile_totals(db: Session, device_id: Optional[int] = None) -> int:
+    """
+    Compare device_usage_totals with SUM/MAX over usage_logs and repair drift.
+
+    Stamps reconciled_at first so the write lock (SQLite) / row locks
+    (PostgreSQL) are held before usage_logs is read - concurrent ingest
+    then lands its increments on top of the repaired values.
+    Commits. Returns number of devices whose totals were corrected.
+    """
+    now = datetime.now(timezone.utc)
+    totals_query = db.query(DeviceUsageTotals)
+    logs_query = db.query(
+        UsageLog.device_id,
+        func.sum(UsageLog.duration).label('total_seconds'),
+        func.max(UsageLog.timestamp).label('last_usage')
+    )
+    if device_id is not None:
+        totals_query = totals_query.filter(DeviceUsageTotals.device_id == device_id)
+        logs_query = logs_query.filter(UsageLog.device_id == device_id)
+
+    totals_query.update({DeviceUsageTotals.reconciled_at: now}, synchronize_session=False)
+    existing = {row.device_id: row for row in totals_query.all()}
+    actual = {
+        row.device_id: (int(row.total_seconds or 0), _as_utc(row.last_usage) if row.last_usage else None)
+        for row in logs_query.group_by(UsageLog.device_id).all()
+    }
+
+    repaired = 0
+    for dev_id in set(existing) | set(actual):
+        seconds, last_usage = actual.get(dev_id, (0, None))
+        row = existing.get(dev_id)
+        if row is None:
+            db.add(DeviceUsageTotals(
+                device_id=dev_id,
+                total_usage_seconds=seconds,
+                last_usage_at=last_usage,
+                reconciled_at=now
+            ))
+            repaired += 1
+            continue
+        stored_last = _as_utc(row.last_usage_at) if row.last_usage_at else None
+        if (row.total_usage_seconds or 0) != seconds or stored_last != last_usage:
+            logger.warning(
+                f"Usage totals drift for device {dev_id}: "
+                f"{row.total_usage_seconds}s/{stored_last} -> {seconds}s/{last_usage}"
+            )
+            row.total_usage_seconds = seconds
+            row.last_usage_at = last_usage
+            repaired += 1
+
+    db.commit()
+    return repaired
+
+
+def get_daily_series(
+    db: Session,
+    device_id: int,
+    start_date: str,
+    end_date: str,
+    app_names: Optional[List[str]] = None
+) -> Dict[str, dict]:
+    """
+    Per-day stats for local dates start_date..end_date (inclusive, YYYY-MM-DD).
+
+    Args:
+        app_names: Lowercase app name variants to restrict to (see
+            stats_service.get_app_name_variants); None = all apps
+
+    Returns:
+        {date: {"minutes", "total_seconds", "apps_count", "apps", "sessions_count",
+                "first_activity", "last_activity"}} - only days with data
+    """
+    query = db.query(UsageDailyRollup).filter(
+        UsageDailyRollup.device_id == device_id,
+        UsageDailyRollup.local_date >= start_date,
+        UsageDailyRollup.local_date <= end_date
+    )
+    if app_names is not None:
+        query = query.filter(func.lower(UsageDailyRollup.app_name).in_(app_names))
+
+    days: Dict[str, dict] = {}
+    bitmaps: Dict[str, int] = {}
+    for row in query.all():
+        day = days.get(row.local_date)
+        if day is None:
+            day = days[row.local_date] = {
+                "minutes": 0,
+                "total_seconds": 0,
+                "apps_count": 0,
+                "apps": [],
+                "sessions_count": 0,
+                "first_activity": None,
+                "last_activity": None,
+            }
+            bitmaps[row.local_date] = 0
+        day["total_seconds"] += row.total_seconds or 0
+        day["sessions_count"] += row.session_count or 0
+        day["apps_count"] += 1
+        day["apps"].append(row.app_name)
+        if row.first_activity is not None:
+            first = _as_utc(row.first_activity)
+            if day["first_activity"] is None or first < day["first_activity"]:
+                day["first_activity"] = first
+        if row.last_activity is not None:
+            last = _as_utc(row.last_activity)
+            if day["last_activity"] is None or last > day["last_activity"]:
+                day["last_activity"] = last
+        bitmaps[row.local_date] |= bitmap_from_bytes(row.minute_bitmap)
+
+    for date, bitmap in bitmaps.items():
+        days[date]["minutes"] = count_minutes(bitmap)
+
+    return days
+
+
+def get_usage_totals(db: Session, device_id: int) -> Tuple[int, Optional[datetime]]:
+    """
+    All-time (total_seconds, last_activity) for a device from device_usage_totals.
+
+    Falls back to summing the daily rollup until the device has a totals row.
+    """
+    totals = db.query(DeviceUsageTotals).filter(DeviceUsageTotals.device_id == device_id).first()
+    if totals is not None:
+        return int(totals.total_usage_seconds or 0), totals.last_usage_at
+    row = db.query(
+        func.sum(UsageDailyRollup.total_seconds).label('total_seconds'),
+        func.max(UsageDailyRollup.last_activity).label('last_activity')
+    ).filter(UsageDailyRollup.device_id == device_id).first()
+    if row is None:
+        return 0, None
+    return int(row.total_seconds or 0), row.last_activity
+
+
+def get_hourly_totals(
+    db: Session,
+    device_id: int,
+    start: datetime,
+    app_names: Optional[List[str]] = None,
+    offset_seconds: int = 0
+) -> List[Tuple[str, int, int]]:
+    """
+    Usage seconds per device-local date and hour from `start` on (summed across apps).
+
+    Local date/hour are computed in SQL from hour_start + offset_seconds,
+    which is exact only for whole-hour offsets; stats_service reads
+    usage_logs instead for offsets like +05:30.
+
+    Args:
+        app_names: Lowercase app name variants to restrict to; None = all apps
+
+    Returns:
+        [(local_date, local_hour, total_seconds)] for hours with data
+    """
+    local_date = date_expr(db, UsageHourlyRollup.hour_start, offset_seconds)
+    local_hour = hour_expr(db, UsageHourlyRollup.hour_start, offset_seconds)
+    query = db.query(
+        local_date.label('date'),
+        local_hour.label('hour'),
+        func.sum(UsageHourlyRollup.total_seconds).label('total_seconds')
+    ).filter(
+        UsageHourlyRollup.device_id == device_id,
+        UsageHourlyRollup.hour_start >= hour_start_utc(start)
+    )
+    if app_names is not None:
+        query = query.filter(func.lower(UsageHourlyRollup.app_name).in_(app_names))
+
+    rows = query.group_by(local_date, local_hour).all()
+    return [(row.date, int(row.hour), int(row.total_seconds or 0)) for row in rows]
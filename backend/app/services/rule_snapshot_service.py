@@ -0,0 +1,213 @@
+"""
+Compiled rule snapshots for the agents.
+
+The agent fetch used to load the enabled rules, run RuleResponse.model_validate
+on every row and re-parse '0-6' day ranges on each request. A snapshot is that
+work done once per rule-set version: rules compiled to plain dicts (schedule
+times zero-padded, day ranges expanded, app lists lowercased) and serialized
+to JSON bytes, which the fetch endpoint splices into its response as-is.
+
+Snapshots are keyed by the device and its rules_version (rule_version_service),
+so a rule change never has to invalidate anything here: the next fetch sees a
+new version and compiles again. With several workers each keeps its own copy.
+
+build_rules_push() turns the same snapshot into the WebSocket "rules" message
+sent after a rule change, either the full set or a delta (upsert / remove by
+rule id) against the previously compiled version.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import logging
+
+from pydantic_core import to_json
+from sqlalchemy.orm import Session
+
+from ..models import Device, Rule
+from .rule_version_service import get_rules_version
+
+logger = logging.getLogger(__name__)
+
+MAX_SNAPSHOTS = 2048  # devices kept; least recently fetched are dropped first
+
+# Same fields and order as schemas.RuleResponse
+RULE_FIELDS = (
+    "id", "device_id", "rule_type", "name", "app_name", "website_url", "time_limit", "enabled",
+    "schedule_start_time", "schedule_end_time", "schedule_days", "block_network", "created_at", "updated_at",
+)
+
+
+def normalize_time(value: Optional[str]) -> Optional[str]:
+    """'8:5' -> '08:05'; values that are not H:MM are returned unchanged."""
+    if not value:
+        return value
+    parts = value.strip().split(":")
+    try:
+        hours, minutes = int(parts[0]), int(parts[1])
+    except (ValueError, IndexError):
+        return value
+    if len(parts) != 2 or not (0 <= hours <= 24 and 0 <= minutes <= 59):
+        return value
+    return f"{hours:02d}:{minutes:02d}"
+
+
+def expand_days(value: Optional[str]) -> Optional[str]:
+    """'0-4,6' -> '0,1,2,3,4,6' (sorted, unique); unparseable values are returned unchanged."""
+    if not value:
+        return value
+    days = set()
+    try:
+        for part in value.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            if "-" in part:
+                start, end = (int(x) for x in part.split("-", 1))
+                if start > end:
+                    return value
+                days.update(range(start, end + 1))
+            else:
+                days.add(int(part))
+    except ValueError:
+        return value
+    return ",".join(str(day) for day in sorted(days))
+
+
+def normalize_app_list(value: Optional[str]) -> Optional[str]:
+    """'Chrome.exe, Steam' -> 'chrome.exe,steam' (agents match app names case-insensitively)."""
+    if not value:
+        return value
+    return ",".join(name.strip().lower() for name in value.split(",") if name.strip())
+
+
+def compile_rule(rule: Rule) -> Dict[str, Any]:
+    """Agent view of one rule (RuleResponse fields, normalized values)."""
+    data = {field: getattr(rule, field) for field in RULE_FIELDS}
+    data["app_name"] = normalize_app_list(rule.app_name)
+    data["schedule_start_time"] = normalize_time(rule.schedule_start_time)
+    data["schedule_end_time"] = normalize_time(rule.schedule_end_time)
+    data["schedule_days"] = expand_days(rule.schedule_days)
+    data["block_network"] = bool(rule.block_network)
+    return data
+
+
+class RuleSnapshot:
+    """Compiled enabled rules of one device at one rules_version."""
+
+    __slots__ = ("device_id", "device_uid", "version", "rules", "rules_json", "compiled_at")
+
+    def __init__(self, device_id: int, device_uid: str, version: int, rules: List[Dict[str, Any]]):
+        self.device_id = device_id
+        self.device_uid = device_uid  # devices.device_id; guards against a reused DB id
+        self.version = version
+        self.rules = rules
+        self.rules_json = to_json(rules)
+        self.compiled_at = datetime.now()
+
+
+class RuleSnapshotCache:
+    """Thread-safe LRU of the latest snapshot per device."""
+
+    def __init__(self, max_entries: int = MAX_SNAPSHOTS):
+        self.max_entries = max_entries
+        self._snapshots: "OrderedDict[int, RuleSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, db: Session, device: Device, version: int) -> RuleSnapshot:
+        """Snapshot for the device's current version, compiled on a miss."""
+        with self._lock:
+            snapshot = self._snapshots.get(device.id)
+            if snapshot is not None and snapshot.version == version and snapshot.device_uid == device.device_id:
+                self._snapshots.move_to_end(device.id)
+                self._hits += 1
+                return snapshot
+            self._misses += 1
+
+        snapshot = self.compile(db, device, version)
+        with self._lock:
+            current = self._snapshots.get(device.id)
+            # A concurrent fetch may already have stored a newer version
+            if current is None or current.version <= version or current.device_uid != device.device_id:
+                self._snapshots[device.id] = snapshot
+                self._snapshots.move_to_end(device.id)
+                while len(self._snapshots) > self.max_entries:
+                    self._snapshots.popitem(last=False)
+        return snapshot
+
+    @staticmethod
+    def compile(db: Session, device: Device, version: int) -> RuleSnapshot:
+        rules = db.query(Rule).filter(
+            Rule.device_id == device.id,
+            Rule.enabled == True
+        ).order_by(Rule.id).all()
+        snapshot = RuleSnapshot(device.id, device.device_id, version, [compile_rule(r) for r in rules])
+        logger.info(f"Compiled rules for device_id={device.device_id} (db_id={device.id}): "
+                    f"version={version}, {len(rules)} rules, {len(snapshot.rules_json)} bytes")
+        return snapshot
+
+    def peek(self, device_id: int) -> Optional[RuleSnapshot]:
+        """Latest compiled snapshot of a device without compiling or counting a lookup."""
+        with self._lock:
+            return self._snapshots.get(device_id)
+
+    def forget(self, device_id: int):
+        """Drop a device's snapshot (e.g. after deletion)."""
+        with self._lock:
+            self._snapshots.pop(device_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._snapshots),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+rule_snapshots = RuleSnapshotCache()
+
+
+def rules_delta(previous: RuleSnapshot, snapshot: RuleSnapshot) -> Dict[str, Any]:
+    """Rules added or changed since previous (upsert) and ids no longer present (remove)."""
+    old = {rule["id"]: rule for rule in previous.rules}
+    new_ids = {rule["id"] for rule in snapshot.rules}
+    return {
+        "base_version": previous.version,
+        "upsert": [rule for rule in snapshot.rules if old.get(rule["id"]) != rule],
+        "remove": sorted(rule_id for rule_id in old if rule_id not in new_ids),
+    }
+
+
+def build_rules_push(db: Session, device: Device, allow_delta: bool = True) -> str:
+    """
+    WebSocket message with the device's current rules.
+
+    Full set: {"type": "rules", "payload": {"rules": [...], "rules_version": N, ...}}.
+    With allow_delta and a previously compiled older version the payload holds
+    base_version / upsert / remove instead, when that is smaller. Agents apply a
+    delta only if their rules_version equals base_version and fetch otherwise.
+    """
+    previous = rule_snapshots.peek(device.id)
+    snapshot = rule_snapshots.get(db, device, get_rules_version(db, device.id))
+    meta = {
+        "rules_version": snapshot.version,
+        "settings_protection": device.settings_protection or "full",
+        "settings_exceptions": device.settings_exceptions,
+    }
+    full = b'{"type":"rules","payload":{"rules":' + snapshot.rules_json + b"," + to_json(meta)[1:] + b"}"
+    if allow_delta and previous is not None and previous.device_uid == snapshot.device_uid \
+            and previous.version < snapshot.version:
+        delta = to_json({"type": "rules", "payload": {**meta, **rules_delta(previous, snapshot)}})
+        if len(delta) < len(full):
+            return delta.decode()
+    return full.decode()
@@ -0,0 +1,55 @@
+"""
+Rule-set versions per device.
+
+Every change that alters what /api/rules/agent/fetch returns for a device
+(rule create / update / delete, lock, unlock, internet pause, settings
+protection) calls bump_rules_version() before its commit. The fetch
+endpoint reports the version; an agent that sends it back as known_version
+gets only the usage numbers while the version stays the same.
+"""
+from datetime import datetime, timezone
+from typing import Iterable
+
+from sqlalchemy.orm import Session
+
+from ..models import DeviceRuleState
+
+
+def get_rules_version(db: Session, device_id: int) -> int:
+    """Current rule-set version (0 until the first change)."""
+    version = db.query(DeviceRuleState.version).filter(DeviceRuleState.device_id == device_id).scalar()
+    return version or 0
+
+
+def bump_rules_version(db: Session, device_id: int) -> None:
+    """Increment the device's version in the caller's transaction (no commit)."""
+    updated = db.query(DeviceRuleState).filter(DeviceRuleState.device_id == device_id).update(
+        {
+            DeviceRuleState.version: DeviceRuleState.version + 1,
+            DeviceRuleState.updated_at: datetime.now(timezone.utc),
+        },
+        synchronize_session=False
+    )
+    if not updated:
+        db.add(DeviceRuleState(device_id=device_id, version=1, updated_at=datetime.now(timezone.utc)))
+
+
+def bump_rules_versions(db: Session, device_ids: Iterable[int]) -> None:
+    """bump_rules_version() for several devices with one UPDATE (no commit)."""
+    device_ids = set(device_ids)
+    if not device_ids:
+        return
+    now = datetime.now(timezone.utc)
+    existing = {
+        device_id for (device_id,) in
+        db.query(DeviceRuleState.device_id).filter(DeviceRuleState.device_id.in_(device_ids))
+    }
+    if existing:
+        db.query(DeviceRuleState).filter(DeviceRuleState.device_id.in_(existing)).update(
+            {DeviceRuleState.version: DeviceRuleState.version + 1, DeviceRuleState.updated_at: now},
+            synchronize_session=False
+        )
+    db.add_all([
+        DeviceRuleState(device_id=device_id, version=1, updated_at=now)
+        for device_id in sorted(device_ids - existing)
+    ])
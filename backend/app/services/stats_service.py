@@ -5,12 +5,14 @@ Common helpers for stats endpoints to reduce code duplication.
 """
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
 from dateutil import parser
 
 from ..models import UsageLog
-from ..db_utils import minute_bucket, hour_expr, day_range_utc
+from ..config import settings
+from ..db_utils import minute_bucket, date_expr, hour_expr, day_range_utc
+from . import rollup_service
 
 
 def get_app_name_variants(app_name: str) -> List[str]:
@@ -118,6 +120,75 @@ def get_day_stats(
     return (stats.apps_count or 0, stats.sessions_count or 0) if stats else (0, 0)
 
 
+def get_day_range_stats(
+    db: Session,
+    device_id: int,
+    start_date: str,
+    end_date: str,
+    offset_seconds: int = 0
+) -> Dict[str, dict]:
+    """
+    Per-day stats for dates start_date..end_date (inclusive) in one grouped query.
+    
+    Replaces the per-day calls to calculate_day_usage_minutes,
+    get_activity_boundaries and get_day_stats (four round trips per day).
+    Days are device-local (offset_seconds) and bucketed in SQL.
+    
+    Returns:
+        {date: {"minutes", "total_seconds", "apps_count", "sessions_count",
+                "first_activity", "last_activity"}} - only days with data,
+        same shape as rollup_service.get_daily_series
+    """
+    range_start, _ = day_range_utc(start_date, offset_seconds)
+    _, range_end = day_range_utc(end_date, offset_seconds)
+    day = date_expr(db, UsageLog.timestamp, offset_seconds)
+    
+    rows = db.query(
+        day.label('date'),
+        func.count(func.distinct(minute_bucket(db, UsageLog.timestamp))).label('minutes'),
+        func.sum(UsageLog.duration).label('total_seconds'),
+        func.count(func.distinct(UsageLog.app_name)).label('apps_count'),
+        func.count(UsageLog.id).label('sessions_count'),
+        func.min(UsageLog.timestamp).label('first_activity'),
+        func.max(UsageLog.timestamp).label('last_activity')
+    ).filter(
+        UsageLog.device_id == device_id,
+        UsageLog.timestamp >= range_start,
+        UsageLog.timestamp < range_end
+    ).group_by(day).all()
+    
+    days = {}
+    for row in rows:
+        days[row.date] = {
+            "minutes": int(row.minutes or 0),
+            "total_seconds": int(row.total_seconds or 0),
+            "apps_count": int(row.apps_count or 0),
+            "sessions_count": int(row.sessions_count or 0),
+            "first_activity": _as_utc(row.first_activity),
+            "last_activity": _as_utc(row.last_activity)
+        }
+    return days
+
+
+def get_daily_usage_series(
+    db: Session,
+    device_id: int,
+    start_date: str,
+    end_date: str,
+    offset_seconds: int = 0
+) -> Dict[str, dict]:
+    """
+    Per-day usage for a range of device-local dates: from usage_daily_rollup
+    when enabled, otherwise one grouped query over usage_logs.
+    
+    offset_seconds must be the offset the rollup was built with
+    (device.timezone_offset).
+    """
+    if settings.USAGE_ROLLUP_ENABLED:
+        return rollup_service.get_daily_series(db, device_id, start_date, end_date)
+    return get_day_range_stats(db, device_id, start_date, end_date, offset_seconds)
+
+
 def get_app_day_duration(
     db: Session, 
     device_id: int, 
@@ -153,6 +224,102 @@ def get_app_total_stats(
     ).first()
 
 
+def get_app_daily_stats(
+    db: Session,
+    device_id: int,
+    app_names: List[str],
+    start_date: str,
+    end_date: str,
+    offset_seconds: int = 0
+) -> Dict[str, dict]:
+    """
+    get_app_total_stats grouped by date: the whole per-day series for an
+    app in one query instead of one query per day. Days are device-local
+    (offset_seconds).
+    
+    Returns:
+        {date: {"total_seconds", "sessions_count", "first_activity",
+                "last_activity"}} - only days with data
+    """
+    range_start, _ = day_range_utc(start_date, offset_seconds)
+    _, range_end = day_range_utc(end_date, offset_seconds)
+    day = date_expr(db, UsageLog.timestamp, offset_seconds)
+    
+    rows = db.query(
+        day.label('date'),
+        func.sum(UsageLog.duration).label('total_duration'),
+        func.count(UsageLog.id).label('sessions_count'),
+        func.min(UsageLog.timestamp).label('first_use'),
+        func.max(UsageLog.timestamp).label('last_use')
+    ).filter(
+        UsageLog.device_id == device_id,
+        func.lower(UsageLog.app_name).in_(app_names),
+        UsageLog.timestamp >= range_start,
+        UsageLog.timestamp < range_end
+    ).group_by(day).all()
+    
+    return {
+        row.date: {
+            "total_seconds": int(row.total_duration or 0),
+            "sessions_count": int(row.sessions_count or 0),
+            "first_activity": _as_utc(row.first_use),
+            "last_activity": _as_utc(row.last_use)
+        }
+        for row in rows
+    }
+
+
+def get_app_daily_series(
+    db: Session,
+    device_id: int,
+    app_names: List[str],
+    start_date: str,
+    end_date: str,
+    offset_seconds: int = 0
+) -> Dict[str, dict]:
+    """Per-day app usage: from usage_daily_rollup when enabled, else get_app_daily_stats."""
+    if settings.USAGE_ROLLUP_ENABLED:
+        return rollup_service.get_daily_series(db, device_id, start_date, end_date, app_names=app_names)
+    return get_app_daily_stats(db, device_id, app_names, start_date, end_date, offset_seconds)
+
+
+def _hourly_rollup_usable(offset_seconds: Optional[int]) -> bool:
+    """usage_hourly_rollup is keyed by UTC hour; it maps onto local hours only for whole-hour offsets."""
+    return settings.USAGE_ROLLUP_ENABLED and not (offset_seconds or 0) % 3600
+
+
+def get_local_hourly_usage(
+    db: Session,
+    device_id: int,
+    start: datetime,
+    offset_seconds: int = 0
+) -> List[Tuple[str, int, int]]:
+    """
+    Usage seconds per device-local date and hour since `start` (heatmap).
+    
+    Reads usage_hourly_rollup when enabled and the offset is a whole number
+    of hours, otherwise groups usage_logs by the offset-aware
+    date_expr/hour_expr in SQL.
+    
+    Returns:
+        [(local_date, local_hour, total_seconds)] for hours with data
+    """
+    if _hourly_rollup_usable(offset_seconds):
+        return rollup_service.get_hourly_totals(db, device_id, start, offset_seconds=offset_seconds)
+    
+    local_date = date_expr(db, UsageLog.timestamp, offset_seconds)
+    local_hour = hour_expr(db, UsageLog.timestamp, offset_seconds)
+    rows = db.query(
+        local_date.label('date'),
+        local_hour.label('hour'),
+        func.sum(UsageLog.duration).label('total_seconds')
+    ).filter(
+        UsageLog.device_id == device_id,
+        UsageLog.timestamp >= start
+    ).group_by(local_date, local_hour).all()
+    return [(row.date, int(row.hour), int(row.total_seconds or 0)) for row in rows]
+
+
 def get_hourly_distribution(
     db: Session,
     device_id: int,
@@ -161,24 +328,30 @@ def get_hourly_distribution(
     timezone_offset_seconds: int = 0
 ) -> List[dict]:
     """Get usage distribution by hour for specific app(s) in device local time.
-    Timestamps in DB are UTC; offset is Client - Server in seconds."""
+    Timestamps in DB are UTC; offset is Client - Server in seconds and is
+    applied in SQL (hour_expr), so half-hour offsets bucket correctly."""
+    usage_by_hour = [{"hour": h, "duration_seconds": 0} for h in range(24)]
+    
+    if _hourly_rollup_usable(timezone_offset_seconds):
+        start = datetime.strptime(start_date, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        for _, hour, total in rollup_service.get_hourly_totals(
+            db, device_id, start, app_names, timezone_offset_seconds
+        ):
+            usage_by_hour[hour]["duration_seconds"] += total
+        return usage_by_hour
+    
+    local_hour = hour_expr(db, UsageLog.timestamp, timezone_offset_seconds)
     hourly_stats = db.query(
-        hour_expr(db, UsageLog.timestamp).label('hour'),
+        local_hour.label('hour'),
         func.sum(UsageLog.duration).label('total')
     ).filter(
         UsageLog.device_id == device_id,
         func.lower(UsageLog.app_name).in_(app_names),
         UsageLog.timestamp >= start_date
-    ).group_by(
-        hour_expr(db, UsageLog.timestamp)
-    ).all()
-    offset_hours = timezone_offset_seconds // 3600
-    usage_by_hour = [{"hour": h, "duration_seconds": 0} for h in range(24)]
+    ).group_by(local_hour).all()
     for stat in hourly_stats:
         if stat.hour is not None:
-            utc_hour = int(stat.hour)
-            local_hour = (utc_hour + offset_hours) % 24
-            usage_by_hour[local_hour]["duration_seconds"] += int(stat.total or 0)
+            usage_by_hour[int(stat.hour)]["duration_seconds"] += int(stat.total or 0)
     return usage_by_hour
 
 
@@ -192,3 +365,39 @@ def format_timestamp_to_time(timestamp) -> Optional[str]:
         return timestamp.strftime('%H:%M')
     except Exception:
         return None
+
+
+def _as_utc(timestamp) -> Optional[datetime]:
+    """Normalize a DB timestamp (naive UTC on SQLite, may be a string) to aware UTC."""
+    if not timestamp:
+        return None
+    if isinstance(timestamp, str):
+        timestamp = parser.parse(timestamp)
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def device_local_now(offset_seconds: int) -> datetime:
+    """Current time on the device (UTC shifted by the device offset)."""
+    return datetime.now(timezone.utc) + timedelta(seconds=offset_seconds or 0)
+
+
+def local_day_strings(offset_seconds: int, days: int) -> List[str]:
+    """Device-local dates (YYYY-MM-DD) for the last `days` days, oldest first."""
+    today = device_local_now(offset_seconds)
+    return [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days - 1, -1, -1)]
+
+
+def local_days_window(start_date: str, end_date: str, offset_seconds: int) -> Tuple[datetime, datetime]:
+    """UTC (start, end) covered by device-local dates start_date..end_date (for stats_cache windows)."""
+    window_start, _ = day_range_utc(start_date, offset_seconds)
+    _, window_end = day_range_utc(end_date, offset_seconds)
+    return window_start, window_end
+
+
+def format_local_time(timestamp: Optional[datetime], offset_seconds: int) -> Optional[str]:
+    """Format a UTC timestamp as HH:MM in device local time."""
+    if not timestamp:
+        return None
+    return (timestamp + timedelta(seconds=offset_seconds or 0)).strftime('%H:%M')
@@ -3,50 +3,141 @@ Summary calculation service.
 
 Business logic for device usage summary calculations,
 extracted from summary_endpoint.py for modularity.
+
+The summary is built from one fetch of the selected day's usage rows
+(fetch_day_logs), one grouped query over the previous week
+(get_week_history) and one rules query; the sub-computations work on
+those in memory instead of each scanning usage_logs again.
 """
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from collections import namedtuple
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 import logging
 
 from ..models import UsageLog, Rule
-from ..db_utils import minute_bucket
+from ..config import settings
+from ..db_utils import minute_bucket, day_range_utc
 from .app_filter import app_filter
+from . import rollup_service, stats_service
 
 logger = logging.getLogger("summary_service")
 
+# One usage_logs row of the summary day. Index 0/1 = app_name/timestamp.
+DayLog = namedtuple("DayLog", ["app_name", "timestamp", "duration", "is_focused", "window_title"])
 
-def calculate_precise_usage(
-    db: Session, 
-    device_id: int, 
-    start_utc: datetime, 
+# Per-app total for the day (same shape as the old GROUP BY query rows)
+AppTotal = namedtuple("AppTotal", ["app_name", "total_duration"])
+
+
+def fetch_day_logs(
+    db: Session,
+    device_id: int,
+    start_utc: datetime,
     end_utc: datetime
-) -> Tuple[int, int]:
-    """
-    Calculate precise usage via interval merging.
-    
-    Returns:
-        Tuple of (today_usage_seconds, elapsed_today_seconds)
-    """
+) -> List[DayLog]:
+    """Fetch all usage rows of the summary day once, ordered by timestamp."""
     from dateutil import parser
     
-    daily_logs = db.query(
-        UsageLog.app_name, UsageLog.timestamp, UsageLog.duration
+    rows = db.query(
+        UsageLog.app_name, UsageLog.timestamp, UsageLog.duration,
+        UsageLog.is_focused, UsageLog.window_title
     ).filter(
         UsageLog.device_id == device_id,
         UsageLog.timestamp >= start_utc,
         UsageLog.timestamp < end_utc
-    ).all()
+    ).order_by(UsageLog.timestamp.asc()).all()
     
+    return [
+        DayLog(
+            row.app_name,
+            row.timestamp if hasattr(row.timestamp, 'timestamp') else parser.parse(row.timestamp),
+            row.duration or 0,
+            row.is_focused,
+            row.window_title
+        )
+        for row in rows
+    ]
+
+
+def get_top_apps(logs: List[DayLog], limit: int = 100) -> List[AppTotal]:
+    """Per-app duration totals for the day, largest first."""
+    totals: Dict[str, int] = {}
+    for log in logs:
+        totals[log.app_name] = totals.get(log.app_name, 0) + log.duration
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [AppTotal(app_name, total) for app_name, total in ranked]
+
+
+def get_week_history(
+    db: Session,
+    device_id: int,
+    today_str: str,
+    offset_seconds: int,
+    days: int = 7
+) -> Dict:
+    """
+    Usage history for the `days` local days before today_str.
+    
+    One rollup query when USAGE_ROLLUP_ENABLED, otherwise the grouped
+    usage_logs range query plus one distinct-apps query.
+    
+    Returns:
+        {"days": {date: {"minutes", "first_activity"}} (only days with data),
+         "apps": set of app names used in the period}
+    """
+    today = datetime.strptime(today_str, '%Y-%m-%d')
+    start_date = (today - timedelta(days=days)).strftime('%Y-%m-%d')
+    end_date = (today - timedelta(days=1)).strftime('%Y-%m-%d')
+    
+    if settings.USAGE_ROLLUP_ENABLED:
+        series = rollup_service.get_daily_series(db, device_id, start_date, end_date)
+        apps = set(app_name for day in series.values() for app_name in day["apps"])
+    else:
+        series = stats_service.get_day_range_stats(db, device_id, start_date, end_date, offset_seconds)
+        range_start, _ = day_range_utc(start_date, offset_seconds)
+        _, range_end = day_range_utc(end_date, offset_seconds)
+        apps = set(row[0] for row in db.query(func.distinct(UsageLog.app_name)).filter(
+            UsageLog.device_id == device_id,
+            UsageLog.timestamp >= range_start,
+            UsageLog.timestamp < range_end
+        ).all())
+    
+    return {
+        "days": {
+            date: {"minutes": day["minutes"], "first_activity": day["first_activity"]}
+            for date, day in series.items()
+        },
+        "apps": apps
+    }
+
+
+def get_usage_totals(db: Session, device_id: int) -> Tuple[int, Optional[datetime]]:
+    """All-time usage seconds and last usage timestamp for a device."""
+    if settings.USAGE_ROLLUP_ENABLED:
+        return rollup_service.get_usage_totals(db, device_id)
+    row = db.query(
+        func.sum(UsageLog.duration).label('total_duration'),
+        func.max(UsageLog.timestamp).label('last_usage')
+    ).filter(UsageLog.device_id == device_id).first()
+    return int(row.total_duration or 0), row.last_usage
+
+
+def calculate_precise_usage(logs: List[DayLog]) -> Tuple[int, int]:
+    """
+    Calculate precise usage via interval merging.
+    
+    Returns:
+        Tuple of (today_usage_seconds, elapsed_today_seconds)
+    """
     all_segments = []
-    for log in daily_logs:
+    for log in logs:
         # Retroactive filtering: Skip logs for apps that are now blacklisted
         if not app_filter.is_trackable(log.app_name):
             continue
             
-        ts_obj = log.timestamp if hasattr(log.timestamp, 'timestamp') else parser.parse(log.timestamp)
-        start_ts = ts_obj.timestamp()
+        start_ts = log.timestamp.timestamp()
         if log.duration > 0:
             all_segments.append((start_ts, start_ts + log.duration))
     
@@ -76,28 +167,12 @@ def _merge_intervals(segments: List[Tuple[float, float]]) -> float:
     return total_seconds
 
 
-def get_latest_window_titles(
-    db: Session, 
-    device_id: int, 
-    start_utc: datetime, 
-    end_utc: datetime
-) -> Dict[str, str]:
+def get_latest_window_titles(logs: List[DayLog]) -> Dict[str, str]:
     """Get latest window titles for each app."""
-    titles_query = db.query(
-        UsageLog.app_name,
-        UsageLog.window_title
-    ).filter(
-        UsageLog.device_id == device_id,
-        UsageLog.timestamp >= start_utc,
-        UsageLog.timestamp < end_utc,
-        UsageLog.window_title.isnot(None),
-        UsageLog.window_title != ""
-    ).order_by(UsageLog.timestamp.desc()).all()
-    
     latest_titles = {}
-    for app, title in titles_query:
-        if app not in latest_titles:
-            latest_titles[app] = title
+    for log in reversed(logs):
+        if log.window_title and log.app_name not in latest_titles:
+            latest_titles[log.app_name] = log.window_title
     return latest_titles
 
 
@@ -118,50 +193,35 @@ def calculate_day_usage(
     return unique_minutes * 60
 
 
-def calculate_week_average(
-    db: Session, 
-    device_id: int, 
-    today_start_utc: datetime
-) -> float:
-    """Calculate 7-day average usage."""
-    week_total = 0
-    for i in range(1, 8):
-        day_start = today_start_utc - timedelta(days=i)
-        day_end = day_start + timedelta(days=1)
-        day_minutes = db.query(
-            func.count(func.distinct(minute_bucket(db, UsageLog.timestamp)))
-        ).filter(
-            UsageLog.device_id == device_id,
-            UsageLog.timestamp >= day_start,
-            UsageLog.timestamp < day_end
-        ).scalar() or 0
-        week_total += day_minutes * 60
+def calculate_yesterday_usage(history: Dict, today_str: str) -> int:
+    """Usage seconds of the local day before today_str (from get_week_history)."""
+    yesterday = (datetime.strptime(today_str, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+    day = history["days"].get(yesterday)
+    return day["minutes"] * 60 if day else 0
+
+
+def calculate_week_average(history: Dict) -> float:
+    """Calculate 7-day average usage (from get_week_history)."""
+    week_total = sum(day["minutes"] * 60 for day in history["days"].values())
     return week_total / 7 if week_total > 0 else 0
 
 
-def get_apps_with_limits(
-    db: Session, 
-    device_id: int, 
-    start_utc: datetime, 
-    end_utc: datetime
-) -> List[Dict]:
+def get_apps_with_limits(rules: List[Rule], logs: List[DayLog]) -> List[Dict]:
     """Get apps with time limits and their current usage."""
-    time_limit_rules = db.query(Rule).filter(
-        Rule.device_id == device_id,
-        Rule.enabled == True,
-        Rule.rule_type == "time_limit",
-        Rule.app_name.isnot(None)
-    ).all()
+    time_limit_rules = [
+        r for r in rules
+        if r.rule_type == "time_limit" and r.app_name is not None
+    ]
+    
+    usage_by_name: Dict[str, int] = {}
+    for log in logs:
+        key = log.app_name.lower()
+        usage_by_name[key] = usage_by_name.get(key, 0) + log.duration
     
     apps_with_limits = []
     for rule in time_limit_rules:
         app_name = rule.app_name
-        app_usage = db.query(func.sum(UsageLog.duration)).filter(
-            UsageLog.device_id == device_id,
-            func.lower(UsageLog.app_name).in_([app_name.lower(), f"{app_name.lower()}.exe"]),
-            UsageLog.timestamp >= start_utc,
-            UsageLog.timestamp < end_utc
-        ).scalar() or 0
+        app_usage = usage_by_name.get(app_name.lower(), 0) + usage_by_name.get(f"{app_name.lower()}.exe", 0)
         
         limit_seconds = (rule.time_limit or 0) * 60
         remaining = max(0, limit_seconds - app_usage)
@@ -182,17 +242,9 @@ def get_apps_with_limits(
     return apps_with_limits
 
 
-def get_daily_limit_info(
-    db: Session, 
-    device_id: int, 
-    today_usage: int
-) -> Optional[Dict]:
+def get_daily_limit_info(rules: List[Rule], today_usage: int) -> Optional[Dict]:
     """Get daily device limit info if set."""
-    daily_limit_rule = db.query(Rule).filter(
-        Rule.device_id == device_id,
-        Rule.enabled == True,
-        Rule.rule_type == "daily_limit"
-    ).first()
+    daily_limit_rule = next((r for r in rules if r.rule_type == "daily_limit"), None)
     
     if not daily_limit_rule or not daily_limit_rule.time_limit:
         return None
@@ -213,51 +265,28 @@ def get_daily_limit_info(
     }
 
 
-def get_active_schedules(db: Session, device_id: int) -> List[Dict]:
+def get_active_schedules(rules: List[Rule]) -> List[Dict]:
     """Get active schedule rules."""
-    schedule_rules = db.query(Rule).filter(
-        Rule.device_id == device_id,
-        Rule.enabled == True,
-        Rule.rule_type == "schedule"
-    ).all()
-    
     return [{
         "id": s.id,
         "start_time": s.schedule_start_time,
         "end_time": s.schedule_end_time,
         "days": s.schedule_days,
         "app_name": s.app_name
-    } for s in schedule_rules]
+    } for s in rules if s.rule_type == "schedule"]
 
 
-def get_activity_timeline(
-    db: Session, 
-    device_id: int, 
-    start_utc: datetime, 
-    end_utc: datetime
-) -> List[Dict]:
+def get_activity_timeline(logs: List[DayLog]) -> List[Dict]:
     """Get granular activity segments for timeline visualization."""
-    from dateutil import parser
-    
-    logs = db.query(
-        UsageLog.app_name, UsageLog.timestamp, UsageLog.duration
-    ).filter(
-        UsageLog.device_id == device_id,
-        UsageLog.timestamp >= start_utc,
-        UsageLog.timestamp < end_utc,
-        UsageLog.duration > 0
-    ).order_by(UsageLog.timestamp.asc()).all()
-    
     timeline = []
     current_segment = None
     
     for log in logs:
         # Retroactive filtering
-        if not app_filter.is_trackable(log.app_name):
+        if log.duration <= 0 or not app_filter.is_trackable(log.app_name):
             continue
             
-        ts_obj = log.timestamp if hasattr(log.timestamp, 'timestamp') else parser.parse(log.timestamp)
-        start_ts = ts_obj.timestamp()
+        start_ts = log.timestamp.timestamp()
         end_ts = start_ts + log.duration
         
         friendly_name = app_filter.get_friendly_name(log.app_name)
@@ -288,10 +317,8 @@ def get_activity_timeline(
 
 
 def calculate_smart_insights(
-    db: Session, 
-    device_id: int, 
-    start_utc: datetime, 
-    end_utc: datetime,
+    logs: List[DayLog],
+    history: Dict,
     today_usage: int, 
     apps_with_limits: List[Dict]
 ) -> Optional[Dict]:
@@ -303,20 +330,10 @@ def calculate_smart_insights(
     - Anomaly detection (early start, night owl, new apps)
     - Wellness score
     """
-    from dateutil import parser
-    
     try:
-        logs_today = db.query(
-            UsageLog.app_name, UsageLog.timestamp, UsageLog.duration, UsageLog.is_focused
-        ).filter(
-            UsageLog.device_id == device_id,
-            UsageLog.timestamp >= start_utc,
-            UsageLog.timestamp < end_utc
-        ).order_by(UsageLog.timestamp.asc()).all()
-
         # Filter blacklisted apps
         logs_today = [
-            log for log in logs_today 
+            log for log in logs 
             if app_filter.is_trackable(log.app_name)
         ]
 
@@ -326,10 +343,10 @@ def calculate_smart_insights(
         flow_index = 0
 
         # Anomaly Detection
-        anomalies = _detect_anomalies(db, device_id, start_utc, logs_today)
+        anomalies = _detect_anomalies(history, logs_today)
         
         # New apps detection
-        new_apps = _detect_new_apps(db, device_id, start_utc, logs_today)
+        new_apps = _detect_new_apps(history, logs_today)
 
         # Wellness Score
         wellness_score = _calculate_wellness_score(
@@ -363,41 +380,23 @@ def calculate_smart_insights(
         return None
 
 
-def _detect_anomalies(
-    db: Session, 
-    device_id: int, 
-    start_utc: datetime, 
-    logs_today: list
-) -> Dict:
+def _detect_anomalies(history: Dict, logs_today: List[DayLog]) -> Dict:
     """Detect usage anomalies like early start or night owl patterns."""
-    from dateutil import parser
-    
     is_early_start = False
     is_night_owl = False
     avg_start_hour = None
     starts = []
     
     if logs_today:
-        first_dt = logs_today[0][1] if hasattr(logs_today[0][1], 'hour') else parser.parse(logs_today[0][1])
+        first_dt = logs_today[0].timestamp
         
         # Night owl check
-        for log in logs_today:
-            l_dt = log[1] if hasattr(log[1], 'hour') else parser.parse(log[1])
-            if l_dt.hour >= 22:
-                is_night_owl = True
-                break
+        is_night_owl = any(log.timestamp.hour >= 22 for log in logs_today)
 
         # Historical start times
-        for k in range(1, 8):
-            day_start = start_utc - timedelta(days=k)
-            day_end = day_start + timedelta(days=1)
-            first_d = db.query(func.min(UsageLog.timestamp)).filter(
-                UsageLog.device_id == device_id,
-                UsageLog.timestamp >= day_start,
-                UsageLog.timestamp < day_end
-            ).scalar()
-            if first_d:
-                fd = first_d if hasattr(first_d, 'hour') else parser.parse(first_d)
+        for day in history["days"].values():
+            fd = day["first_activity"]
+            if fd:
                 starts.append(fd.hour + fd.minute/60)
         
         # Early start detection
@@ -415,22 +414,10 @@ def _detect_anomalies(
     }
 
 
-def _detect_new_apps(
-    db: Session, 
-    device_id: int, 
-    start_utc: datetime, 
-    logs_today: list
-) -> List[str]:
+def _detect_new_apps(history: Dict, logs_today: List[DayLog]) -> List[str]:
     """Detect apps used today that weren't used in the last week."""
-    apps_today_set = set(log[0].lower() for log in logs_today) if logs_today else set()
-    
-    apps_last_week = db.query(func.distinct(UsageLog.app_name)).filter(
-        UsageLog.device_id == device_id,
-        UsageLog.timestamp >= start_utc - timedelta(days=7),
-        UsageLog.timestamp < start_utc
-    ).all()
-    
-    apps_last_week_set = set(a[0].lower() for a in apps_last_week)
+    apps_today_set = set(log.app_name.lower() for log in logs_today)
+    apps_last_week_set = set(app_name.lower() for app_name in history["apps"])
     return list(apps_today_set - apps_last_week_set)
 
 
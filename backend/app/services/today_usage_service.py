@@ -0,0 +1,309 @@
+"""
+In-memory "today" usage per device for the agent rules fetch.
+
+The fetch used to run COUNT(DISTINCT minute) and a GROUP BY app over all of
+the device's logs since local midnight on every call. The store keeps, per
+device and local day, a bitmap of the UTC minutes that have usage (daily
+usage = set bits * 60 s, same as the unique-minute count) and a per-app
+duration sum, so the fetch answer is O(apps).
+
+- Ingest: Session events pick up every usage_logs insert (bulk executemany
+  from ingest_service / write_queue and plain ORM adds) and fold the rows in
+  after the transaction commits; rolled back rows are dropped.
+- Miss (first fetch, new local day, changed timezone offset): the day is
+  loaded from usage_logs once and kept.
+- Races: each insert takes a per-device ticket before commit. A day loaded
+  while an insert was in flight is not stored, and a commit whose ticket is
+  older than the loaded day drops it (it may already contain the rows).
+- Restart: persist() writes the days with the highest usage_logs id on
+  shutdown; load() reuses them only while that id is unchanged, otherwise
+  the days are rebuilt from the DB (warm_up()).
+
+Per process: with several workers rows ingested by one worker would not
+reach the others. The store is therefore opt-in (TODAY_USAGE_ENABLED, set by
+the single-worker launchers) and stays off with WEB_CONCURRENCY > 1 or a
+shared STATE_BACKEND; the fetch then keeps querying the DB.
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import Device, UsageLog
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _as_naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _minute_number(value: datetime) -> int:
+    return int((value - _EPOCH).total_seconds() // 60)
+
+
+def device_day_start(offset_seconds: Optional[int], now: Optional[datetime] = None) -> datetime:
+    """Start of the device's current local day as naive UTC (what usage_logs stores)."""
+    offset = offset_seconds or 0
+    now_device = (now or datetime.now(timezone.utc)) + timedelta(seconds=offset)
+    local_start = now_device.replace(hour=0, minute=0, second=0, microsecond=0)
+    return _as_naive_utc(local_start - timedelta(seconds=offset))
+
+
+class _Day:
+    """Usage of one device since day_start."""
+
+    __slots__ = ("day_start", "day_end", "first_minute", "minutes", "apps", "built_seq")
+
+    def __init__(self, day_start: datetime, built_seq: int, minutes: int = 0, apps: Optional[Dict[str, int]] = None):
+        self.day_start = day_start
+        self.day_end = day_start + timedelta(days=1)
+        self.first_minute = _minute_number(day_start)
+        self.minutes = minutes  # bit i = usage in minute first_minute + i
+        self.apps: Dict[str, int] = apps or {}
+        self.built_seq = built_seq
+
+    def add(self, timestamp: datetime, app_name: str, duration: int):
+        timestamp = _as_naive_utc(timestamp)
+        # Future agent clocks would grow the bitmap without bound
+        if not self.day_start <= timestamp < self.day_end:
+            return
+        self.minutes |= 1 << (_minute_number(timestamp) - self.first_minute)
+        self.apps[app_name] = self.apps.get(app_name, 0) + (duration or 0)
+
+    def totals(self) -> Tuple[int, Dict[str, int]]:
+        return bin(self.minutes).count("1") * 60, dict(self.apps)
+
+
+class TodayUsageStore:
+    """Thread-safe device_id -> today's usage accumulator."""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._days: Dict[int, _Day] = {}
+        self._seq: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._loads = 0
+        self._rows_added = 0
+        self._dropped = 0
+
+    def get(self, db: Session, device: Device) -> Tuple[int, Dict[str, int]]:
+        """(daily_usage seconds, usage_by_app) for the device's current local day."""
+        day_start = device_day_start(device.timezone_offset)
+        with self._lock:
+            day = self._days.get(device.id)
+            if day is not None and day.day_start == day_start:
+                self._hits += 1
+                return day.totals()
+            seq = self._seq.get(device.id, 0)
+            self._loads += 1
+
+        day = self._load_day(db, device.id, day_start, seq)
+        with self._lock:
+            # An insert took a ticket meanwhile: the load may or may not contain it
+            if self._seq.get(device.id, 0) == seq:
+                self._days[device.id] = day
+        return day.totals()
+
+    @staticmethod
+    def _load_day(db: Session, device_id: int, day_start: datetime, seq: int) -> _Day:
+        day = _Day(day_start, seq)
+        rows = db.query(UsageLog.timestamp, UsageLog.app_name, UsageLog.duration).filter(
+            UsageLog.device_id == device_id,
+            UsageLog.timestamp >= day_start,
+            UsageLog.timestamp < day.day_end
+        )
+        for timestamp, app_name, duration in rows:
+            day.add(timestamp, app_name, duration)
+        return day
+
+    # ---- ingest ----
+
+    def take_tickets(self, device_ids: Iterable[int]) -> Dict[int, int]:
+        """Per-device tickets for rows about to be committed."""
+        with self._lock:
+            tickets = {}
+            for device_id in set(device_ids):
+                tickets[device_id] = self._seq[device_id] = self._seq.get(device_id, 0) + 1
+            return tickets
+
+    def add_committed(self, rows: List[Dict], tickets: Dict[int, int]):
+        """Fold committed usage rows into the loaded days."""
+        with self._lock:
+            for row in rows:
+                device_id = row.get("device_id")
+                day = self._days.get(device_id)
+                if day is None:
+                    continue
+                if day.built_seq >= tickets.get(device_id, 0) or row.get("timestamp") is None:
+                    # Loaded after the ticket (rows may be counted already) or server-side timestamp
+                    del self._days[device_id]
+                    self._dropped += 1
+                    continue
+                day.add(row["timestamp"], row["app_name"], row.get("duration"))
+                self._rows_added += 1
+
+    def forget(self, device_id: int):
+        """Drop a device's day (e.g. after deleting its logs)."""
+        with self._lock:
+            self._days.pop(device_id, None)
+            self._seq[device_id] = self._seq.get(device_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._days.clear()
+            self._seq.clear()
+
+    # ---- restart ----
+
+    def warm_up(self, db: Session) -> int:
+        """Load the current day of every device (startup without a usable snapshot)."""
+        devices = db.query(Device.id, Device.timezone_offset).all()
+        for device in devices:
+            self.get(db, device)
+        return len(devices)
+
+    def persist(self, path: str, db: Session) -> int:
+        """Write the loaded days with the usage_logs high-water mark. Returns days written."""
+        high_water = db.query(func.max(UsageLog.id)).scalar() or 0
+        with self._lock:
+            days = {
+                str(device_id): {
+                    "day_start": day.day_start.isoformat(),
+                    "minutes": format(day.minutes, "x"),
+                    "apps": day.apps,
+                }
+                for device_id, day in self._days.items()
+            }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"high_water": high_water, "days": days}, f)
+        os.replace(tmp, path)
+        return len(days)
+
+    def load(self, path: str, db: Session) -> bool:
+        """Restore persisted days if no usage_logs row was added since. Returns True if used."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable today usage snapshot {path}: {e}")
+            return False
+        finally:
+            # One-shot: a later crash must not restore this state again
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        high_water = db.query(func.max(UsageLog.id)).scalar() or 0
+        if data.get("high_water") != high_water:
+            logger.info("Today usage snapshot is outdated, rebuilding from usage_logs")
+            return False
+        with self._lock:
+            for device_id, day in data.get("days", {}).items():
+                device_id = int(device_id)
+                self._days[device_id] = _Day(
+                    datetime.fromisoformat(day["day_start"]),
+                    self._seq.get(device_id, 0),
+                    int(day["minutes"], 16),
+                    {name: int(seconds) for name, seconds in day["apps"].items()}
+                )
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._loads
+            return {
+                "enabled": self.enabled,
+                "devices": len(self._days),
+                "hits": self._hits,
+                "loads": self._loads,
+                "hit_ratio": round(self._hits / lookups, 3) if lookups else 0.0,
+                "rows_added": self._rows_added,
+                "dropped": self._dropped,
+            }
+
+
+today_usage = TodayUsageStore(enabled=(
+    settings.TODAY_USAGE_ENABLED and settings.STATE_BACKEND == "memory" and settings.WEB_CONCURRENCY <= 1
+))
+
+
+def restore_or_rebuild(session_factory: Callable[[], Session], path: str = None) -> str:
+    """Startup: reuse the shutdown snapshot if still valid, else load today's usage from the DB."""
+    path = path or settings.TODAY_USAGE_SNAPSHOT_PATH
+    db = session_factory()
+    try:
+        if today_usage.load(path, db):
+            return "snapshot"
+        today_usage.warm_up(db)
+        return "rebuilt"
+    finally:
+        db.close()
+
+
+def persist(session_factory: Callable[[], Session], path: str = None) -> int:
+    """Shutdown: write the loaded days (after the write-behind queue is flushed)."""
+    db = session_factory()
+    try:
+        return today_usage.persist(path or settings.TODAY_USAGE_SNAPSHOT_PATH, db)
+    finally:
+        db.close()
+
+
+# ---- Session hooks: every usage_logs insert feeds the store after commit ----
+
+_PENDING_KEY = "today_usage_pending"
+
+
+def _track(session: Session, rows: List[Dict]):
+    if not today_usage.enabled or not rows:
+        return
+    tickets = today_usage.take_tickets(row.get("device_id") for row in rows)
+    session.info.setdefault(_PENDING_KEY, []).append((rows, tickets))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _on_execute(state):
+    # Bulk path: session.execute(insert(UsageLog), rows)
+    mapper = state.bind_mapper
+    if state.is_insert and mapper is not None and mapper.class_ is UsageLog:
+        params = state.parameters
+        if isinstance(params, dict):
+            params = [params]
+        _track(state.session, [dict(p) for p in params or ()])
+
+
+@event.listens_for(Session, "after_flush")
+def _on_flush(session, flush_context):
+    # ORM path: session.add(UsageLog(...))
+    _track(session, [
+        {"device_id": obj.device_id, "app_name": obj.app_name, "duration": obj.duration,
+         "timestamp": obj.__dict__.get("timestamp")}
+        for obj in session.new if isinstance(obj, UsageLog)
+    ])
+
+
+@event.listens_for(Session, "after_commit")
+def _on_commit(session):
+    for rows, tickets in session.info.pop(_PENDING_KEY, ()):
+        today_usage.add_committed(rows, tickets)
+
+
+@event.listens_for(Session, "after_rollback")
+def _on_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,448 @@
+"""Pluggable store for state shared between API worker processes.
+
+The stats cache, the running processes snapshot, the rate limiter and the
+WebSocket auth-failure log throttle used to be plain per-process dicts,
+so with several uvicorn workers each process had its own (diverging) copy.
+They now keep their state in a StateBackend:
+
+- MemoryStateBackend (default): process-local dicts, behaves as before.
+  Fine for the usual single-worker deployment.
+- SqliteStateBackend: one SQLite file (WAL mode) shared by all workers on
+  the same node. Select it with STATE_BACKEND=sqlite; STATE_BACKEND_PATH
+  sets the file (default: next to the database).
+
+Values in the shared file are pickled. The file is written only by the
+server's own workers - keep it in a directory other users cannot write to.
+Replicas on different hosts need a network store and are not covered here.
+"""
+import os
+import pickle
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class StateBackend(ABC):
+    """
+    Key-value store with TTL, counters, sliding-window rate limits and
+    a small event log for cross-process notifications.
+
+    Keys are strings grouped by namespace. publish() / poll() only
+    deliver events to *other* processes - in-process listeners are
+    called directly by the publisher.
+    """
+
+    name = "base"
+    # True when other processes see the same state (enables cross-process sync)
+    shared = False
+
+    @abstractmethod
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        """Value of key, default when missing or expired."""
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        """Store value, expiring after ttl seconds (None = never)."""
+
+    @abstractmethod
+    def add(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Set key only if it is missing or expired. Returns True if it was set."""
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str) -> bool:
+        """Remove key. Returns True if it existed."""
+
+    @abstractmethod
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        """Add amount to an integer counter (missing = 0). Returns the new value."""
+
+    @abstractmethod
+    def hit(self, namespace: str, key: str, limit: int, window: float) -> Tuple[bool, int, int]:
+        """
+        Record a hit in a sliding window of window seconds.
+
+        Returns (allowed, remaining, retry_after). A denied hit is not
+        recorded; limit 0 only reads the window.
+        """
+
+    @abstractmethod
+    def publish(self, channel: str, message: Any):
+        """Append message to channel for other processes."""
+
+    @abstractmethod
+    def poll(self, channel: str, after_id: Optional[int]) -> Tuple[int, Optional[List[Any]]]:
+        """
+        Messages from other processes published after after_id.
+
+        Returns (last_id, messages). after_id None starts at the current
+        end of the log. messages is None when events after after_id were
+        already purged - the caller has to resync its state.
+        """
+
+    @abstractmethod
+    def close(self):
+        """Release connections / file handles."""
+
+
+class MemoryStateBackend(StateBackend):
+    """Process-local backend (plain dicts behind a lock)."""
+
+    name = "memory"
+    shared = False
+
+    _PURGE_INTERVAL = 60.0
+
+    def __init__(self):
+        self._data: Dict[Tuple[str, str], Tuple[Any, Optional[float]]] = {}
+        self._hits: Dict[Tuple[str, str], List[float]] = {}
+        self._lock = threading.Lock()
+        self._next_purge = time.monotonic() + self._PURGE_INTERVAL
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get((namespace, key))
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[(namespace, key)]
+                return default
+            return value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._maybe_purge()
+            self._data[(namespace, key)] = (value, time.time() + ttl if ttl else None)
+
+    def add(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            self._maybe_purge()
+            now = time.time()
+            item = self._data.get((namespace, key))
+            if item is not None and (item[1] is None or item[1] > now):
+                return False
+            self._data[(namespace, key)] = (value, now + ttl if ttl else None)
+            return True
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            return self._data.pop((namespace, key), None) is not None
+
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        with self._lock:
+            value, expires_at = self._data.get((namespace, key), (0, None))
+            value += amount
+            self._data[(namespace, key)] = (value, expires_at)
+            return value
+
+    def hit(self, namespace: str, key: str, limit: int, window: float) -> Tuple[bool, int, int]:
+        with self._lock:
+            self._maybe_purge()
+            now = time.time()
+            cutoff = now - window
+            hits = [ts for ts in self._hits.get((namespace, key), ()) if ts > cutoff]
+            if len(hits) >= limit:
+                self._hits[(namespace, key)] = hits
+                retry_after = max(0, int(window - (now - min(hits))) + 1) if hits else 0
+                return False, 0, retry_after
+            hits.append(now)
+            self._hits[(namespace, key)] = hits
+            return True, limit - len(hits), 0
+
+    def publish(self, channel: str, message: Any):
+        # Nobody else sees this process's state
+        pass
+
+    def poll(self, channel: str, after_id: Optional[int]) -> Tuple[int, Optional[List[Any]]]:
+        return after_id or 0, []
+
+    def close(self):
+        pass
+
+    def _maybe_purge(self):
+        """Drop expired keys and idle rate-limit windows (called within lock)."""
+        if time.monotonic() < self._next_purge:
+            return
+        self._next_purge = time.monotonic() + self._PURGE_INTERVAL
+        now = time.time()
+        for k in [k for k, (_, exp) in self._data.items() if exp is not None and exp <= now]:
+            del self._data[k]
+        # Windows are at most a few minutes; an hour without hits is idle
+        for k in [k for k, hits in self._hits.items() if not hits or hits[-1] < now - 3600]:
+            del self._hits[k]
+
+
+class SqliteStateBackend(StateBackend):
+    """
+    Backend in a SQLite file shared by the worker processes of one node.
+
+    One connection per thread and process, WAL journal, autocommit; the
+    read-modify-write operations (add, incr, hit) run in BEGIN IMMEDIATE
+    transactions so concurrent workers serialize on the file lock.
+    """
+
+    name = "sqlite"
+    shared = True
+
+    _PURGE_INTERVAL = 60.0
+    # Events older than this are purged; a process that polls later resyncs
+    EVENT_RETENTION = 300.0
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._token = uuid.uuid4().hex[:12]
+        self._next_purge = 0.0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._create_schema()
+
+    @property
+    def origin(self) -> str:
+        """Identifies this process in the event log (pid changes after fork)."""
+        return f"{os.getpid()}:{self._token}"
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _create_schema(self):
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS kv (
+                ns TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB,
+                expires_at REAL,
+                PRIMARY KEY (ns, key)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS ix_kv_expires ON kv (expires_at);
+            CREATE TABLE IF NOT EXISTS hits (
+                ns TEXT NOT NULL,
+                key TEXT NOT NULL,
+                ts REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_hits_key ON hits (ns, key, ts);
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                payload BLOB,
+                created_at REAL NOT NULL
+            );
+        """)
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE ns = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())
+        ).fetchone()
+        return pickle.loads(row[0]) if row is not None else default
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        self._maybe_purge()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, pickle.dumps(value), time.time() + ttl if ttl else None)
+        )
+
+    def add(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        self._maybe_purge()
+        now = time.time()
+        with self._immediate() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM kv WHERE ns = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, key, now)
+            ).fetchone()
+            if row is not None:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, pickle.dumps(value), now + ttl if ttl else None)
+            )
+            return True
+
+    def delete(self, namespace: str, key: str) -> bool:
+        cursor = self._conn().execute("DELETE FROM kv WHERE ns = ? AND key = ?", (namespace, key))
+        return cursor.rowcount > 0
+
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        with self._immediate() as conn:
+            row = conn.execute("SELECT value FROM kv WHERE ns = ? AND key = ?", (namespace, key)).fetchone()
+            value = (pickle.loads(row[0]) if row is not None else 0) + amount
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, NULL)",
+                (namespace, key, pickle.dumps(value))
+            )
+            return value
+
+    def hit(self, namespace: str, key: str, limit: int, window: float) -> Tuple[bool, int, int]:
+        self._maybe_purge()
+        now = time.time()
+        with self._immediate() as conn:
+            conn.execute("DELETE FROM hits WHERE ns = ? AND key = ? AND ts <= ?", (namespace, key, now - window))
+            count, oldest = conn.execute(
+                "SELECT COUNT(*), MIN(ts) FROM hits WHERE ns = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if count >= limit:
+                retry_after = max(0, int(window - (now - oldest)) + 1) if oldest is not None else 0
+                return False, 0, retry_after
+            conn.execute("INSERT INTO hits (ns, key, ts) VALUES (?, ?, ?)", (namespace, key, now))
+            return True, limit - count - 1, 0
+
+    def publish(self, channel: str, message: Any):
+        self._maybe_purge()
+        self._conn().execute(
+            "INSERT INTO events (channel, origin, payload, created_at) VALUES (?, ?, ?, ?)",
+            (channel, self.origin, pickle.dumps(message), time.time())
+        )
+
+    def poll(self, channel: str, after_id: Optional[int]) -> Tuple[int, Optional[List[Any]]]:
+        conn = self._conn()
+        purged_upto = self.get("_meta", "events_purged_upto", 0)
+        if after_id is None:
+            row = conn.execute("SELECT MAX(id) FROM events").fetchone()
+            return max(row[0] or 0, purged_upto), []
+        rows = conn.execute(
+            "SELECT id, origin, payload FROM events WHERE id > ? AND channel = ? ORDER BY id",
+            (after_id, channel)
+        ).fetchall()
+        last_id = max(after_id, rows[-1][0]) if rows else after_id
+        if after_id < purged_upto:
+            return max(last_id, purged_upto), None
+        origin = self.origin
+        return last_id, [pickle.loads(payload) for _, row_origin, payload in rows if row_origin != origin]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _immediate(self):
+        return _ImmediateTransaction(self._conn())
+
+    def _maybe_purge(self):
+        """Drop expired keys, old rate-limit hits and old events (at most once per interval)."""
+        if time.monotonic() < self._next_purge:
+            return
+        self._next_purge = time.monotonic() + self._PURGE_INTERVAL
+        now = time.time()
+        try:
+            with self._immediate() as conn:
+                conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+                # Rate-limit windows are at most a few minutes
+                conn.execute("DELETE FROM hits WHERE ts < ?", (now - 3600,))
+                row = conn.execute(
+                    "SELECT MAX(id) FROM events WHERE created_at < ?", (now - self.EVENT_RETENTION,)
+                ).fetchone()
+                if row[0] is not None:
+                    conn.execute("DELETE FROM events WHERE id <= ?", (row[0],))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO kv (ns, key, value, expires_at) VALUES ('_meta', 'events_purged_upto', ?, NULL)",
+                        (pickle.dumps(row[0]),)
+                    )
+        except sqlite3.OperationalError as e:
+            logger.warning(f"State backend purge skipped: {e}")
+
+
+class _ImmediateTransaction:
+    """BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error) on an autocommit connection."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+class StateMap:
+    """
+    Dict-like view of one backend namespace (get, [], in, del).
+
+    Lets module-level caches that used to be plain dicts move to the
+    backend without changing their callers. Keys are stored as strings;
+    values must be picklable for the shared backend, and a value read
+    from it is a copy - assign it back after changing it.
+    """
+
+    def __init__(self, namespace: str, ttl: Optional[float] = None, backend: Optional[StateBackend] = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._backend = backend
+
+    @property
+    def backend(self) -> StateBackend:
+        return self._backend or get_state_backend()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        return self.backend.get(self.namespace, str(key), default)
+
+    def __getitem__(self, key: Any) -> Any:
+        value = self.backend.get(self.namespace, str(key), _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Any, value: Any):
+        self.backend.set(self.namespace, str(key), value, self.ttl)
+
+    def __delitem__(self, key: Any):
+        if not self.backend.delete(self.namespace, str(key)):
+            raise KeyError(key)
+
+    def __contains__(self, key: Any) -> bool:
+        return self.backend.get(self.namespace, str(key), _MISSING) is not _MISSING
+
+
+_backend: Optional[StateBackend] = None
+_backend_lock = threading.Lock()
+
+
+def create_state_backend(kind: str, path: Optional[str] = None) -> StateBackend:
+    """Backend for a STATE_BACKEND value ("memory" or "sqlite")."""
+    if kind == "sqlite":
+        return SqliteStateBackend(path)
+    if kind != "memory":
+        logger.warning(f"Unknown STATE_BACKEND '{kind}', using memory")
+    return MemoryStateBackend()
+
+
+def get_state_backend() -> StateBackend:
+    """Process-wide backend selected by settings.STATE_BACKEND (created on first use)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                from .config import settings
+                _backend = create_state_backend(settings.STATE_BACKEND, settings.STATE_BACKEND_PATH)
+                logger.info(f"State backend: {_backend.name}")
+    return _backend
+
+
+def set_state_backend(backend: Optional[StateBackend]) -> Optional[StateBackend]:
+    """Replace the process-wide backend (tests, embedding). Returns the previous one."""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
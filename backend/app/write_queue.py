@@ -0,0 +1,401 @@
+"""Write-behind queue for high-frequency agent writes.
+
+Agent reports and critical events used to open their own session and
+compete for the SQLite writer lock. Producers now enqueue usage rows here,
+and a single asyncio writer task flushes them in batched transactions when
+the batch size is reached or the flush interval elapses. Daily and hourly
+rollup deltas are coalesced in memory and written in the same transaction;
+after commit the covered time ranges are published to the stats cache.
+Liveness (last_seen) is kept separately in heartbeat.py.
+
+The actual DB work runs in a worker thread (one at a time), so the event
+loop is never blocked on the SQLite lock.
+
+A batch that fails with a transient error (lock timeout, lost connection)
+is retried whole on the next tick. Any other error is blamed on the data:
+the batch is bisected at once so the good rows are written, and a row that
+keeps failing on its own is logged and dropped after max_attempts flushes.
+"""
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+import logging
+
+from sqlalchemy import exc, insert
+
+from .config import settings
+from .metrics import ingest_rows
+from .offload import offload
+from .services import ingest_service, rollup_service
+
+logger = logging.getLogger(__name__)
+
+
+def _is_transient(error: Exception) -> bool:
+    """True for errors that say nothing about the rows (locks, connections, pool timeouts)."""
+    if isinstance(error, (exc.OperationalError, exc.TimeoutError)):
+        return True
+    return isinstance(error, exc.DBAPIError) and error.connection_invalidated
+
+
+class _Batch:
+    """Rows written in one transaction, their rollup deltas and failed attempts."""
+
+    __slots__ = ("rows", "offsets", "rollup", "attempts", "enqueued_at")
+
+    def __init__(
+        self,
+        rows: List[Dict[str, Any]],
+        offsets: List[int],
+        rollup: Optional[rollup_service.RollupBatch] = None,
+        attempts: int = 0,
+        enqueued_at: Optional[float] = None
+    ):
+        self.rows = rows
+        self.offsets = offsets  # device timezone offset per row
+        self.rollup = rollup if rollup is not None else self._build_rollup(rows, offsets)
+        self.attempts = attempts
+        self.enqueued_at = enqueued_at
+
+    @staticmethod
+    def _build_rollup(rows: List[Dict[str, Any]], offsets: List[int]) -> rollup_service.RollupBatch:
+        rollup = rollup_service.RollupBatch()
+        start = 0
+        for end in range(1, len(rows) + 1):
+            if end == len(rows) or offsets[end] != offsets[start]:
+                rollup.add_rows(rows[start:end], offsets[start])
+                start = end
+        return rollup
+
+    def split(self) -> List["_Batch"]:
+        """Two halves; they have not been tried yet, so they keep the attempts made before this one failed."""
+        mid = len(self.rows) // 2
+        return [
+            _Batch(self.rows[:mid], self.offsets[:mid], None, self.attempts - 1, self.enqueued_at),
+            _Batch(self.rows[mid:], self.offsets[mid:], None, self.attempts - 1, self.enqueued_at),
+        ]
+
+
+class WriteBehindQueue:
+    """In-process write-behind buffer with a single writer task.
+
+    - enqueue_usage(): append usage_logs rows (dicts, see ingest_service.build_usage_rows)
+    - discard_device(): drop a device's buffered rows (device deletion)
+    - stats(): queue depth and flush latency for monitoring
+    """
+
+    def __init__(
+        self,
+        max_batch: int = 500,
+        flush_interval: float = 1.0,
+        max_queue: int = 50000,
+        max_attempts: int = 3,
+        session_factory: Optional[Callable] = None
+    ):
+        """
+        Initialize queue.
+
+        Args:
+            max_batch: Queue depth (rows) that triggers an immediate flush
+            flush_interval: Maximum seconds between flushes
+            max_queue: Hard cap on buffered rows; enqueue_usage() refuses above it
+            max_attempts: Failed flushes after which a single row is dropped
+            session_factory: Session factory for the writer (defaults to database.SessionLocal)
+        """
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self._session_factory = session_factory
+
+        self._lock = threading.Lock()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._usage_rows: List[Dict[str, Any]] = []
+        self._row_offsets: List[int] = []
+        self._rollup = rollup_service.RollupBatch()
+        self._oldest_enqueued_at: Optional[float] = None
+        # Batches that failed, retried before new rows
+        self._retry: List[_Batch] = []
+
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # Counters
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._rows_flushed = 0
+        self._rows_dropped = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._avg_flush_ms = 0.0
+        self._last_queue_wait_ms = 0.0
+
+    # ------------------------------------------------------------------
+    # Producers
+    # ------------------------------------------------------------------
+
+    @property
+    def is_running(self) -> bool:
+        """True if the writer task is active and producers may enqueue."""
+        return self._task is not None and not self._task.done() and not self._stopping
+
+    def enqueue_usage(self, rows: List[Dict[str, Any]], offset_seconds: int = 0) -> bool:
+        """
+        Queue usage rows for the writer.
+
+        offset_seconds is the device timezone offset used to bucket the
+        rows into local days for the daily rollup.
+
+        Returns False (nothing queued) if the writer is not running or the
+        queue is full - the caller must then write the rows itself.
+        """
+        if not rows:
+            return True
+        if not self.is_running:
+            return False
+        with self._lock:
+            depth = self._depth()
+            if depth + len(rows) > self.max_queue:
+                logger.warning(f"Write-behind queue full ({depth} rows), caller writes inline")
+                return False
+            if self._oldest_enqueued_at is None:
+                self._oldest_enqueued_at = time.monotonic()
+            self._usage_rows.extend(rows)
+            self._row_offsets.extend([offset_seconds] * len(rows))
+            self._rollup.add_rows(rows, offset_seconds)
+            depth = len(self._usage_rows)
+        if depth >= self.max_batch and self._wakeup is not None:
+            self._wake()
+        return True
+
+    async def discard_device(self, device_id: int) -> int:
+        """
+        Drop the buffered rows of a device (before the device is deleted).
+
+        Waits for a flush in progress, so none of its rows are written after
+        this returns. Returns number of rows dropped.
+        """
+        if self._flush_lock is None:
+            return self._discard_device(device_id)
+        async with self._flush_lock:
+            return self._discard_device(device_id)
+
+    def _discard_device(self, device_id: int) -> int:
+        with self._lock:
+            batches = self._retry
+            if self._usage_rows:
+                batches = batches + [_Batch(self._usage_rows, self._row_offsets, self._rollup, 0, self._oldest_enqueued_at)]
+            kept: List[_Batch] = []
+            dropped = 0
+            for batch in batches:
+                keep = [i for i, row in enumerate(batch.rows) if row["device_id"] != device_id]
+                dropped += len(batch.rows) - len(keep)
+                if len(keep) == len(batch.rows):
+                    kept.append(batch)
+                elif keep:
+                    kept.append(_Batch([batch.rows[i] for i in keep], [batch.offsets[i] for i in keep],
+                                       None, batch.attempts, batch.enqueued_at))
+            # Remaining rows go to the retry list as they are; new rows start a fresh buffer
+            self._retry = kept
+            self._usage_rows = []
+            self._row_offsets = []
+            self._rollup = rollup_service.RollupBatch()
+            self._oldest_enqueued_at = None
+        if dropped:
+            logger.info(f"Write-behind queue discarded {dropped} rows of device {device_id}")
+        return dropped
+
+    def _wake(self):
+        """Set the wakeup event; producers may run in worker threads (database.AsyncDb)."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        else:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass  # loop closed; the interval flush / stop() picks the rows up
+
+    # ------------------------------------------------------------------
+    # Writer
+    # ------------------------------------------------------------------
+
+    def start(self, session_factory: Optional[Callable] = None):
+        """Start the writer task on the running event loop."""
+        if self.is_running:
+            return
+        if session_factory is not None:
+            self._session_factory = session_factory
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Write-behind queue started (batch={self.max_batch}, interval={self.flush_interval}s)")
+
+    async def stop(self):
+        """Stop the writer task and flush everything still buffered."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        logger.info("Write-behind queue stopped")
+
+    async def flush(self):
+        """Flush buffered writes now (used by producers that need read-your-writes)."""
+        if self._flush_lock is None:
+            await offload.run("maintenance", self.flush_pending)
+            return
+        async with self._flush_lock:
+            await offload.run("maintenance", self.flush_pending)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Write-behind flush loop error: {e}")
+
+    def flush_pending(self) -> int:
+        """
+        Write all buffered rows (blocking).
+
+        New rows go in one transaction, after any batches that failed before.
+        A transient failure puts the batch and everything after it back for
+        the next tick; any other failure bisects the batch right away, and a
+        single row is dropped once it has failed max_attempts times.
+        Returns number of usage rows written.
+        """
+        with self._lock:
+            pending = self._retry
+            if self._usage_rows:
+                pending.append(_Batch(self._usage_rows, self._row_offsets, self._rollup, 0, self._oldest_enqueued_at))
+            self._retry = []
+            self._usage_rows = []
+            self._row_offsets = []
+            self._rollup = rollup_service.RollupBatch()
+            self._oldest_enqueued_at = None
+
+        if not pending:
+            return 0
+
+        session_factory = self._session_factory
+        if session_factory is None:
+            from .database import SessionLocal
+            session_factory = SessionLocal
+
+        written = 0
+        while pending:
+            batch = pending.pop(0)
+            started = time.monotonic()
+            try:
+                self._write(session_factory, batch)
+            except Exception as e:
+                self._failed_flushes += 1
+                if _is_transient(e):
+                    self._requeue([batch] + pending)
+                    logger.warning(f"Write-behind flush failed ({len(batch.rows)} rows), will retry: {e}")
+                    break
+                batch.attempts += 1
+                if len(batch.rows) > 1:
+                    # Data errors repeat, so find the bad rows now and write the rest
+                    pending[:0] = batch.split()
+                elif batch.attempts >= self.max_attempts:
+                    self._rows_dropped += 1
+                    logger.error(f"Write-behind dropped row after {batch.attempts} failed attempts: {batch.rows[0]!r}: {e}")
+                else:
+                    self._requeue([batch])
+                    logger.warning(f"Write-behind row failed (attempt {batch.attempts}), will retry: {e}")
+                continue
+
+            ingest_service.publish_usage_changed(batch.rows)
+
+            finished = time.monotonic()
+            enqueued_at = batch.enqueued_at
+            self._record_flush((finished - started) * 1000, (finished - enqueued_at) * 1000 if enqueued_at else 0.0)
+            self._rows_flushed += len(batch.rows)
+            written += len(batch.rows)
+            logger.debug(f"Write-behind flush: {len(batch.rows)} rows in {self._last_flush_ms:.1f}ms")
+        return written
+
+    def _write(self, session_factory: Callable, batch: _Batch):
+        from .models import UsageLog
+
+        db = session_factory()
+        try:
+            db.execute(insert(UsageLog), batch.rows)
+            batch.rollup.apply(db)
+            db.commit()
+            ingest_rows.inc(len(batch.rows))
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _requeue(self, batches: List[_Batch]):
+        with self._lock:
+            self._retry.extend(batches)
+
+    def _record_flush(self, flush_ms: float, queue_wait_ms: float):
+        self._flushes += 1
+        self._last_flush_ms = flush_ms
+        self._max_flush_ms = max(self._max_flush_ms, flush_ms)
+        # Exponential moving average keeps the number stable without storing samples
+        self._avg_flush_ms = flush_ms if self._flushes == 1 else self._avg_flush_ms * 0.9 + flush_ms * 0.1
+        self._last_queue_wait_ms = queue_wait_ms
+
+    # ------------------------------------------------------------------
+    # Observability
+    # ------------------------------------------------------------------
+
+    @property
+    def depth(self) -> int:
+        """Buffered usage rows not yet written."""
+        return self._depth()
+
+    def _depth(self) -> int:
+        return len(self._usage_rows) + sum(len(batch.rows) for batch in self._retry)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and flush latency counters."""
+        return {
+            "running": self.is_running,
+            "depth": self._depth(),
+            "flushes": self._flushes,
+            "failed_flushes": self._failed_flushes,
+            "rows_flushed": self._rows_flushed,
+            "rows_dropped": self._rows_dropped,
+            "last_flush_ms": round(self._last_flush_ms, 2),
+            "avg_flush_ms": round(self._avg_flush_ms, 2),
+            "max_flush_ms": round(self._max_flush_ms, 2),
+            "last_queue_wait_ms": round(self._last_queue_wait_ms, 2),
+        }
+
+
+# Global writer instance
+write_queue = WriteBehindQueue(
+    max_batch=settings.WRITE_BEHIND_MAX_BATCH,
+    flush_interval=settings.WRITE_BEHIND_FLUSH_INTERVAL,
+    max_queue=settings.WRITE_BEHIND_MAX_QUEUE,
+    max_attempts=settings.WRITE_BEHIND_MAX_ATTEMPTS
+)
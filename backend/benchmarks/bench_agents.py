@@ -0,0 +1,196 @@
+"""
+Concurrency benchmark for the agent hot paths (usage report + rules fetch).
+
+Simulates N agents that report usage and fetch rules at the same time
+against a temporary SQLite file and compares three ways of running the
+endpoints' DB work:
+
+- blocking: synchronous Session on the event loop (before database.AsyncDb)
+- threads:  AsyncDb in worker threads (default)
+- aiosqlite: AsyncDb on the async engine (ASYNC_DB_ENABLED; skipped if aiosqlite is missing)
+
+Besides throughput and request latency it measures event loop lag - how
+late a 10 ms ticker wakes up - which is what every connected WebSocket
+(agent pings, parent dashboard) waits on.
+
+Usage (from backend/):
+    python -m benchmarks.bench_agents --agents 500 --rounds 3 --rows 30
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.orm import sessionmaker
+
+from app import database
+from app.api import rules
+from app.api.reports import agent_endpoints
+from app.database import AsyncDb, async_database_url
+from app.models import User, Device, Rule
+from app.schemas import AgentReportRequest, AgentRulesRequest, AgentUsageLogCreate
+from app.write_queue import write_queue
+
+from .bench_ingest import _make_engine
+
+
+def _seed_agents(SessionLocal, agents: int) -> list:
+    db = SessionLocal()
+    try:
+        user = User(email="bench@example.com", password_hash="x", role="parent")
+        db.add(user)
+        db.commit()
+        devices = [
+            Device(
+                name=f"Agent {i}", device_type="windows", mac_address=f"00:00:00:00:{i // 256:02x}:{i % 256:02x}",
+                device_id=f"agent-{i}", parent_id=user.id, api_key=f"key-{i}"
+            )
+            for i in range(agents)
+        ]
+        db.add_all(devices)
+        db.commit()
+        for device in devices:
+            db.add(Rule(device_id=device.id, rule_type="time_limit", app_name="minecraft", time_limit=60, enabled=True))
+            db.add(Rule(device_id=device.id, rule_type="daily_limit", time_limit=240, enabled=True))
+        db.commit()
+        return [(d.device_id, d.api_key) for d in devices]
+    finally:
+        db.close()
+
+
+def _report(device_id: str, api_key: str, rows: int, base: datetime) -> AgentReportRequest:
+    return AgentReportRequest(
+        device_id=device_id,
+        api_key=api_key,
+        usage_logs=[
+            AgentUsageLogCreate(app_name=f"app{i % 8}.exe", window_title=f"Window {i}", duration=60,
+                                timestamp=base + timedelta(seconds=i))
+            for i in range(rows)
+        ],
+        running_processes=["chrome.exe", "minecraft.exe"]
+    )
+
+
+async def _blocking_agent(SessionLocal, credentials, report, latencies):
+    """Pre-AsyncDb endpoints: the sync ORM work runs on the event loop."""
+    start = time.perf_counter()
+    db = SessionLocal()
+    try:
+        agent_endpoints._process_report(db, report)
+        rules._build_agent_rules(db, AgentRulesRequest(device_id=credentials[0], api_key=credentials[1]))
+    finally:
+        db.close()
+    latencies.append(time.perf_counter() - start)
+
+
+async def _async_agent(session_factory, credentials, report, latencies):
+    start = time.perf_counter()
+    db = AsyncDb(session_factory)
+    await agent_endpoints.agent_report_usage(report, db=db)
+    await rules.agent_fetch_rules(AgentRulesRequest(device_id=credentials[0], api_key=credentials[1]), db=db)
+    latencies.append(time.perf_counter() - start)
+
+
+async def _run_mode(mode: str, SessionLocal, agents: list, rounds: int, rows: int) -> dict:
+    write_queue.start(SessionLocal)
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - start - 0.01)
+
+    tick = asyncio.create_task(ticker())
+    latencies = []
+    base = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=2)
+    start = time.perf_counter()
+    for r in range(rounds):
+        batch = []
+        for credentials in agents:
+            report = _report(credentials[0], credentials[1], rows, base + timedelta(minutes=r))
+            if mode == "blocking":
+                batch.append(_blocking_agent(SessionLocal, credentials, report, latencies))
+            else:
+                batch.append(_async_agent(SessionLocal if mode == "threads" else None, credentials, report, latencies))
+        await asyncio.gather(*batch)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    await write_queue.stop()
+
+    latencies.sort()
+    lags.sort()
+    return {
+        "requests_per_s": 2 * len(agents) * rounds / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[max(0, int(round(len(latencies) * 0.95)) - 1)] * 1000,
+        "lag_p95_ms": lags[max(0, int(round(len(lags) * 0.95)) - 1)] * 1000 if lags else 0.0,
+        "lag_max_ms": lags[-1] * 1000 if lags else 0.0,
+    }
+
+
+def _run_one(mode: str, agents: int, rounds: int, rows: int) -> dict:
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = _make_engine(path)
+    async_engine = None
+    previous = database.AsyncSessionLocal
+    try:
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        credentials = _seed_agents(SessionLocal, agents)
+        if mode == "aiosqlite":
+            from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+            async_engine = create_async_engine(async_database_url(f"sqlite:///{path}"), connect_args={"timeout": 20.0})
+            database.AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+
+        async def main():
+            try:
+                return await _run_mode(mode, SessionLocal, credentials, rounds, rows)
+            finally:
+                if async_engine is not None:
+                    await async_engine.dispose()
+
+        return asyncio.run(main())
+    finally:
+        database.AsyncSessionLocal = previous
+        engine.dispose()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.unlink(path + suffix)
+            except OSError:
+                pass
+
+
+def run(agents: int, rounds: int, rows: int) -> dict:
+    """Run every available mode. Returns {mode: {requests_per_s, p50_ms, p95_ms, lag_p95_ms, lag_max_ms}}."""
+    modes = ["blocking", "threads"]
+    if importlib.util.find_spec("aiosqlite") is not None:
+        modes.append("aiosqlite")
+    return {mode: _run_one(mode, agents, rounds, rows) for mode in modes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent agents benchmark (report + rules fetch)")
+    parser.add_argument("--agents", type=int, default=500, help="Simultaneous agents")
+    parser.add_argument("--rounds", type=int, default=3, help="Report + fetch rounds per agent")
+    parser.add_argument("--rows", type=int, default=30, help="Usage rows per report")
+    args = parser.parse_args()
+
+    results = run(args.agents, args.rounds, args.rows)
+    print(f"Agents benchmark: {args.agents} agents x {args.rounds} rounds, {args.rows} rows/report")
+    print(f"  {'mode':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'lag p95':>8} {'lag max':>8}")
+    for mode, r in results.items():
+        print(
+            f"  {mode:<10} {r['requests_per_s']:>8.0f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+            f"{r['lag_p95_ms']:>8.1f} {r['lag_max_ms']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
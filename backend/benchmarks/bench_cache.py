@@ -0,0 +1,125 @@
+"""
+Microbenchmark for the stats cache engine (app/cache.py SimpleCache).
+
+Compares the previous implementation (sort-based eviction of the oldest
+10% when full, prefix scan for per-device invalidation) with the current
+LRU / per-TTL expiry queue / device-index engine on a full cache: set-heavy churn,
+get hits, and per-device invalidation.
+
+Usage (from backend/):
+    python -m benchmarks.bench_cache --size 5000 --ops 200000 --devices 200
+"""
+import argparse
+import logging
+import random
+import threading
+import time
+
+from app.cache import SimpleCache
+
+logger = logging.getLogger("bench_cache")
+
+
+class _LegacySimpleCache:
+    """SimpleCache before the O(1) engine (kept here for comparison only)."""
+
+    def __init__(self, default_ttl: int = 300, max_size: int = 1000):
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.default_ttl = default_ttl
+        self.max_size = max_size
+
+    def get(self, key):
+        with self._lock:
+            if key in self._cache:
+                value, expires_at = self._cache[key]
+                if time.time() < expires_at:
+                    logger.debug(f"Cache HIT: {key}")
+                    return value
+                del self._cache[key]
+                logger.debug(f"Cache EXPIRED: {key}")
+        return None
+
+    def set(self, key, value, ttl=None, device_id=None):
+        with self._lock:
+            if len(self._cache) >= self.max_size:
+                now = time.time()
+                for k in [k for k, (_, exp) in self._cache.items() if now >= exp]:
+                    del self._cache[k]
+                if len(self._cache) >= self.max_size:
+                    sorted_items = sorted(self._cache.items(), key=lambda x: x[1][1])
+                    for k, _ in sorted_items[:int(self.max_size * 0.1)]:
+                        del self._cache[k]
+            self._cache[key] = (value, time.time() + (ttl or self.default_ttl))
+            logger.debug(f"Cache SET: {key}")
+
+    def invalidate_device(self, device_id):
+        with self._lock:
+            prefix = f"stats:{device_id}:"
+            keys = [k for k in self._cache.keys() if k.startswith(prefix)]
+            for k in keys:
+                del self._cache[k]
+            return len(keys)
+
+
+def _key(device_id: int, i: int) -> str:
+    return f"stats:{device_id}:{i}"
+
+
+def _run(cache, size: int, ops: int, devices: int) -> dict:
+    rng = random.Random(42)
+    for i in range(size):
+        cache.set(_key(i % devices, i), i, device_id=i % devices)
+
+    # Churn: every set on a full cache has to evict
+    worst = 0.0
+    start = time.perf_counter()
+    for i in range(size, size + ops):
+        op_start = time.perf_counter()
+        cache.set(_key(i % devices, i), i, device_id=i % devices)
+        worst = max(worst, time.perf_counter() - op_start)
+    set_us = (time.perf_counter() - start) * 1e6 / ops
+
+    # Lookups on recently written keys (hits)
+    recent = [size + ops - 1 - rng.randrange(size // 2) for _ in range(ops)]
+    start = time.perf_counter()
+    for i in recent:
+        cache.get(_key(i % devices, i))
+    get_us = (time.perf_counter() - start) * 1e6 / ops
+
+    # Per-device invalidation (ingest events)
+    start = time.perf_counter()
+    for device_id in range(devices):
+        cache.invalidate_device(device_id)
+    invalidate_us = (time.perf_counter() - start) * 1e6 / devices
+
+    return {"set_us": set_us, "set_max_us": worst * 1e6, "get_us": get_us, "invalidate_us": invalidate_us}
+
+
+def run(size: int, ops: int, devices: int) -> dict:
+    """Measure both engines. Returns {name: {set_us, set_max_us, get_us, invalidate_us}}."""
+    return {
+        "legacy (sort evict, prefix scan)": _run(_LegacySimpleCache(max_size=size), size, ops, devices),
+        "lru + ttl queues + device index": _run(SimpleCache(max_size=size), size, ops, devices),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stats cache engine microbenchmark")
+    parser.add_argument("--size", type=int, default=5000, help="Cache max_size")
+    parser.add_argument("--ops", type=int, default=200000, help="Set / get operations")
+    parser.add_argument("--devices", type=int, default=200, help="Distinct devices in keys")
+    args = parser.parse_args()
+
+    results = run(args.size, args.ops, args.devices)
+    print(f"Cache benchmark: size {args.size}, {args.ops} ops, {args.devices} devices (us/op)")
+    print(f"  {'engine':<34} {'set':>8} {'set max':>9} {'get':>8} {'invalidate':>11}")
+    for name, r in results.items():
+        print(
+            f"  {name:<34} {r['set_us']:>8.2f} {r['set_max_us']:>9.0f} "
+            f"{r['get_us']:>8.2f} {r['invalidate_us']:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
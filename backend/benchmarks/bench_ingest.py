@@ -0,0 +1,156 @@
+"""
+Ingest throughput benchmark (rows/sec) for the agent report write path.
+
+Compares the legacy per-row ORM path (db.add() per entry) with the bulk
+path in services/ingest_service.py on a temporary SQLite file using the
+same PRAGMAs as production.
+
+Usage (from backend/):
+    python -m benchmarks.bench_ingest --reports 200 --rows 60
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import User, Device, UsageLog
+from app.schemas import AgentUsageLogCreate
+from app.services import ingest_service
+
+
+def _make_engine(path: str):
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False, "timeout": 20.0}
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def _seed_device(SessionLocal) -> int:
+    db = SessionLocal()
+    try:
+        user = User(email="bench@example.com", password_hash="x", role="parent")
+        db.add(user)
+        db.commit()
+        device = Device(
+            name="Bench", device_type="windows", mac_address="00:00:00:00:00:00",
+            device_id="bench-device", parent_id=user.id, api_key="bench-key"
+        )
+        db.add(device)
+        db.commit()
+        return device.id
+    finally:
+        db.close()
+
+
+def _make_report(rows: int, base: datetime) -> list:
+    return [
+        AgentUsageLogCreate(
+            app_name=f"app{i % 12}.exe",
+            window_title=f"Window {i}",
+            duration=60,
+            timestamp=base + timedelta(seconds=i)
+        )
+        for i in range(rows)
+    ]
+
+
+def _run_legacy(SessionLocal, device_id: int, reports: list) -> float:
+    start = time.perf_counter()
+    for report in reports:
+        db = SessionLocal()
+        try:
+            device = db.get(Device, device_id)
+            device.last_seen = datetime.now(timezone.utc)
+            for log_data in report:
+                db.add(UsageLog(
+                    device_id=device_id,
+                    app_name=log_data.app_name,
+                    window_title=log_data.window_title,
+                    exe_path=log_data.exe_path,
+                    duration=log_data.duration,
+                    is_focused=log_data.is_focused,
+                    timestamp=log_data.timestamp
+                ))
+            db.commit()
+            db.add(device)
+            db.commit()
+        finally:
+            db.close()
+    return time.perf_counter() - start
+
+
+def _run_bulk(SessionLocal, device_id: int, reports: list) -> float:
+    start = time.perf_counter()
+    for report in reports:
+        db = SessionLocal()
+        try:
+            device = db.get(Device, device_id)
+            now_utc = datetime.now(timezone.utc)
+            device.last_seen = now_utc
+            rows, _ = ingest_service.build_usage_rows(device_id, report, now_utc)
+            ingest_service.bulk_insert_usage_logs(db, rows)
+            db.add(device)
+            db.commit()
+        finally:
+            db.close()
+    return time.perf_counter() - start
+
+
+def run(reports: int, rows: int) -> dict:
+    """Run both paths on fresh databases and return rows/sec for each."""
+    base = datetime.now(timezone.utc) - timedelta(days=1)
+    payloads = [_make_report(rows, base + timedelta(minutes=i)) for i in range(reports)]
+    total_rows = reports * rows
+    results = {}
+
+    for name, runner in (("legacy", _run_legacy), ("bulk", _run_bulk)):
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        engine = _make_engine(path)
+        try:
+            SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            device_id = _seed_device(SessionLocal)
+            elapsed = runner(SessionLocal, device_id, payloads)
+            results[name] = total_rows / elapsed if elapsed > 0 else float("inf")
+        finally:
+            engine.dispose()
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.unlink(path + suffix)
+                except OSError:
+                    pass
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent report ingest benchmark")
+    parser.add_argument("--reports", type=int, default=200, help="Number of agent reports")
+    parser.add_argument("--rows", type=int, default=60, help="Usage log entries per report")
+    args = parser.parse_args()
+
+    results = run(args.reports, args.rows)
+    print(f"Ingest benchmark: {args.reports} reports x {args.rows} rows")
+    for name, rate in results.items():
+        print(f"  {name:<8} {rate:>12,.0f} rows/sec")
+    if results.get("legacy"):
+        print(f"  speedup  {results['bulk'] / results['legacy']:>12.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Query-count benchmark for the per-app day breakdowns (app-trends, app-details).
+
+Compares the legacy per-day loops (one aggregate query per day) with the
+grouped series in services/stats_service.py, on the raw usage_logs path and
+on the daily rollup, using a temporary SQLite file seeded with synthetic
+usage. Counts SQL statements sent to the database and wall time.
+
+Usage (from backend/):
+    python -m benchmarks.bench_stats_queries --days 60 --rows-per-day 500
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import sessionmaker
+
+from app.cache import stats_cache
+from app.config import settings
+from app.db_utils import day_range_utc
+from app.models import User, UsageLog
+from app.api.reports import stats_endpoints
+from app.services import ingest_service, stats_service
+
+from .bench_ingest import _make_engine, _seed_device
+
+APP_NAME = "youtube"
+
+
+def _seed_usage(SessionLocal, device_id: int, days: int, rows_per_day: int):
+    now = datetime.now(timezone.utc)
+    db = SessionLocal()
+    try:
+        for day in range(days):
+            day_start = (now - timedelta(days=day)).replace(hour=6, minute=0, second=0, microsecond=0)
+            rows = [
+                {
+                    "device_id": device_id,
+                    "app_name": "YouTube" if i % 3 else f"app{i % 7}.exe",
+                    "window_title": None,
+                    "exe_path": None,
+                    "duration": 60,
+                    "is_focused": True,
+                    "timestamp": day_start + timedelta(seconds=i * 60)
+                }
+                for i in range(rows_per_day)
+            ]
+            ingest_service.write_usage_rows(db, rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _legacy_app_trends(db, device_id: int, app_names: list, days: int) -> list:
+    """app-trends day loop before the grouped series (one query per day)."""
+    now_utc = datetime.now(timezone.utc)
+    results = []
+    for i in range(days):
+        day_str = (now_utc - timedelta(days=i)).strftime('%Y-%m-%d')
+        day_start, day_end = day_range_utc(day_str)
+        stats = db.query(
+            func.sum(UsageLog.duration).label('total_duration'),
+            func.count(UsageLog.id).label('sessions_count'),
+            func.min(UsageLog.timestamp).label('first_use'),
+            func.max(UsageLog.timestamp).label('last_use')
+        ).filter(
+            UsageLog.device_id == device_id,
+            func.lower(UsageLog.app_name).in_(app_names),
+            UsageLog.timestamp >= day_start,
+            UsageLog.timestamp < day_end
+        ).first()
+        results.append((day_str, int(stats.total_duration or 0)))
+    return results
+
+
+def _legacy_app_details_days(db, device_id: int, app_names: list, days: int) -> list:
+    """app-details daily breakdown before the grouped series (get_app_day_duration per day)."""
+    now_utc = datetime.now(timezone.utc)
+    return [
+        stats_service.get_app_day_duration(db, device_id, app_names, (now_utc - timedelta(days=i)).strftime('%Y-%m-%d'))
+        for i in range(days)
+    ]
+
+
+def _measure(engine, fn) -> tuple:
+    """Run fn() and return (statements executed, elapsed ms)."""
+    counter = {"n": 0}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter["n"] += 1
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        start = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - start) * 1000
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return counter["n"], elapsed
+
+
+def run(days: int, rows_per_day: int) -> dict:
+    """Seed a fresh database and measure each variant. Returns {name: (queries, ms)}."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = _make_engine(path)
+    results = {}
+    rollup_enabled = settings.USAGE_ROLLUP_ENABLED
+    try:
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        device_id = _seed_device(SessionLocal)
+        _seed_usage(SessionLocal, device_id, days, rows_per_day)
+        app_names = stats_service.get_app_name_variants(APP_NAME)
+        trend_days = min(days, 60)
+        detail_days = min(days, 30)
+
+        db = SessionLocal()
+        try:
+            user = db.query(User).first()
+
+            def endpoints():
+                stats_cache.clear()
+                asyncio.run(stats_endpoints.get_app_trends(
+                    device_id, APP_NAME, days=trend_days, current_user=user, db=db
+                ))
+                asyncio.run(stats_endpoints.get_app_details(
+                    device_id, APP_NAME, days=detail_days, current_user=user, db=db
+                ))
+
+            results["legacy app-trends loop"] = _measure(
+                engine, lambda: _legacy_app_trends(db, device_id, app_names, trend_days)
+            )
+            results["legacy app-details loop"] = _measure(
+                engine, lambda: _legacy_app_details_days(db, device_id, app_names, detail_days)
+            )
+            day_strs = stats_service.local_day_strings(0, trend_days)
+            results["grouped app-trends series"] = _measure(
+                engine, lambda: stats_service.get_app_daily_stats(
+                    db, device_id, app_names, day_strs[0], day_strs[-1]
+                )
+            )
+            settings.USAGE_ROLLUP_ENABLED = False
+            results["endpoints (raw)"] = _measure(engine, endpoints)
+            settings.USAGE_ROLLUP_ENABLED = True
+            results["endpoints (rollup)"] = _measure(engine, endpoints)
+        finally:
+            db.close()
+    finally:
+        settings.USAGE_ROLLUP_ENABLED = rollup_enabled
+        engine.dispose()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.unlink(path + suffix)
+            except OSError:
+                pass
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="app-trends / app-details query-count benchmark")
+    parser.add_argument("--days", type=int, default=60, help="Days of seeded history")
+    parser.add_argument("--rows-per-day", type=int, default=500, help="Usage log rows per day")
+    args = parser.parse_args()
+
+    results = run(args.days, args.rows_per_day)
+    print(f"Stats query benchmark: {args.days} days x {args.rows_per_day} rows")
+    for name, (queries, ms) in results.items():
+        print(f"  {name:<28} {queries:>5} queries {ms:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
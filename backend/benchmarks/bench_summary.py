@@ -0,0 +1,136 @@
+"""
+Latency benchmark for the dashboard summary endpoint (get_device_summary).
+
+Seeds a temporary SQLite file with a device, a few rules and N days of
+usage history, then calls the endpoint repeatedly and reports p50 / p95
+latency and the number of SQL statements per call.
+
+Usage (from backend/):
+    python -m benchmarks.bench_summary --days 90 --rows-per-day 1000 --runs 50 --target-p95-ms 50
+Exits with status 1 when --target-p95-ms is given and p95 is above it.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from app.models import User, Rule
+from app.api.reports import summary_endpoint
+from app.services import ingest_service
+
+from .bench_ingest import _make_engine, _seed_device
+
+APPS = ["chrome.exe", "YouTube", "Minecraft", "discord.exe", "code.exe", "Roblox", "spotify.exe", "Teams"]
+
+
+def _seed(SessionLocal, device_id: int, days: int, rows_per_day: int):
+    now = datetime.now(timezone.utc)
+    db = SessionLocal()
+    try:
+        for app_name, limit in (("YouTube", 60), ("Minecraft", 90), ("Roblox", 30), ("discord", 45)):
+            db.add(Rule(device_id=device_id, rule_type="time_limit", app_name=app_name, time_limit=limit, enabled=True))
+        db.add(Rule(device_id=device_id, rule_type="daily_limit", time_limit=240, enabled=True))
+        db.add(Rule(device_id=device_id, rule_type="schedule", schedule_start_time="21:00",
+                    schedule_end_time="07:00", schedule_days="0,1,2,3,4,5,6", enabled=True))
+        db.commit()
+
+        step = max(1, (14 * 3600) // rows_per_day)
+        for day in range(days, -1, -1):
+            day_start = (now - timedelta(days=day)).replace(hour=7, minute=0, second=0, microsecond=0)
+            if day_start > now:
+                continue
+            rows = [
+                {
+                    "device_id": device_id,
+                    "app_name": APPS[(i // 20) % len(APPS)],
+                    "window_title": f"Window {i % 50}",
+                    "exe_path": None,
+                    "duration": step,
+                    "is_focused": True,
+                    "timestamp": day_start + timedelta(seconds=i * step)
+                }
+                for i in range(rows_per_day)
+                if day_start + timedelta(seconds=i * step) <= now
+            ]
+            ingest_service.write_usage_rows(db, rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+def run(days: int, rows_per_day: int, runs: int) -> dict:
+    """Seed a fresh database and time get_device_summary. Returns latency stats."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = _make_engine(path)
+    counter = {"n": 0}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter["n"] += 1
+
+    try:
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        device_id = _seed_device(SessionLocal)
+        _seed(SessionLocal, device_id, days, rows_per_day)
+
+        event.listen(engine, "before_cursor_execute", count)
+        timings = []
+        queries = []
+        for _ in range(runs):
+            db = SessionLocal()
+            try:
+                user = db.query(User).first()
+                counter["n"] = 0
+                start = time.perf_counter()
+                asyncio.run(summary_endpoint.get_device_summary(device_id, current_user=user, db=db))
+                timings.append((time.perf_counter() - start) * 1000)
+                queries.append(counter["n"])
+            finally:
+                db.close()
+        event.remove(engine, "before_cursor_execute", count)
+    finally:
+        engine.dispose()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.unlink(path + suffix)
+            except OSError:
+                pass
+
+    timings.sort()
+    return {
+        "p50_ms": statistics.median(timings),
+        "p95_ms": timings[max(0, int(round(len(timings) * 0.95)) - 1)],
+        "max_ms": timings[-1],
+        "queries": max(queries),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summary endpoint latency benchmark")
+    parser.add_argument("--days", type=int, default=90, help="Days of seeded history")
+    parser.add_argument("--rows-per-day", type=int, default=1000, help="Usage log rows per day")
+    parser.add_argument("--runs", type=int, default=50, help="Timed calls")
+    parser.add_argument("--target-p95-ms", type=float, default=None, help="Fail if p95 is above this")
+    args = parser.parse_args()
+
+    result = run(args.days, args.rows_per_day, args.runs)
+    print(f"Summary benchmark: {args.days} days x {args.rows_per_day} rows, {args.runs} runs")
+    print(f"  queries/call {result['queries']:>8}")
+    print(f"  p50          {result['p50_ms']:>8.1f} ms")
+    print(f"  p95          {result['p95_ms']:>8.1f} ms")
+    print(f"  max          {result['max_ms']:>8.1f} ms")
+
+    if args.target_p95_ms is not None and result["p95_ms"] > args.target_p95_ms:
+        print(f"  FAIL: p95 above target {args.target_p95_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Rebuild usage rollup tables from raw usage_logs.
+
+Usage:
+    python rebuild_rollups.py              # all devices
+    python rebuild_rollups.py --device 3   # single device
+    python rebuild_rollups.py --totals     # only check/repair device_usage_totals
+"""
+import argparse
+
+from app.database import SessionLocal, init_db
+from app.services import rollup_service
+
+
+def reconcile(device_id=None):
+    print("Reconciling usage totals...")
+    init_db()
+    db = SessionLocal()
+    try:
+        repaired = rollup_service.reconcile_totals(db, device_id)
+        print(f"{repaired} devices repaired")
+    finally:
+        db.close()
+
+
+def rebuild(device_id=None):
+    print("Rebuilding usage rollups...")
+    init_db()
+    db = SessionLocal()
+    try:
+        if device_id is not None:
+            count = rollup_service.rebuild_device(db, device_id)
+            print(f"Device {device_id}: {count} usage logs folded in")
+        else:
+            count = rollup_service.rebuild_all(db)
+            print(f"All devices: {count} usage logs folded in")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild usage rollups from usage_logs")
+    parser.add_argument("--device", type=int, default=None, help="Device id (default: all devices)")
+    parser.add_argument("--totals", action="store_true", help="Only reconcile device_usage_totals")
+    args = parser.parse_args()
+    if args.totals:
+        reconcile(args.device)
+    else:
+        rebuild(args.device)
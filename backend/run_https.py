@@ -10,6 +10,8 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 def main():
+    # One uvicorn worker: the in-process today usage store sees every write
+    os.environ.setdefault("TODAY_USAGE_ENABLED", "1")
     import uvicorn
     from app.config import settings
     from app.ssl_manager import certificates_exist, generate_certificates, get_ssl_context, get_local_ip
@@ -26,6 +26,9 @@ else:
     if os.path.exists(_venv_site) and _venv_site not in sys.path:
         sys.path.insert(0, _venv_site)
 
+# One uvicorn worker (see run_uvicorn): the in-process today usage store sees every write
+os.environ.setdefault("TODAY_USAGE_ENABLED", "1")
+
 # Import app setup
 try:
     from app.main import app
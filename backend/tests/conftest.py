@@ -4,12 +4,21 @@ Shared pytest fixtures for backend tests.
 import os
 import tempfile
 import pytest
+
+# Tests write through the request session; the write-behind writer would target the real DB
+os.environ.setdefault("WRITE_BEHIND_ENABLED", "0")
+# Same for the startup rebuild / shutdown snapshot of today's usage (days load on first fetch)
+os.environ.setdefault("TODAY_USAGE_PERSIST", "0")
+# Tests run in one process
+os.environ.setdefault("TODAY_USAGE_ENABLED", "1")
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 from typing import Generator
 
-from app.database import Base, get_db
+from app.database import Base, TimedQueuePool, get_db
 from app.models import User, Device, Rule, UsageLog, PairingToken
+from app.services.rule_snapshot_service import rule_snapshots
+from app.services.today_usage_service import today_usage
 
 
 @pytest.fixture(scope="function")
@@ -22,6 +31,9 @@ def db_engine():
         connect_args={"check_same_thread": False},
     )
     Base.metadata.create_all(engine)
+    # In-memory state keyed by device id, which every fresh DB reuses
+    rule_snapshots.clear()
+    today_usage.clear()
     try:
         yield engine
     finally:
@@ -43,6 +55,22 @@ def db_session(db_engine) -> Generator[Session, None, None]:
         session.close()
 
 
+@pytest.fixture
+def small_pool_engine():
+    """Temp-file SQLite engine on a one-connection TimedQueuePool (pool gauges, checkout timeouts)."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = create_engine(
+        f"sqlite:///{path}", poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05,
+        connect_args={"check_same_thread": False}
+    )
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+        os.unlink(path)
+
+
 @pytest.fixture
 def test_user(db_session: Session) -> User:
     """Create a test user."""
@@ -84,3 +112,23 @@ def override_get_db(db_session: Session):
             pass
     
     return _get_db
+
+
+@pytest.fixture
+def assert_max_queries(db_engine):
+    """
+    Fail if the block runs more SQL statements than allowed on the test engine.
+
+        with assert_max_queries(5):
+            client.get(...)
+    """
+    from contextlib import contextmanager
+    from app.query_profiler import count_queries
+
+    @contextmanager
+    def _assert_max_queries(limit: int):
+        with count_queries(db_engine) as log:
+            yield log
+        assert log.count <= limit, f"{log.count} queries (limit {limit}):\n{log.summary()}"
+
+    return _assert_max_queries
@@ -0,0 +1,77 @@
+"""
+Tests for the non-blocking DB access used by the agent hot paths (database.AsyncDb).
+"""
+import asyncio
+import json
+from datetime import datetime, timezone, timedelta
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app import database
+from app.api import rules
+from app.api.reports import agent_endpoints
+from app.database import AsyncDb, async_database_url
+from app.models import Rule, UsageLog
+from app.schemas import AgentReportRequest, AgentRulesRequest, AgentUsageLogCreate
+
+
+def test_async_database_url():
+    assert async_database_url("sqlite:////data/x.db") == "sqlite+aiosqlite:////data/x.db"
+    assert async_database_url("postgresql://u:p@h:5432/db") == "postgresql+asyncpg://u:p@h:5432/db"
+    assert async_database_url("postgresql+psycopg2://u:p@h/db") == "postgresql+asyncpg://u:p@h/db"
+    assert async_database_url("mysql://u:p@h/db") is None
+
+
+def _report_and_fetch(test_device):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    report = AgentReportRequest(
+        device_id=test_device.device_id,
+        api_key=test_device.api_key,
+        usage_logs=[
+            AgentUsageLogCreate(app_name="minecraft.exe", duration=60, timestamp=now - timedelta(minutes=i))
+            for i in range(3)
+        ],
+        running_processes=["minecraft.exe"]
+    )
+    credentials = AgentRulesRequest(device_id=test_device.device_id, api_key=test_device.api_key)
+
+    async def go():
+        db = AsyncDb()
+        result = await agent_endpoints.agent_report_usage(report, db=db)
+        response = await rules.agent_fetch_rules(credentials, db=db)
+        return db.is_async, result, json.loads(response.body)
+
+    return asyncio.run(go())
+
+
+def test_agent_paths_in_worker_threads(monkeypatch, db_engine, db_session, test_device):
+    monkeypatch.setattr(database, "AsyncSessionLocal", None)
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=db_engine))
+    db_session.add(Rule(device_id=test_device.id, rule_type="time_limit", app_name="minecraft", time_limit=30, enabled=True))
+    db_session.commit()
+
+    is_async, result, fetched = _report_and_fetch(test_device)
+
+    assert is_async is False
+    assert result["logs_received"] == 3
+    assert fetched["daily_usage"] == 180
+    assert [r["app_name"] for r in fetched["rules"]] == ["minecraft"]
+    assert db_session.query(UsageLog).count() == 3
+
+
+def test_agent_paths_on_aiosqlite(monkeypatch, db_engine, db_session, test_device):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(async_database_url(str(db_engine.url)))
+    monkeypatch.setattr(database, "AsyncSessionLocal", async_sessionmaker(async_engine, autoflush=False))
+    try:
+        is_async, result, fetched = _report_and_fetch(test_device)
+    finally:
+        asyncio.run(async_engine.dispose())
+
+    assert is_async is True
+    assert result["logs_received"] == 3
+    assert fetched["daily_usage"] == 180
+    assert db_session.query(UsageLog).count() == 3
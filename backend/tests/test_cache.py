@@ -0,0 +1,171 @@
+"""
+Tests for the stats cache and ingest-driven invalidation.
+"""
+import time
+from datetime import datetime, timezone, timedelta
+
+from app.cache import SimpleCache, stats_cache
+from app.services import ingest_service
+
+
+def test_lru_eviction_and_counters():
+    """A full cache evicts the least recently used key, not the oldest insert."""
+    cache = SimpleCache(default_ttl=300, max_size=3)
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+    assert cache.get("a") == "a"  # a becomes most recently used
+    cache.set("d", "d")
+
+    assert cache.get("b") is None
+    assert [cache.get(k) for k in ("a", "c", "d")] == ["a", "c", "d"]
+    stats = cache.stats()
+    assert stats["size"] == 3
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 4 and stats["misses"] == 1
+
+
+def test_expired_entries_purged_and_device_index():
+    cache = SimpleCache(default_ttl=300, max_size=10)
+    cache.set("short", 1, ttl=0.01, device_id=7)
+    cache.set("long", 2, device_id=7)
+    cache.set("other", 3, device_id=8)
+    time.sleep(0.02)
+    cache.set("new", 4)
+
+    assert cache.size == 3
+    assert cache.stats()["expirations"] == 1
+    assert cache.invalidate_device(7) == 1
+    assert cache.get("long") is None
+    assert cache.get("other") == 3
+
+
+def test_invalidate_window_only_overlapping():
+    """A data change drops entries whose window covers it, not older windows or other devices."""
+    cache = SimpleCache(default_ttl=300)
+    now = datetime.now(timezone.utc)
+    yesterday = (now - timedelta(days=1), now - timedelta(hours=1))
+
+    cache.set("today", 1, device_id=1, window=(now - timedelta(hours=2), None))
+    cache.set("yesterday", 2, device_id=1, window=yesterday)
+    cache.set("untagged_window", 3, device_id=1)
+    cache.set("other_device", 4, device_id=2, window=(now - timedelta(hours=2), None))
+    cache.set("global", 5)
+
+    assert cache.invalidate_window(1, now - timedelta(minutes=1), now) == 2
+    assert cache.get("today") is None
+    assert cache.get("untagged_window") is None
+    assert cache.get("yesterday") == 2
+    assert cache.get("other_device") == 4
+    assert cache.get("global") == 5
+
+    # Late data for yesterday invalidates the historical entry
+    assert cache.invalidate_window(1, now - timedelta(hours=5), now - timedelta(hours=5)) == 1
+    assert cache.get("yesterday") is None
+
+
+def test_historical_window_gets_long_ttl():
+    cache = SimpleCache(default_ttl=60, historical_ttl=3600)
+    now = datetime.now(timezone.utc)
+    cache.set("past", 1, device_id=1, window=(now - timedelta(days=2), now - timedelta(days=1)))
+    cache.set("open", 2, device_id=1, window=(now - timedelta(days=1), None))
+    assert cache._cache["past"].expires_at - cache._cache["open"].expires_at > 3000
+
+
+def test_publish_usage_changed_invalidates_stats_cache(test_device):
+    now = datetime.now(timezone.utc)
+    stats_cache.clear()
+    stats_cache.set("k", "v", device_id=test_device.id, window=(now - timedelta(days=7), None))
+    rows = [{"device_id": test_device.id, "app_name": "YouTube", "window_title": None,
+             "exe_path": None, "duration": 60, "is_focused": True,
+             "timestamp": now.replace(tzinfo=None)}]
+    assert ingest_service.usage_changed_ranges(rows)[test_device.id] == (now, now + timedelta(seconds=60))
+    ingest_service.publish_usage_changed(rows)
+    assert stats_cache.get("k") is None
+
+
+def test_get_or_compute_coalesces_concurrent_misses():
+    """Concurrent misses for one key run the computation once."""
+    import asyncio
+    cache = SimpleCache(default_ttl=300)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"value": 42}
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_compute("k", compute, device_id=1) for _ in range(10)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(r == {"value": 42} for r in results)
+    assert cache.get("k") == {"value": 42}
+    assert cache.stats()["coalesced"] == 9
+
+
+def test_single_flight_survives_cancelled_leader():
+    """Cancelling the caller that started the computation does not fail the others."""
+    import asyncio
+    cache = SimpleCache(default_ttl=300)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def scenario():
+        leader = asyncio.create_task(cache.single_flight("k", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.single_flight("k", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        result = await follower
+        assert leader.cancelled()
+        return result
+
+    assert asyncio.run(scenario()) == "done"
+    assert len(calls) == 1
+    assert cache.stats()["in_flight"] == 0
+
+
+def test_get_or_compute_skips_store_after_invalidation():
+    """A result computed across an ingest event is returned but not cached."""
+    import asyncio
+    cache = SimpleCache(default_ttl=300)
+    now = datetime.now(timezone.utc)
+
+    async def compute():
+        await asyncio.sleep(0)
+        cache.invalidate_window(1, now, now)
+        return "stale"
+
+    assert asyncio.run(cache.get_or_compute("k", compute, device_id=1, window=(now, None))) == "stale"
+    assert cache.get("k") is None
+
+
+def test_stale_while_revalidate():
+    """Within max_stale an expired value is served at once and refreshed in the background."""
+    import asyncio
+    cache = SimpleCache(default_ttl=300)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def scenario():
+        first = await cache.get_or_compute("k", compute, ttl=0.05, max_stale=10)
+        await asyncio.sleep(0.06)
+        assert cache.get("k") is None  # expired for plain get()
+        stale = await cache.get_or_compute("k", compute, ttl=0.05, max_stale=10)
+        await asyncio.sleep(0.03)  # background refresh finishes
+        fresh = await cache.get_or_compute("k", compute, ttl=0.05, max_stale=10)
+        return first, stale, fresh
+
+    assert asyncio.run(scenario()) == (1, 1, 2)
+    assert len(calls) == 2
+    stats = cache.stats()
+    assert stats["stale_served"] == 1 and stats["background_refreshes"] == 1
@@ -0,0 +1,55 @@
+"""
+Tests for connection pool metrics, read replica routing and the internal metrics endpoint.
+"""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import exc, text
+
+from app import database
+from app.config import settings
+from app.database import read_bind
+from app.main import app
+
+
+def test_pool_gauges_and_checkout_wait(small_pool_engine):
+    pool = small_pool_engine.pool
+    with small_pool_engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        stats = pool.stats()
+        assert stats["size"] == 1 and stats["checked_out"] == 1 and stats["idle"] == 0
+
+        # Pool exhausted: the second checkout waits pool_timeout and gives up
+        with pytest.raises(exc.TimeoutError):
+            small_pool_engine.connect()
+
+    stats = pool.stats()
+    assert stats["checked_out"] == 0 and stats["idle"] == 1
+    assert stats["checkouts"] == 2
+    assert stats["timeouts"] == 1
+    assert stats["max_wait_ms"] >= 40
+
+
+def test_read_bind_routes_primary_to_replica(monkeypatch, small_pool_engine):
+    replica = object()
+    assert read_bind(database.engine) is database.engine  # no replica configured
+    monkeypatch.setattr(database, "read_engine", replica)
+    assert read_bind(database.engine) is replica
+    # Sessions on other engines (tests, benchmarks) are left alone
+    assert read_bind(small_pool_engine) is small_pool_engine
+
+
+def test_internal_metrics_access(monkeypatch, small_pool_engine):
+    # CI runs on sqlite:///:memory:, whose pool has no gauges
+    monkeypatch.setattr(database, "engine", small_pool_engine)
+    monkeypatch.setattr(database, "read_engine", small_pool_engine)
+    client = TestClient(app)
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "")
+    assert client.get("/api/internal/metrics").status_code == 404
+
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "s3cret")
+    assert client.get("/api/internal/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 404
+    r = client.get("/api/internal/metrics", headers={"Authorization": "Bearer s3cret"})
+    assert r.status_code == 200
+    body = r.json()
+    assert set(body) == {"db_pools", "offload", "stats_cache", "rule_snapshots", "today_usage", "write_queue", "heartbeat"}
+    assert "checked_out" in body["db_pools"]["primary"]
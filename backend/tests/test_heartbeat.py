@@ -0,0 +1,47 @@
+"""
+Tests for the in-memory device liveness table.
+"""
+from datetime import datetime, timezone, timedelta
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Device
+from app.heartbeat import HeartbeatStore, heartbeat_store
+
+
+def test_touch_keeps_newest_timestamp():
+    """Out-of-order touches never move last_seen backwards."""
+    store = HeartbeatStore()
+    newer = datetime(2030, 1, 1, 12, 0, tzinfo=timezone.utc)
+    store.touch(1, newer)
+    store.touch(1, newer - timedelta(minutes=5))
+    assert store.get(1) == newer
+
+
+def test_flush_single_bulk_update(db_engine, db_session, test_device):
+    """Dirty entries are written once and skipped when the device no longer exists."""
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    store = HeartbeatStore()
+    seen = datetime(2030, 1, 1, 12, 0, tzinfo=timezone.utc)
+    store.touch(test_device.id, seen)
+    store.touch(test_device.id + 1000, seen)
+
+    assert store.flush(SessionLocal) == 2
+    assert store.flush(SessionLocal) == 0, "Nothing dirty after a flush"
+
+    db_session.expire_all()
+    last_seen = db_session.get(Device, test_device.id).last_seen
+    assert last_seen.replace(tzinfo=None) == seen.replace(tzinfo=None)
+
+
+def test_is_online_uses_in_memory_liveness(db_session, test_device):
+    """A ping recorded only in memory makes the device online."""
+    heartbeat_store.forget(test_device.id)
+    test_device.last_seen = datetime.now(timezone.utc) - timedelta(hours=1)
+    db_session.commit()
+    assert test_device.is_online is False
+
+    heartbeat_store.touch(test_device.id)
+    try:
+        assert test_device.is_online is True
+    finally:
+        heartbeat_store.forget(test_device.id)
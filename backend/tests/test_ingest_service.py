@@ -0,0 +1,45 @@
+"""
+Tests for the bulk usage ingest path.
+"""
+from datetime import datetime, timezone, timedelta
+
+from app.models import UsageLog
+from app.schemas import AgentUsageLogCreate
+from app.services import ingest_service
+
+
+def test_build_usage_rows_filters_system_processes(test_device):
+    """Non-trackable apps are dropped and counted."""
+    now = datetime.now(timezone.utc)
+    logs = [
+        AgentUsageLogCreate(app_name="YouTube", duration=60, timestamp=now),
+        AgentUsageLogCreate(app_name="svchost", duration=60, timestamp=now),
+        AgentUsageLogCreate(app_name="Minecraft", duration=30),
+    ]
+
+    rows, filtered = ingest_service.build_usage_rows(test_device.id, logs, now)
+
+    assert filtered == 1
+    assert [r["app_name"] for r in rows] == ["YouTube", "Minecraft"]
+    assert rows[1]["timestamp"] == now, "Missing client timestamp falls back to default"
+
+
+def test_bulk_insert_usage_logs(db_session, test_device):
+    """Whole batch is inserted and visible after a single commit."""
+    now = datetime.now(timezone.utc)
+    logs = [
+        AgentUsageLogCreate(app_name=f"app{i}", duration=10, timestamp=now - timedelta(seconds=i))
+        for i in range(50)
+    ]
+    rows, _ = ingest_service.build_usage_rows(test_device.id, logs, now)
+
+    inserted = ingest_service.bulk_insert_usage_logs(db_session, rows)
+    db_session.commit()
+
+    assert inserted == 50
+    assert db_session.query(UsageLog).filter(UsageLog.device_id == test_device.id).count() == 50
+
+
+def test_bulk_insert_empty_batch(db_session):
+    """Empty batch is a no-op."""
+    assert ingest_service.bulk_insert_usage_logs(db_session, []) == 0
@@ -0,0 +1,100 @@
+"""
+Tests for the Prometheus metrics registry and the /api/metrics endpoint.
+"""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from app import database, metrics
+from app.api import metrics as metrics_api
+from app.config import settings
+from app.database import get_async_db, AsyncDb
+from app.main import app
+from app.metrics import Counter, Histogram
+from app.rate_limiter import check_rate_limit
+
+
+def test_counter_and_histogram_exposition():
+    counter = Counter("things_total", "Things", ("kind",))
+    counter.inc(kind='a"b')
+    counter.inc(2, kind='a"b')
+    assert counter.render()[-1] == 'things_total{kind="a\\"b"} 3'
+
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, route="/x")
+    lines = histogram.render()
+    assert 'latency_seconds_bucket{route="/x",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/x",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/x",le="+Inf"} 3' in lines
+    assert 'latency_seconds_sum{route="/x"} 5.55' in lines
+    assert histogram.count(route="/x") == 3
+
+
+@pytest.fixture
+def client(monkeypatch, db_engine):
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    app.dependency_overrides[get_async_db] = lambda: AsyncDb(session_factory=SessionLocal)
+    monkeypatch.setattr(metrics_api, "_is_loopback", lambda ip: True)
+    with TestClient(app) as tc:
+        yield tc
+    app.dependency_overrides.clear()
+
+
+def test_request_queries_and_ingest_recorded(client, test_device):
+    route = "/api/reports/agent/report"
+    before = metrics.db_queries_per_request.count(route=route)
+    ingested = metrics.ingest_rows.value()
+
+    r = client.post(route, json={
+        "device_id": test_device.device_id,
+        "api_key": test_device.api_key,
+        "usage_logs": [{"app_name": "minecraft.exe", "duration": 60}],
+    })
+    assert r.status_code == 201
+
+    assert metrics.db_queries_per_request.count(route=route) == before + 1
+    assert metrics.requests_total.value(method="POST", route=route, status=201) >= 1
+    assert metrics.ingest_rows.value() == ingested + 1
+    # DB work ran in the offload pool but is attributed to the request
+    state = metrics.db_queries_per_request._values[(route,)]
+    assert state[-1] > 0
+
+
+def test_metrics_endpoint(monkeypatch, client, small_pool_engine):
+    # CI runs on sqlite:///:memory:, whose pool has no gauges
+    monkeypatch.setattr(database, "engine", small_pool_engine)
+    monkeypatch.setattr(database, "read_engine", small_pool_engine)
+    for _ in range(6):
+        check_rate_limit("10.9.8.7", endpoint="login", max_requests=5, window_seconds=60)
+
+    r = client.get("/api/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = r.text
+    assert 'rate_limit_rejections_total{endpoint="login"}' in body
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert "stats_cache_hit_ratio " in body
+    assert 'app_filter_cache_hits_total{function="is_trackable"}' in body
+    assert 'websocket_connections{kind="device"} 0' in body
+    assert 'db_pool_checked_out{engine="primary"}' in body
+
+
+def test_metrics_endpoint_hidden_from_remote_clients():
+    assert TestClient(app).get("/api/metrics").status_code == 404
+
+
+def test_metrics_loopback_check_ignores_forwarded_headers(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "s3cret")
+    monkeypatch.setenv("TRUST_PROXY", "1")
+    client = TestClient(app)
+    # A remote client claiming to be localhost
+    assert client.get("/api/metrics", headers={"X-Forwarded-For": "127.0.0.1"}).status_code == 404
+
+    # Loopback peer, but a proxy on the same host forwarded the request
+    monkeypatch.setattr(metrics_api, "_is_loopback", lambda ip: True)
+    assert client.get("/api/metrics", headers={"X-Forwarded-For": "203.0.113.9"}).status_code == 404
+    assert client.get("/api/metrics", headers={
+        "X-Forwarded-For": "203.0.113.9", "Authorization": "Bearer s3cret"
+    }).status_code == 200
+    assert client.get("/api/metrics").status_code == 200
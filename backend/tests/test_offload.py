@@ -0,0 +1,91 @@
+"""
+Tests for the per-category bounded thread pools (app.offload).
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.offload import Offload
+
+
+def test_category_limit_and_counters():
+    offload = Offload({"reports": 2})
+    lock = threading.Lock()
+    running = {"now": 0, "peak": 0}
+
+    def work():
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        time.sleep(0.02)
+        with lock:
+            running["now"] -= 1
+        return threading.current_thread().name
+
+    async def go():
+        return await asyncio.gather(*(offload.run("reports", work) for _ in range(6)))
+
+    try:
+        names = asyncio.run(go())
+        stats = offload.stats()["reports"]
+    finally:
+        offload.shutdown()
+
+    assert running["peak"] == 2
+    assert all(name.startswith("offload-reports") for name in names)
+    assert stats["limit"] == 2
+    assert stats["submitted"] == stats["completed"] == 6
+    assert stats["active"] == stats["waiting"] == 0
+    # The last tasks queued behind two rounds of work
+    assert stats["max_queue_wait_ms"] >= 30
+
+
+def test_exception_propagates_and_counts_as_failed():
+    offload = Offload()
+
+    def boom(value):
+        raise ValueError(value)
+
+    try:
+        with pytest.raises(ValueError, match="bad"):
+            asyncio.run(offload.run("db", boom, "bad"))
+        assert offload.stats()["db"]["failed"] == 1
+        # Unknown categories get a fallback pool
+        assert asyncio.run(offload.run("other", lambda a, b=0: a + b, 1, b=2)) == 3
+        assert offload.stats()["other"]["limit"] == 2
+    finally:
+        offload.shutdown()
+
+
+def test_busy_reports_pool_does_not_block_db_or_loop():
+    offload = Offload({"reports": 1, "db": 2})
+    release = threading.Event()
+
+    async def go():
+        heavy = [asyncio.ensure_future(offload.run("reports", release.wait, 5)) for _ in range(3)]
+        await asyncio.sleep(0.02)
+
+        start = time.perf_counter()
+        assert await offload.run("db", lambda: "ok") == "ok"
+        db_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lag_ms = (time.perf_counter() - start) * 1000 - 10
+
+        waiting = offload.stats()["reports"]["waiting"]
+        release.set()
+        await asyncio.gather(*heavy)
+        return db_ms, lag_ms, waiting
+
+    try:
+        db_ms, lag_ms, waiting = asyncio.run(go())
+    finally:
+        release.set()
+        offload.shutdown()
+
+    assert waiting == 2
+    assert db_ms < 1000
+    assert lag_ms < 1000
@@ -224,3 +224,24 @@ def test_postgres_usage_by_hour_query(postgres_session, postgres_device):
         assert row.hour is not None
         assert int(row.hour) in range(0, 24)
         assert row.total_seconds >= 0
+
+
+def test_postgres_offset_date_hour_expr(postgres_session, postgres_device):
+    """PostgreSQL: offset-aware date_expr/hour_expr bucket by device-local day and hour."""
+    ts = datetime(2026, 3, 2, 18, 45, tzinfo=timezone.utc)  # 00:15 on 3 March at UTC+05:30
+    postgres_session.add(UsageLog(
+        device_id=postgres_device.id,
+        app_name="App",
+        duration=60,
+        timestamp=ts
+    ))
+    postgres_session.commit()
+
+    offset = 5 * 3600 + 1800
+    row = postgres_session.query(
+        date_expr(postgres_session, UsageLog.timestamp, offset).label("date"),
+        hour_expr(postgres_session, UsageLog.timestamp, offset).label("hour"),
+    ).filter(UsageLog.device_id == postgres_device.id).one()
+
+    assert row.date == "2026-03-03"
+    assert int(row.hour) == 0
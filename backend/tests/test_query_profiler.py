@@ -0,0 +1,109 @@
+"""
+Tests for the SQL query profiler and query bounds of the dashboard endpoints.
+
+The bounds guard against N+1 regressions: data is spread over many days and
+rules, so a per-day or per-rule query shows up as a blown limit.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from app.api.auth import get_current_parent
+from app.cache import stats_cache
+from app.config import settings
+from app.database import get_db, get_async_db, AsyncDb
+from app.main import app
+from app.models import Rule
+from app.query_profiler import count_queries, normalize_sql
+from app.services import ingest_service
+
+
+def test_normalize_sql():
+    sql = """SELECT * FROM usage_logs
+             WHERE device_id = 5 AND app_name = 'it''s'  AND id IN (?, ?, ?) AND x IN (:a, :b)"""
+    assert normalize_sql(sql) == "SELECT * FROM usage_logs WHERE device_id = ? AND app_name = ? AND id IN (...) AND x IN (...)"
+    assert normalize_sql("SELECT usage_logs_1.id FROM t WHERE a = %(param_1)s") == \
+        "SELECT usage_logs_1.id FROM t WHERE a = %(param_1)s"
+
+
+def test_slow_query_logged(monkeypatch, caplog, db_engine):
+    monkeypatch.setattr(settings, "SLOW_QUERY_MS", 0.000001)
+    with caplog.at_level(logging.WARNING, logger="slow_query"):
+        with db_engine.connect() as conn:
+            conn.execute(text("SELECT 42, 'secret'"))
+    assert "SELECT ?, ?" in caplog.text
+    assert "secret" not in caplog.text
+
+
+def test_count_queries_per_engine(db_engine):
+    with count_queries(db_engine) as log:
+        with db_engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+    assert log.statements == ["SELECT ?", "SELECT ?"]
+
+
+@pytest.fixture
+def client(db_engine, db_session, test_user, test_device):
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+
+    def override_get_db():
+        session = SessionLocal()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = lambda: AsyncDb(session_factory=SessionLocal)
+    app.dependency_overrides[get_current_parent] = lambda: test_user
+
+    # 20 app limits, usage spread over ~30 days
+    for i in range(20):
+        db_session.add(Rule(device_id=test_device.id, rule_type="time_limit", app_name=f"app{i}", time_limit=30, enabled=True))
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows = [
+        dict(device_id=test_device.id, app_name=f"app{i % 20}.exe", window_title="w", duration=60,
+             timestamp=now - timedelta(hours=i * 3), created_at=now)
+        for i in range(240)
+    ]
+    ingest_service.write_usage_rows(db_session, rows)
+    db_session.commit()
+    # Load the expired test objects now, not inside the counted block
+    db_session.refresh(test_user)
+    db_session.refresh(test_device)
+    stats_cache.clear()
+
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+    stats_cache.clear()
+
+
+@pytest.mark.parametrize("path, limit", [
+    ("usage-by-hour", 3),
+    ("usage-trends?period=month", 2),
+    ("weekly-pattern?weeks=4", 2),
+    ("weekly-current", 2),
+    ("app-details?app_name=app1&days=30", 4),
+    ("app-trends?app_name=app1&days=30", 2),
+    ("summary", 5),
+    ("apps", 2),
+])
+def test_dashboard_endpoint_query_bounds(client, test_device, assert_max_queries, path, limit):
+    with assert_max_queries(limit):
+        r = client.get(f"/api/reports/device/{test_device.id}/{path}")
+    assert r.status_code == 200
+
+
+def test_debug_headers(monkeypatch, client, test_device):
+    monkeypatch.setattr(settings, "DEBUG", True)
+    r = client.get(f"/api/reports/device/{test_device.id}/summary")
+    assert int(r.headers["X-DB-Queries"]) >= 1
+    assert float(r.headers["X-DB-Time-Ms"]) > 0
+
+    monkeypatch.setattr(settings, "DEBUG", False)
+    assert "X-DB-Queries" not in client.get("/api/health").headers
@@ -0,0 +1,228 @@
+"""
+Tests for the usage rollups (usage_daily_rollup, usage_hourly_rollup).
+"""
+import asyncio
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+
+from app.models import UsageLog, UsageDailyRollup, UsageHourlyRollup
+from app.services import ingest_service, rollup_service, stats_service
+from app.write_queue import WriteBehindQueue
+
+
+def _row(device_id, ts, app_name="YouTube", duration=60):
+    return {
+        "device_id": device_id,
+        "app_name": app_name,
+        "window_title": None,
+        "exe_path": None,
+        "duration": duration,
+        "is_focused": False,
+        "timestamp": ts,
+    }
+
+
+def _raw_minutes(db, device_id):
+    """Reference: COUNT DISTINCT of UTC minute buckets (offset 0)."""
+    return db.query(
+        func.count(func.distinct(func.strftime('%Y-%m-%d %H:%M', UsageLog.timestamp)))
+    ).filter(UsageLog.device_id == device_id).scalar()
+
+
+def test_incremental_rollup_matches_raw(db_session, test_device):
+    """Two reports with overlapping minutes and apps count each minute once."""
+    base = datetime(2026, 3, 2, 10, 0, 30, tzinfo=timezone.utc)
+    first = [_row(test_device.id, base + timedelta(minutes=i), "YouTube") for i in range(5)]
+    second = [_row(test_device.id, base + timedelta(minutes=i), "Minecraft", 30) for i in range(3, 8)]
+
+    ingest_service.write_usage_rows(db_session, first)
+    db_session.commit()
+    ingest_service.write_usage_rows(db_session, second)
+    db_session.commit()
+
+    series = rollup_service.get_daily_series(db_session, test_device.id, "2026-03-02", "2026-03-02")
+    day = series["2026-03-02"]
+    assert day["minutes"] == _raw_minutes(db_session, test_device.id) == 8
+    assert day["total_seconds"] == 5 * 60 + 5 * 30
+    assert day["apps_count"] == 2
+    assert day["sessions_count"] == 10
+    assert day["first_activity"] == base
+    assert day["last_activity"] == base + timedelta(minutes=7)
+
+
+def test_rollup_uses_device_local_day(db_session, test_device):
+    """A UTC late-evening log lands on the next local day for a UTC+2 device."""
+    ts = datetime(2026, 3, 2, 23, 30, tzinfo=timezone.utc)
+    ingest_service.write_usage_rows(db_session, [_row(test_device.id, ts)], offset_seconds=7200)
+    db_session.commit()
+
+    row = db_session.query(UsageDailyRollup).filter(UsageDailyRollup.device_id == test_device.id).one()
+    assert row.local_date == "2026-03-03"
+    assert rollup_service.bitmap_from_bytes(row.minute_bitmap) == 1 << (1 * 60 + 30)
+
+
+def test_rebuild_matches_incremental(db_session, test_device):
+    """Backfill from raw logs gives the same rows as incremental maintenance."""
+    base = datetime(2026, 3, 2, 8, 0, tzinfo=timezone.utc)
+    rows = [_row(test_device.id, base + timedelta(minutes=i * 7), f"app{i % 3}", 45) for i in range(40)]
+    ingest_service.write_usage_rows(db_session, rows)
+    db_session.commit()
+
+    def snapshot():
+        return sorted(
+            (r.local_date, r.app_name, r.total_seconds, r.session_count, bytes(r.minute_bitmap))
+            for r in db_session.query(UsageDailyRollup).filter(UsageDailyRollup.device_id == test_device.id)
+        )
+
+    def hourly_snapshot():
+        return sorted(
+            (r.hour_start, r.app_name, r.total_seconds, r.session_count)
+            for r in db_session.query(UsageHourlyRollup).filter(UsageHourlyRollup.device_id == test_device.id)
+        )
+
+    before, hourly_before = snapshot(), hourly_snapshot()
+    assert rollup_service.rebuild_device(db_session, test_device.id) == 40
+    db_session.expire_all()
+    assert snapshot() == before
+    assert hourly_snapshot() == hourly_before
+
+
+def test_hourly_rollup_matches_raw(db_session, test_device, monkeypatch):
+    """Hourly totals and local-hour distribution match the raw usage_logs queries."""
+    base = datetime(2026, 3, 2, 9, 50, tzinfo=timezone.utc)
+    rows = [_row(test_device.id, base + timedelta(minutes=i * 5), "YouTube", 40 + i) for i in range(30)]
+    rows += [_row(test_device.id, base + timedelta(minutes=i * 9), "Minecraft", 25) for i in range(10)]
+    ingest_service.write_usage_rows(db_session, rows[:15])
+    db_session.commit()
+    ingest_service.write_usage_rows(db_session, rows[15:])
+    db_session.commit()
+
+    hourly = {
+        (date, hour): total
+        for date, hour, total in rollup_service.get_hourly_totals(db_session, test_device.id, base - timedelta(hours=1))
+    }
+    expected = {}
+    for row in rows:
+        key = (row["timestamp"].strftime("%Y-%m-%d"), row["timestamp"].hour)
+        expected[key] = expected.get(key, 0) + row["duration"]
+    assert hourly == expected
+
+    app_names = stats_service.get_app_name_variants("youtube")
+    from_rollup = stats_service.get_hourly_distribution(db_session, test_device.id, app_names, "2026-03-01", 3600)
+    monkeypatch.setattr(stats_service.settings, "USAGE_ROLLUP_ENABLED", False)
+    from_raw = stats_service.get_hourly_distribution(db_session, test_device.id, app_names, "2026-03-01", 3600)
+    assert from_rollup == from_raw
+    assert sum(h["duration_seconds"] for h in from_rollup) == sum(40 + i for i in range(30))
+
+
+def test_half_hour_offset_reads_raw_hours(db_session, test_device, monkeypatch):
+    """+05:30: UTC hour buckets straddle local hours, so the default path must match the raw query."""
+    offset = 5 * 3600 + 1800
+    base = datetime(2026, 3, 2, 9, 10, tzinfo=timezone.utc)
+    rows = [_row(test_device.id, base + timedelta(minutes=i * 10), "YouTube", 30 + i) for i in range(12)]
+    ingest_service.write_usage_rows(db_session, rows, offset_seconds=offset)
+    db_session.commit()
+
+    start = base - timedelta(hours=1)
+    app_names = stats_service.get_app_name_variants("youtube")
+    default = (
+        sorted(stats_service.get_local_hourly_usage(db_session, test_device.id, start, offset)),
+        stats_service.get_hourly_distribution(db_session, test_device.id, app_names, "2026-03-01", offset),
+    )
+    monkeypatch.setattr(stats_service.settings, "USAGE_ROLLUP_ENABLED", False)
+    raw = (
+        sorted(stats_service.get_local_hourly_usage(db_session, test_device.id, start, offset)),
+        stats_service.get_hourly_distribution(db_session, test_device.id, app_names, "2026-03-01", offset),
+    )
+    assert default == raw
+    # 09:10-11:00 UTC = 14:40-16:30 local: three local hours, not two
+    assert [hour for _, hour, _ in raw[0]] == [14, 15, 16]
+
+
+def test_needs_backfill(db_session, test_device):
+    """Raw logs without rollup rows trigger the startup backfill."""
+    assert rollup_service.needs_backfill(db_session) is False
+    ingest_service.bulk_insert_usage_logs(db_session, [_row(test_device.id, datetime.now(timezone.utc))])
+    db_session.commit()
+    assert rollup_service.needs_backfill(db_session) is True
+    rollup_service.rebuild_all(db_session)
+    assert rollup_service.needs_backfill(db_session) is False
+
+
+def test_write_queue_applies_rollup(db_engine, db_session, test_device):
+    """Queued rows from several reports are coalesced into one rollup row."""
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    queue = WriteBehindQueue(max_batch=1000, flush_interval=60, session_factory=SessionLocal)
+    base = datetime(2026, 3, 2, 12, 0, tzinfo=timezone.utc)
+
+    async def scenario():
+        queue.start()
+        assert queue.enqueue_usage([_row(test_device.id, base)])
+        assert queue.enqueue_usage([_row(test_device.id, base + timedelta(minutes=1))])
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+    row = db_session.query(UsageDailyRollup).filter(UsageDailyRollup.device_id == test_device.id).one()
+    assert row.session_count == 2
+    assert row.total_seconds == 120
+    assert rollup_service.count_minutes(rollup_service.bitmap_from_bytes(row.minute_bitmap)) == 2
+
+
+def test_usage_totals_incremental_and_reconcile(db_session, test_device):
+    """All-time totals follow ingest; reconcile_totals repairs drift from raw logs."""
+    base = datetime(2026, 3, 2, 8, 0, tzinfo=timezone.utc)
+    ingest_service.write_usage_rows(db_session, [_row(test_device.id, base + timedelta(minutes=i), duration=30) for i in range(10)])
+    db_session.commit()
+    ingest_service.write_usage_rows(db_session, [_row(test_device.id, base + timedelta(days=1), "Minecraft", 90)])
+    db_session.commit()
+
+    assert rollup_service.get_usage_totals(db_session, test_device.id) == (10 * 30 + 90, base.replace(tzinfo=None) + timedelta(days=1))
+    assert rollup_service.reconcile_totals(db_session) == 0
+
+    # Rows written without the rollup path (e.g. a manual import) are picked up by reconcile
+    ingest_service.bulk_insert_usage_logs(db_session, [_row(test_device.id, base + timedelta(days=2), duration=15)])
+    db_session.commit()
+    assert rollup_service.reconcile_totals(db_session) == 1
+    db_session.expire_all()
+    total, last_usage = rollup_service.get_usage_totals(db_session, test_device.id)
+    assert total == 10 * 30 + 90 + 15
+    assert last_usage.replace(tzinfo=timezone.utc) == base + timedelta(days=2)
+
+
+def test_cleanup_trims_rollups_and_totals(db_session, test_user, test_device, monkeypatch):
+    """Deleting old logs leaves the rollups and totals a rebuild from the remaining logs would give."""
+    from app.api.reports import device_endpoints
+
+    events = []
+    monkeypatch.setattr(device_endpoints, "publish_data_changed", lambda *args: events.append(args))
+    test_device.timezone_offset = 19800  # UTC+05:30: hour and day boundaries differ
+    db_session.commit()
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=2)
+    rows = [_row(test_device.id, cutoff + timedelta(minutes=m), f"app{m % 2}", 40)
+            for m in (-2 * 1440, -300, -20, -5, 5, 20, 300, 1440)]
+    ingest_service.write_usage_rows(db_session, rows, offset_seconds=19800)
+    db_session.commit()
+
+    result = asyncio.run(device_endpoints.cleanup_old_logs(days=2, current_user=test_user, db=db_session))
+    assert result["deleted_count"] == 4
+    assert events and events[0][0] == test_device.id and events[0][1] == rows[0]["timestamp"]
+
+    def snapshot():
+        db_session.expire_all()
+        daily = sorted(
+            (r.local_date, r.app_name, r.total_seconds, r.session_count, bytes(r.minute_bitmap))
+            for r in db_session.query(UsageDailyRollup).filter(UsageDailyRollup.device_id == test_device.id)
+        )
+        hourly = sorted(
+            (r.hour_start, r.app_name, r.total_seconds, r.session_count)
+            for r in db_session.query(UsageHourlyRollup).filter(UsageHourlyRollup.device_id == test_device.id)
+        )
+        return daily, hourly, rollup_service.get_usage_totals(db_session, test_device.id)[0]
+
+    trimmed = snapshot()
+    assert trimmed[2] == 4 * 40
+    rollup_service.rebuild_device(db_session, test_device.id)
+    assert snapshot() == trimmed
@@ -7,13 +7,18 @@ from sqlalchemy.orm import sessionmaker
 from datetime import datetime, timezone, timedelta
 
 from app.main import app
-from app.database import get_db
+from app.database import get_db, get_async_db, AsyncDb
 from app.models import User, Device, Rule, UsageLog
+from app.api.auth import get_current_parent
+from app.query_profiler import count_queries
+from app.schemas import RuleResponse
+from app.services.rule_snapshot_service import expand_days, normalize_time, rule_snapshots
+from app.services.rule_version_service import get_rules_version
 
 
 @pytest.fixture
 def client(db_engine, db_session):
-    """Create test client. get_db yields a new session to same DB so request thread sees test data."""
+    """Create test client. get_db / get_async_db use new sessions to same DB so request thread sees test data."""
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
 
     def override_get_db():
@@ -23,7 +28,11 @@ def client(db_engine, db_session):
         finally:
             session.close()
 
+    def override_get_async_db():
+        return AsyncDb(session_factory=SessionLocal)
+
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
     with TestClient(app, base_url="http://test") as tc:
         yield tc
     app.dependency_overrides.clear()
@@ -106,3 +115,153 @@ def test_agent_fetch_rules_calculates_daily_usage(client, db_session, test_user,
     assert data["daily_usage"] >= 0
     assert "YouTube" in data["usage_by_app"]
     assert data["usage_by_app"]["YouTube"] >= 300
+
+
+def test_agent_fetch_rules_unchanged_version(client, db_session, test_user, test_device):
+    """Rule changes bump the version; a current known_version gets only usage."""
+    app.dependency_overrides[get_current_parent] = lambda: test_user
+    credentials = {"device_id": test_device.device_id, "api_key": test_device.api_key}
+
+    first = client.post("/api/rules/agent/fetch", json=credentials).json()
+    assert first["rules_version"] == 0 and first["unchanged"] is False
+
+    created = client.post("/api/rules/", json={
+        "device_id": test_device.id, "rule_type": "time_limit", "app_name": "minecraft", "time_limit": 30
+    })
+    assert created.status_code == 201
+    data = client.post("/api/rules/agent/fetch", json={**credentials, "known_version": 0}).json()
+    assert data["rules_version"] == 1
+    assert data["unchanged"] is False
+    assert [r["app_name"] for r in data["rules"]] == ["minecraft"]
+
+    db_session.add(UsageLog(device_id=test_device.id, app_name="minecraft.exe", duration=60,
+                            timestamp=datetime.now(timezone.utc)))
+    db_session.commit()
+    data = client.post("/api/rules/agent/fetch", json={**credentials, "known_version": 1}).json()
+    assert data["unchanged"] is True
+    assert data["rules"] == []
+    assert data["usage_by_app"] == {"minecraft.exe": 60}
+
+    assert client.post(f"/api/devices/{test_device.id}/lock").status_code == 200
+    assert client.delete(f"/api/rules/{created.json()['id']}").status_code == 204
+    data = client.post("/api/rules/agent/fetch", json={**credentials, "known_version": 1}).json()
+    assert data["rules_version"] == 3
+    assert [r["rule_type"] for r in data["rules"]] == ["lock_device"]
+
+
+def test_agent_fetch_rules_compiled_snapshot(client, db_session, test_device):
+    """Rules are compiled once per version and served normalized."""
+    db_session.add_all([
+        Rule(device_id=test_device.id, rule_type="schedule", schedule_start_time="8:00",
+             schedule_end_time="20:30", schedule_days="0-2,5", enabled=True),
+        Rule(device_id=test_device.id, rule_type="app_block", app_name="Steam.exe, Discord", enabled=True),
+        Rule(device_id=test_device.id, rule_type="app_block", app_name="off", enabled=False),
+    ])
+    db_session.commit()
+    credentials = {"device_id": test_device.device_id, "api_key": test_device.api_key}
+
+    data = client.post("/api/rules/agent/fetch", json=credentials).json()
+    schedule, block = data["rules"]
+    assert schedule["schedule_start_time"] == "08:00"
+    assert schedule["schedule_end_time"] == "20:30"
+    assert schedule["schedule_days"] == "0,1,2,5"
+    assert block["app_name"] == "steam.exe,discord"
+    assert set(block) == set(RuleResponse.model_fields)
+
+    with count_queries() as log:
+        again = client.post("/api/rules/agent/fetch", json=credentials).json()
+    assert again["rules"] == data["rules"]
+    assert not any("FROM rules" in sql for sql in log.statements)
+    assert rule_snapshots.stats()["hits"] == 1
+
+
+def _second_device(db_session, test_user):
+    device = Device(name="Second", device_id="second-device-id", device_type="windows",
+                    parent_id=test_user.id, mac_address="AA:BB:CC:DD:EE:01", api_key="second-api-key")
+    db_session.add(device)
+    db_session.commit()
+    return device
+
+
+def test_bulk_rules_upsert_and_delete(client, db_session, test_user, test_device):
+    """Upserts match like POST /api/rules/, deletes run first, one version bump per device."""
+    app.dependency_overrides[get_current_parent] = lambda: test_user
+    other = _second_device(db_session, test_user)
+    steam = Rule(device_id=test_device.id, rule_type="app_block", app_name="steam", enabled=True)
+    old_limit = Rule(device_id=other.id, rule_type="daily_limit", time_limit=60, enabled=True)
+    db_session.add_all([steam, old_limit])
+    db_session.commit()
+    ids = (test_device.id, other.id, steam.id, old_limit.id)
+
+    limit = {"rule_type": "time_limit", "app_name": "youtube", "time_limit": 30}
+    schedule = {"rule_type": "schedule", "schedule_start_time": "08:00", "schedule_end_time": "20:00"}
+    r = client.post("/api/rules/bulk", json={
+        "upsert": [
+            {"device_id": ids[0], "rule_type": "app_block", "app_name": "steam", "enabled": False},
+            {"device_id": ids[0], **limit},
+            {"device_id": ids[0], **limit, "time_limit": 45},
+            {"device_id": ids[1], **limit},
+            {"device_id": ids[0], **schedule},
+            {"device_id": ids[0], **schedule},
+            {"device_id": ids[1], "rule_type": "daily_limit", "time_limit": 90},
+        ],
+        "delete": [ids[3]],
+    })
+    assert r.status_code == 200
+    data = r.json()
+    assert data["deleted"] == [ids[3]] and data["devices"] == [ids[0], ids[1]]
+    rules = data["rules"]
+    assert rules[0]["id"] == ids[2] and rules[0]["enabled"] is False
+    assert rules[1]["id"] == rules[2]["id"] and rules[2]["time_limit"] == 45
+    assert rules[4]["id"] != rules[5]["id"]
+    assert rules[6]["id"] != ids[3] and rules[6]["time_limit"] == 90
+
+    db_session.expire_all()
+    assert db_session.query(Rule).count() == 6
+    assert get_rules_version(db_session, ids[0]) == 1
+    assert get_rules_version(db_session, ids[1]) == 1
+
+
+def test_bulk_rules_one_transaction(client, db_engine, db_session, test_user, test_device):
+    """Template for many devices costs a fixed number of queries; errors change nothing."""
+    app.dependency_overrides[get_current_parent] = lambda: test_user
+    other = _second_device(db_session, test_user)
+    upsert = [
+        {"device_id": device_id, "rule_type": "app_block", "app_name": f"app{i}"}
+        for device_id in (test_device.id, other.id) for i in range(100)
+    ]
+    with count_queries(db_engine) as log:
+        r = client.post("/api/rules/bulk", json={"upsert": upsert})
+    assert r.status_code == 200 and len(r.json()["rules"]) == 200
+    # SQLite has no ordered multi-row RETURNING, so the ORM inserts new rules one by one
+    # (batched on PostgreSQL); everything else is independent of the batch size
+    other_statements = [sql for sql in log.statements if not sql.startswith("INSERT INTO rules")]
+    assert len(other_statements) <= 8, other_statements
+
+    r = client.post("/api/rules/bulk", json={"upsert": upsert[:1], "delete": [999999]})
+    assert r.status_code == 404
+    r = client.post("/api/rules/bulk", json={"upsert": [{**upsert[0], "device_id": 999999}]})
+    assert r.status_code == 404
+    db_session.expire_all()
+    assert get_rules_version(db_session, test_device.id) == 1
+
+
+@pytest.mark.parametrize("days, expected", [
+    ("0-6", "0,1,2,3,4,5,6"),
+    ("1,3", "1,3"),
+    ("4-2", "4-2"),
+    ("weekdays", "weekdays"),
+    (None, None),
+])
+def test_expand_days(days, expected):
+    assert expand_days(days) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("8:5", "08:05"),
+    ("23:59", "23:59"),
+    ("25:00", "25:00"),
+    ("noon", "noon"),
+])
+def test_normalize_time(value, expected):
+    assert normalize_time(value) == expected
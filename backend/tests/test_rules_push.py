@@ -0,0 +1,114 @@
+"""
+Tests for pushing rule changes to connected agents over WebSocket.
+"""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from app import database
+from app.api.auth import get_current_parent
+from app.api.websocket import parse_agent_features
+from app.database import get_db
+from app.main import app
+
+
+@pytest.fixture
+def client(monkeypatch, db_engine, test_user):
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+
+    def override_get_db():
+        session = SessionLocal()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    # WebSocket auth runs in its own short-lived session (run_db)
+    monkeypatch.setattr(database, "SessionLocal", SessionLocal)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_current_parent] = lambda: test_user
+    with TestClient(app) as tc:
+        yield tc
+    app.dependency_overrides.clear()
+
+
+def _connect(client, device, features=""):
+    headers = {"X-API-Key": device.api_key}
+    if features:
+        headers["X-Agent-Features"] = features
+    return client.websocket_connect(f"/ws/device/{device.device_id}", headers=headers)
+
+
+def _create_rule(client, device, app_name):
+    r = client.post("/api/rules/", json={
+        "device_id": device.id, "rule_type": "app_block", "app_name": app_name
+    })
+    assert r.status_code == 201
+    return r.json()["id"]
+
+
+def test_parse_agent_features():
+    assert parse_agent_features(" Rules-Push, rules-delta ,") == {"rules-push", "rules-delta"}
+    assert parse_agent_features("") == frozenset()
+
+
+def test_push_full_then_deltas(client, test_device):
+    with _connect(client, test_device, "rules-push, rules-delta") as ws:
+        first_id = _create_rule(client, test_device, "Steam")
+        msg = ws.receive_json()
+        assert msg["type"] == "rules"
+        payload = msg["payload"]
+        assert payload["rules_version"] == 1
+        assert [r["app_name"] for r in payload["rules"]] == ["steam"]
+        assert payload["settings_protection"] == "full"
+
+        second_id = _create_rule(client, test_device, "Discord")
+        payload = ws.receive_json()["payload"]
+        assert "rules" not in payload
+        assert payload["base_version"] == 1 and payload["rules_version"] == 2
+        assert [r["id"] for r in payload["upsert"]] == [second_id]
+        assert payload["remove"] == []
+
+        assert client.delete(f"/api/rules/{first_id}").status_code == 204
+        payload = ws.receive_json()["payload"]
+        assert payload["base_version"] == 2 and payload["rules_version"] == 3
+        assert payload["upsert"] == [] and payload["remove"] == [first_id]
+
+        assert client.post(f"/api/devices/{test_device.id}/lock").status_code == 200
+        payload = ws.receive_json()["payload"]
+        assert [r["rule_type"] for r in payload["upsert"]] == ["lock_device"]
+
+
+def test_push_without_delta_feature_sends_full_set(client, test_device):
+    with _connect(client, test_device, "rules-push") as ws:
+        _create_rule(client, test_device, "steam")
+        ws.receive_json()
+        _create_rule(client, test_device, "discord")
+        payload = ws.receive_json()["payload"]
+        assert payload["rules_version"] == 2
+        assert [r["app_name"] for r in payload["rules"]] == ["steam", "discord"]
+
+
+def test_legacy_agent_gets_refresh_command(client, test_device):
+    with _connect(client, test_device) as ws:
+        _create_rule(client, test_device, "steam")
+        assert ws.receive_json() == {"type": "command", "cmd": "REFRESH_RULES", "payload": {}}
+
+        assert client.post(f"/api/devices/{test_device.id}/lock").status_code == 200
+        assert ws.receive_json()["cmd"] == "LOCK_NOW"
+
+
+def test_bulk_change_pushes_once(client, test_device):
+    with _connect(client, test_device, "rules-push, rules-delta") as ws:
+        r = client.post("/api/rules/bulk", json={"upsert": [
+            {"device_id": test_device.id, "rule_type": "app_block", "app_name": name}
+            for name in ("steam", "discord", "roblox")
+        ]})
+        assert r.status_code == 200
+        payload = ws.receive_json()["payload"]
+        assert payload["rules_version"] == 1 and len(payload["rules"]) == 3
+
+        # The next message is the next version, not a repeat of the bulk change
+        _create_rule(client, test_device, "minecraft")
+        payload = ws.receive_json()["payload"]
+        assert payload["base_version"] == 1 and payload["rules_version"] == 2
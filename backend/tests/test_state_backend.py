@@ -0,0 +1,153 @@
+"""
+Tests for the state backends and the shared stats cache tier.
+
+Two SqliteStateBackend instances on one file stand in for two worker
+processes (each instance has its own event origin).
+"""
+import asyncio
+import time
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from app.cache import SimpleCache
+from app.rate_limiter import RateLimiter
+from app.state_backend import MemoryStateBackend, SqliteStateBackend, StateBackend, StateMap
+
+
+def test_backend_must_implement_interface():
+    class Partial(StateBackend):
+        def get(self, namespace, key, default=None):
+            return default
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryStateBackend()
+    else:
+        backend = SqliteStateBackend(str(tmp_path / "state.db"))
+        yield backend
+        backend.close()
+
+
+def test_kv_ttl_add_incr(backend):
+    backend.set("ns", "a", {"x": 1})
+    backend.set("ns", "short", 1, ttl=0.05)
+    assert backend.get("ns", "a") == {"x": 1}
+    assert backend.get("other", "a") is None
+
+    assert backend.add("ns", "once", 1, ttl=0.05) is True
+    assert backend.add("ns", "once", 2, ttl=0.05) is False
+    time.sleep(0.06)
+    assert backend.get("ns", "short") is None
+    assert backend.add("ns", "once", 3, ttl=0.05) is True
+
+    assert backend.incr("gen", "7") == 1
+    assert backend.incr("gen", "7", 2) == 3
+    assert backend.delete("ns", "a") is True
+    assert backend.delete("ns", "a") is False
+
+
+def test_rate_limiter_sliding_window(backend):
+    limiter = RateLimiter(backend)
+    results = [limiter.check("1.2.3.4:login", 3, 60) for _ in range(4)]
+
+    assert [r[0] for r in results] == [True, True, True, False]
+    assert [r[1] for r in results[:3]] == [2, 1, 0]
+    assert 59 <= results[3][2] <= 61
+    assert limiter.get_retry_after("1.2.3.4:login", 60) == results[3][2]
+    assert limiter.is_allowed("5.6.7.8:login", 3, 60) == (True, 2)
+
+
+def test_state_map_dict_interface(backend):
+    procs = StateMap("running_processes", backend=backend)
+    procs[5] = {"processes": ["a.exe"], "updated_at": datetime(2026, 1, 1, tzinfo=timezone.utc)}
+
+    assert 5 in procs and 6 not in procs
+    assert procs[5]["updated_at"].year == 2026
+    assert procs.get(6, {}) == {}
+    del procs[5]
+    assert procs.get(5) is None
+    with pytest.raises(KeyError):
+        del procs[5]
+
+
+def test_sqlite_backend_shared_between_instances(tmp_path):
+    path = str(tmp_path / "state.db")
+    a, b = SqliteStateBackend(path), SqliteStateBackend(path)
+    try:
+        a.set("ns", "k", [1, 2])
+        assert b.get("ns", "k") == [1, 2]
+        assert RateLimiter(a).check("ip", 1, 60)[0] is True
+        assert RateLimiter(b).check("ip", 1, 60)[0] is False
+
+        start_b, _ = b.poll("ch", None)
+        a.publish("ch", ("device", 1))
+        b.publish("ch", ("device", 2))
+        last_id, messages = b.poll("ch", start_b)
+        # Own events are skipped
+        assert messages == [("device", 1)]
+        assert b.poll("ch", last_id) == (last_id, [])
+
+        # Events purged before they were read -> caller must resync
+        a.EVENT_RETENTION = -1
+        a._next_purge = 0
+        a.set("ns", "trigger", 1)
+        assert b.poll("ch", start_b)[1] is None
+    finally:
+        a.close()
+        b.close()
+
+
+def test_shared_cache_tier_across_workers(tmp_path):
+    path = str(tmp_path / "state.db")
+    backend_a, backend_b = SqliteStateBackend(path), SqliteStateBackend(path)
+    cache_a = SimpleCache(backend=backend_a, sync_interval=0)
+    cache_b = SimpleCache(backend=backend_b, sync_interval=0)
+    now = datetime.now(timezone.utc)
+    today = (now - timedelta(hours=3), None)
+    try:
+        cache_b.get("warmup")  # start B's event cursor
+        cache_a.set("stats:1:today", {"v": 1}, device_id=1, window=today)
+        cache_a.set("stats:2:today", {"v": 2}, device_id=2, window=today)
+
+        # B reuses A's value and keeps a local copy
+        assert cache_b.get("stats:1:today") == {"v": 1}
+        assert cache_b.stats()["shared_hits"] == 1
+        assert cache_b.size == 1
+
+        # New data on device 1 in worker A: B drops its local copy and the shared one is retired
+        cache_a.invalidate_window(1, now - timedelta(minutes=1), now)
+        assert cache_b.get("stats:1:today") is None
+        assert cache_a.get("stats:1:today") is None
+        assert cache_b.get("stats:2:today") == {"v": 2}
+
+        cache_a.clear()
+        assert cache_b.get("stats:2:today") is None
+    finally:
+        backend_a.close()
+        backend_b.close()
+
+
+def test_shared_cache_skips_result_invalidated_by_other_worker(tmp_path):
+    """A value computed while another worker invalidated the device is not stored."""
+    path = str(tmp_path / "state.db")
+    backend_a, backend_b = SqliteStateBackend(path), SqliteStateBackend(path)
+    cache_a = SimpleCache(backend=backend_a, sync_interval=0)
+    cache_b = SimpleCache(backend=backend_b, sync_interval=0)
+
+    async def compute():
+        cache_b.invalidate_device(3)
+        return "old"
+
+    try:
+        assert asyncio.run(cache_a.get_or_compute("stats:3:x", compute, device_id=3)) == "old"
+        assert cache_a.get("stats:3:x") is None
+        assert cache_b.get("stats:3:x") is None
+    finally:
+        backend_a.close()
+        backend_b.close()
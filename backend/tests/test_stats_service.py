@@ -98,3 +98,70 @@ def test_get_activity_boundaries(db_session, test_device):
     
     assert first == "08:00", "Should return first activity time"
     assert last == "20:30", "Should return last activity time"
+
+
+def test_get_day_range_stats_matches_per_day_helpers(db_session, test_device):
+    """Range query returns the same numbers as the per-day helpers, in one query."""
+    base = datetime(2026, 3, 2, 8, 0, tzinfo=timezone.utc)
+    for day in range(3):
+        for i in range(10):
+            db_session.add(UsageLog(
+                device_id=test_device.id,
+                app_name="YouTube" if i % 2 else "Minecraft",
+                duration=30,
+                timestamp=base + timedelta(days=day, minutes=i * (day + 1), seconds=i)
+            ))
+    db_session.commit()
+    
+    series = stats_service.get_day_range_stats(db_session, test_device.id, "2026-03-01", "2026-03-05")
+    
+    assert sorted(series) == ["2026-03-02", "2026-03-03", "2026-03-04"]
+    for day_str, day in series.items():
+        apps_count, sessions_count = stats_service.get_day_stats(db_session, test_device.id, day_str)
+        first, last = stats_service.get_activity_boundaries(db_session, test_device.id, day_str)
+        assert day["minutes"] == stats_service.calculate_day_usage_minutes(db_session, test_device.id, day_str)
+        assert (day["apps_count"], day["sessions_count"]) == (apps_count, sessions_count)
+        assert day["first_activity"].strftime('%H:%M') == first
+        assert day["last_activity"].strftime('%H:%M') == last
+        assert day["total_seconds"] == 300
+
+
+def test_get_app_daily_stats_matches_per_day_duration(db_session, test_device):
+    """Grouped per-app series equals get_app_day_duration for every day."""
+    base = datetime(2026, 3, 2, 10, 0, tzinfo=timezone.utc)
+    for day in range(4):
+        for app_name, duration in (("YouTube", 60 * (day + 1)), ("youtube.exe", 15), ("Minecraft", 90)):
+            db_session.add(UsageLog(
+                device_id=test_device.id,
+                app_name=app_name,
+                duration=duration,
+                timestamp=base + timedelta(days=day, minutes=day)
+            ))
+    db_session.commit()
+    
+    app_names = stats_service.get_app_name_variants("YouTube")
+    series = stats_service.get_app_daily_stats(db_session, test_device.id, app_names, "2026-03-01", "2026-03-06")
+    
+    assert len(series) == 4
+    for day_str, day in series.items():
+        assert day["total_seconds"] == stats_service.get_app_day_duration(db_session, test_device.id, app_names, day_str)
+        assert day["sessions_count"] == 2
+
+
+def test_local_day_bucketing_in_sql(db_session, test_device, monkeypatch):
+    """Half-hour offset: days and hours are bucketed in device local time by the query."""
+    monkeypatch.setattr(stats_service.settings, "USAGE_ROLLUP_ENABLED", False)
+    offset = 5 * 3600 + 1800  # UTC+05:30
+    # 18:45 UTC = 00:15 next local day; 18:15 UTC = 23:45 local
+    for ts in (datetime(2026, 3, 2, 18, 15, tzinfo=timezone.utc), datetime(2026, 3, 2, 18, 45, tzinfo=timezone.utc)):
+        db_session.add(UsageLog(device_id=test_device.id, app_name="YouTube", duration=60, timestamp=ts))
+    db_session.commit()
+    
+    series = stats_service.get_day_range_stats(db_session, test_device.id, "2026-03-02", "2026-03-03", offset)
+    assert {d: v["sessions_count"] for d, v in series.items()} == {"2026-03-02": 1, "2026-03-03": 1}
+    
+    distribution = stats_service.get_hourly_distribution(
+        db_session, test_device.id, ["youtube"], "2026-03-01", offset
+    )
+    assert distribution[23]["duration_seconds"] == 60
+    assert distribution[0]["duration_seconds"] == 60
@@ -0,0 +1,114 @@
+"""
+Tests for the in-memory today usage accumulators (agent rules fetch).
+"""
+from datetime import datetime, timedelta, timezone
+
+from app.api import rules as rules_api
+from app.models import UsageLog
+from app.query_profiler import count_queries
+from app.services import ingest_service
+from app.services.today_usage_service import TodayUsageStore, device_day_start, today_usage
+
+
+def _rows(device, *entries):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return [
+        dict(device_id=device.id, app_name=app_name, window_title="w", duration=duration,
+             timestamp=now - timedelta(minutes=minutes_ago), created_at=now)
+        for app_name, duration, minutes_ago in entries
+    ]
+
+
+def test_ingest_updates_loaded_day_without_query(db_engine, db_session, test_device):
+    ingest_service.write_usage_rows(db_session, _rows(test_device, ("steam.exe", 60, 1)))
+    db_session.commit()
+    assert today_usage.get(db_session, test_device) == (60, {"steam.exe": 60})
+    rows_added = today_usage.stats()["rows_added"]
+
+    # Same minute twice counts once; a second app adds its own seconds
+    ingest_service.write_usage_rows(db_session, _rows(test_device, ("steam.exe", 30, 1), ("chrome.exe", 45, 0)))
+    db_session.add(UsageLog(device_id=test_device.id, app_name="chrome.exe", duration=15,
+                            timestamp=datetime.now(timezone.utc)))
+    db_session.commit()
+
+    with count_queries(db_engine) as log:
+        assert today_usage.get(db_session, test_device) == (120, {"steam.exe": 90, "chrome.exe": 60})
+    assert not any("usage_logs" in sql for sql in log.statements)
+    assert today_usage.stats()["rows_added"] == rows_added + 3
+
+
+def test_rolled_back_rows_are_not_counted(db_session, test_device):
+    today_usage.get(db_session, test_device)
+    ingest_service.write_usage_rows(db_session, _rows(test_device, ("steam.exe", 60, 0)))
+    db_session.rollback()
+    assert today_usage.get(db_session, test_device) == (0, {})
+
+
+def test_matches_sql_path(monkeypatch, db_session, test_device):
+    test_device.timezone_offset = 3600
+    ingest_service.write_usage_rows(db_session, _rows(
+        test_device, ("a.exe", 60, 0), ("b.exe", 60, 0), ("a.exe", 20, 3), ("b.exe", 10, 2000)
+    ))
+    db_session.commit()
+    today_usage.get(db_session, test_device)
+    ingest_service.write_usage_rows(db_session, _rows(test_device, ("c.exe", 5, 1)))
+    db_session.commit()
+
+    cached = rules_api._today_usage(db_session, test_device)
+    monkeypatch.setattr(today_usage, "enabled", False)
+    assert cached == rules_api._today_usage(db_session, test_device)
+
+
+def test_load_in_flight_is_not_stored(db_session, test_device):
+    store = TodayUsageStore()
+    store.get(db_session, test_device)
+    tickets = store.take_tickets([test_device.id])
+    store.forget(test_device.id)
+    store.get(db_session, test_device)  # loaded after the ticket: may already hold the rows
+    store.add_committed(_rows(test_device, ("steam.exe", 60, 0)), tickets)
+    assert store.stats()["devices"] == 0 and store.stats()["dropped"] == 1
+
+
+def test_day_rollover():
+    now = datetime(2026, 3, 10, 22, 30, tzinfo=timezone.utc)
+    assert device_day_start(0, now) == datetime(2026, 3, 10)
+    # UTC+2: already 11 March locally, which started at 22:00 UTC
+    assert device_day_start(7200, now) == datetime(2026, 3, 10, 22, 0)
+    assert device_day_start(-3600, now) == datetime(2026, 3, 10, 1, 0)
+
+
+def test_persist_and_load(tmp_path, db_session, test_device):
+    path = str(tmp_path / "today_usage.json")
+    ingest_service.write_usage_rows(db_session, _rows(test_device, ("steam.exe", 60, 0)))
+    db_session.commit()
+    store = TodayUsageStore()
+    expected = store.get(db_session, test_device)
+    assert store.persist(path, db_session) == 1
+
+    restored = TodayUsageStore()
+    assert restored.load(path, db_session) is True
+    assert restored.get(db_session, test_device) == expected
+    assert restored.stats()["loads"] == 0
+    # One-shot
+    assert restored.load(path, db_session) is False
+
+    # Rows written after the snapshot make it unusable
+    store.persist(path, db_session)
+    ingest_service.write_usage_rows(db_session, _rows(test_device, ("chrome.exe", 60, 0)))
+    db_session.commit()
+    assert TodayUsageStore().load(path, db_session) is False
+
+
+def test_rows_after_today_are_ignored(db_session, test_device):
+    today_usage.get(db_session, test_device)
+    far_future = datetime(2200, 1, 1)
+    ingest_service.write_usage_rows(db_session, _rows(test_device, ("steam.exe", 60, 0)) + [
+        dict(device_id=test_device.id, app_name="clock.exe", window_title="w", duration=60,
+             timestamp=far_future, created_at=far_future)
+    ])
+    db_session.commit()
+    assert today_usage.get(db_session, test_device) == (60, {"steam.exe": 60})
+
+    # Same on a fresh load from usage_logs
+    today_usage.forget(test_device.id)
+    assert today_usage.get(db_session, test_device) == (60, {"steam.exe": 60})
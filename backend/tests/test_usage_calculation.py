@@ -1,6 +1,5 @@
 import pytest
 from datetime import datetime, timezone
-from unittest.mock import MagicMock
 
 import os
 import sys
@@ -8,12 +7,9 @@ import sys
 # Add backend directory to sys.path
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from app.services.summary_service import calculate_precise_usage
+from app.services.summary_service import calculate_precise_usage, DayLog
 
 def test_interval_merging():
-    # Mock DB session
-    db = MagicMock()
-    
     # Setup test logs:
     # 1. 10:00:00 - 10:00:30 (30s)
     # 2. 10:00:20 - 10:00:50 (30s, overlaps with #1)
@@ -21,15 +17,15 @@ def test_interval_merging():
     
     base_time = datetime(2023, 1, 1, 10, 0, 0, tzinfo=timezone.utc)
     
-    # Mock return values from the query
-    mock_log1 = MagicMock(app_name="chrome", timestamp=base_time, duration=30)
-    mock_log2 = MagicMock(app_name="chrome", timestamp=base_time.replace(second=20), duration=30)
-    mock_log3 = MagicMock(app_name="minecraft", timestamp=base_time.replace(minute=1), duration=10)
-    
-    db.query.return_value.filter.return_value.all.return_value = [mock_log1, mock_log2, mock_log3]
+    # Rows as returned by fetch_day_logs
+    logs = [
+        DayLog("chrome", base_time, 30, True, None),
+        DayLog("chrome", base_time.replace(second=20), 30, True, None),
+        DayLog("minecraft", base_time.replace(minute=1), 10, True, None),
+    ]
     
     # Call the helper function
-    total_usage, elapsed = calculate_precise_usage(db, 1, base_time, base_time)
+    total_usage, elapsed = calculate_precise_usage(logs)
     
     # Expected result:
     # Segment 1 & 2 merge into: 10:00:00 - 10:00:50 (50 seconds)
@@ -40,15 +36,47 @@ def test_interval_merging():
     assert elapsed == 60
 
 def test_interval_merging_complete_overlap():
-    db = MagicMock()
     base_time = datetime(2023, 1, 1, 10, 0, 0, tzinfo=timezone.utc)
     
     # Log 2 is completely inside Log 1
-    mock_log1 = MagicMock(app_name="chrome", timestamp=base_time, duration=60)
-    mock_log2 = MagicMock(app_name="chrome", timestamp=base_time.replace(second=10), duration=30)
-    
-    db.query.return_value.filter.return_value.all.return_value = [mock_log1, mock_log2]
+    logs = [
+        DayLog("chrome", base_time, 60, True, None),
+        DayLog("chrome", base_time.replace(second=10), 30, True, None),
+    ]
     
-    total_usage, _ = calculate_precise_usage(db, 1, base_time, base_time)
+    total_usage, _ = calculate_precise_usage(logs)
     
     assert total_usage == 60
+
+
+def test_week_history_rollup_matches_raw(db_session, test_device, monkeypatch):
+    from datetime import timedelta
+    from app.services import ingest_service, summary_service
+    
+    now = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+    rows = [
+        {"device_id": test_device.id, "app_name": "chrome" if i % 2 else "minecraft",
+         "window_title": None, "exe_path": None, "duration": 60, "is_focused": True,
+         "timestamp": now - timedelta(days=i % 9, minutes=i)}
+        for i in range(60)
+    ]
+    ingest_service.write_usage_rows(db_session, rows)
+    db_session.commit()
+    today_str = now.strftime('%Y-%m-%d')
+    
+    monkeypatch.setattr(summary_service.settings, "USAGE_ROLLUP_ENABLED", True)
+    rollup = summary_service.get_week_history(db_session, test_device.id, today_str, 0)
+    monkeypatch.setattr(summary_service.settings, "USAGE_ROLLUP_ENABLED", False)
+    raw = summary_service.get_week_history(db_session, test_device.id, today_str, 0)
+    
+    assert rollup == raw
+    assert len(raw["days"]) == 7
+    assert raw["apps"] == {"chrome", "minecraft"}
+    assert summary_service.calculate_week_average(raw) > 0
+    
+    yesterday_start = now.replace(hour=0, tzinfo=None) - timedelta(days=1)
+    expected = summary_service.calculate_day_usage(
+        db_session, test_device.id, yesterday_start, yesterday_start + timedelta(days=1)
+    )
+    assert expected > 0
+    assert summary_service.calculate_yesterday_usage(raw, today_str) == expected
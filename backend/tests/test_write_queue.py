@@ -0,0 +1,157 @@
+"""
+Tests for the write-behind ingest queue.
+"""
+import asyncio
+from datetime import datetime, timezone
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.metrics import ingest_rows
+from app.models import UsageLog
+from app.offload import offload
+from app.write_queue import WriteBehindQueue
+
+
+def _row(device_id, app_name="YouTube", duration=60, ts=None):
+    return {
+        "device_id": device_id,
+        "app_name": app_name,
+        "window_title": None,
+        "exe_path": None,
+        "duration": duration,
+        "is_focused": False,
+        "timestamp": ts or datetime.now(timezone.utc),
+    }
+
+
+def test_queue_refuses_when_not_running(test_device):
+    """Producers must write inline when the writer task is not running."""
+    queue = WriteBehindQueue()
+    assert queue.enqueue_usage([_row(test_device.id)]) is False
+
+
+def test_stop_flushes_buffered_rows(db_engine, db_session, test_device):
+    """Rows buffered below the batch size are written when the writer stops."""
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    queue = WriteBehindQueue(max_batch=1000, flush_interval=60, session_factory=SessionLocal)
+
+    async def scenario():
+        queue.start()
+        assert queue.enqueue_usage([_row(test_device.id) for _ in range(10)])
+        assert queue.stats()["depth"] == 10
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+    stats = queue.stats()
+    assert stats["depth"] == 0
+    assert stats["rows_flushed"] == 10
+    assert stats["flushes"] == 1
+    assert db_session.query(UsageLog).filter(UsageLog.device_id == test_device.id).count() == 10
+
+
+def test_queue_full_falls_back(db_engine, test_device):
+    """Above max_queue the producer is told to write inline."""
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    queue = WriteBehindQueue(max_batch=1000, flush_interval=60, max_queue=5, session_factory=SessionLocal)
+
+    async def scenario():
+        queue.start()
+        accepted = queue.enqueue_usage([_row(test_device.id) for _ in range(4)])
+        rejected = queue.enqueue_usage([_row(test_device.id) for _ in range(4)])
+        await queue.stop()
+        return accepted, rejected
+
+    accepted, rejected = asyncio.run(scenario())
+    assert accepted is True
+    assert rejected is False
+
+
+def test_flush_counts_ingest_rows(db_engine, test_device):
+    """ingest_rows_total covers rows written by the queue, not only the inline path."""
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    queue = WriteBehindQueue(max_batch=5, flush_interval=60, session_factory=SessionLocal)
+    before = ingest_rows.value()
+
+    async def scenario():
+        queue.start()
+        assert queue.enqueue_usage([_row(test_device.id) for _ in range(5)])
+        for _ in range(100):
+            if queue.stats()["rows_flushed"] == 5:
+                break
+            await asyncio.sleep(0.02)
+        await queue.stop()
+
+    asyncio.run(scenario())
+    assert queue.stats()["rows_flushed"] == 5
+    assert ingest_rows.value() == before + 5
+
+
+def test_bad_row_is_isolated_and_dropped(db_engine, db_session, test_device):
+    """A row that cannot be written does not block the rest of its batch or later flushes."""
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    queue = WriteBehindQueue(max_batch=1000, flush_interval=60, max_attempts=2, session_factory=SessionLocal)
+
+    async def scenario():
+        queue.start()
+        rows = [_row(test_device.id) for _ in range(9)]
+        rows.insert(4, _row(test_device.id, app_name=None))  # NOT NULL violation
+        assert queue.enqueue_usage(rows)
+        await queue.flush()
+        first = queue.stats()
+        assert queue.enqueue_usage([_row(test_device.id)])
+        await queue.flush()
+        await queue.stop()
+        return first
+
+    first = asyncio.run(scenario())
+    assert first["rows_flushed"] == 9 and first["depth"] == 1 and first["rows_dropped"] == 0
+    stats = queue.stats()
+    assert stats["rows_flushed"] == 10
+    assert stats["depth"] == 0 and stats["rows_dropped"] == 1
+    assert db_session.query(UsageLog).filter(UsageLog.device_id == test_device.id).count() == 10
+
+
+def test_transient_failure_retries_whole_batch(db_engine, db_session, test_device):
+    """Lock or connection errors keep the batch intact for the next flush."""
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    failures = []
+
+    def flaky_session():
+        if not failures:
+            failures.append(1)
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return SessionLocal()
+
+    queue = WriteBehindQueue(max_batch=1000, flush_interval=60, max_attempts=1, session_factory=flaky_session)
+
+    async def scenario():
+        queue.start()
+        assert queue.enqueue_usage([_row(test_device.id) for _ in range(5)])
+        assert await offload.run("maintenance", queue.flush_pending) == 0
+        assert queue.stats()["depth"] == 5
+        await queue.stop()
+
+    asyncio.run(scenario())
+    stats = queue.stats()
+    assert stats["failed_flushes"] == 1 and stats["rows_dropped"] == 0
+    assert db_session.query(UsageLog).filter(UsageLog.device_id == test_device.id).count() == 5
+
+
+def test_discard_device_drops_queued_rows(db_engine, db_session, test_device):
+    """Deleting a device drops its buffered rows; other devices' rows are kept."""
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    queue = WriteBehindQueue(max_batch=1000, flush_interval=60, session_factory=SessionLocal)
+    other_id = test_device.id + 1000
+
+    async def scenario():
+        queue.start()
+        assert queue.enqueue_usage([_row(test_device.id) for _ in range(3)])
+        assert queue.enqueue_usage([_row(other_id) for _ in range(2)], offset_seconds=3600)
+        dropped = await queue.discard_device(other_id)
+        await queue.stop()
+        return dropped
+
+    assert asyncio.run(scenario()) == 2
+    assert queue.stats()["rows_flushed"] == 3
+    assert db_session.query(UsageLog).count() == 3
@@ -1,6 +1,8 @@
 package com.familyeye.agent.data.api
 
 import com.familyeye.agent.config.AgentConstants
+import com.familyeye.agent.data.api.dto.RulesPushMessage
+import com.familyeye.agent.data.api.dto.RulesPushPayload
 import com.familyeye.agent.data.repository.AgentConfigRepository
 import com.squareup.moshi.Moshi
 import kotlinx.coroutines.CoroutineScope
@@ -45,6 +47,10 @@ class WebSocketClient @Inject constructor(
     // Command flow for subscribers (Service)
     private val _commands = MutableSharedFlow<WebSocketCommand>()
     val commands = _commands.asSharedFlow()
+
+    // Rule sets pushed by the backend after a change (applied without a fetch)
+    private val _rulePushes = MutableSharedFlow<RulesPushPayload>()
+    val rulePushes = _rulePushes.asSharedFlow()
     
     private var isRunning = false
 
@@ -100,6 +106,7 @@ class WebSocketClient @Inject constructor(
             .url(url)
             .addHeader("X-API-Key", apiKey)  // API key in header, not URL
             .addHeader("X-Device-ID", deviceId)
+            .addHeader("X-Agent-Features", "rules-push,rules-delta")  // rule changes pushed as {"type": "rules"}
             .build()
             
         webSocket = client.newWebSocket(request, object : WebSocketListener() {
@@ -140,6 +147,11 @@ class WebSocketClient @Inject constructor(
                 scope.launch {
                     _commands.emit(WebSocketCommand(msg.cmd, msg.payload))
                 }
+            } else if (msg.type == "rules") {
+                val push = moshi.adapter(RulesPushMessage::class.java).fromJson(text)?.payload ?: return
+                scope.launch {
+                    _rulePushes.emit(push)
+                }
             }
         } catch (e: Exception) {
             Timber.e(e, "Failed to parse WS message")
@@ -51,9 +51,31 @@ data class AgentRulesResponse(
     @Json(name = "usage_by_app") val usageByApp: Map<String, Int> = emptyMap(),
     @Json(name = "server_time") val serverTime: String?,
     @Json(name = "settings_protection") val settingsProtection: String? = "full",
+    @Json(name = "settings_exceptions") val settingsExceptions: String? = null,
+    @Json(name = "rules_version") val rulesVersion: Int? = null
+)
+
+/**
+ * Rule set pushed over WebSocket ({"type": "rules"}) after a change.
+ * Either the full set ([rules]) or a delta against [baseVersion] ([upsert] / [remove] by rule id).
+ */
+@JsonClass(generateAdapter = true)
+data class RulesPushPayload(
+    @Json(name = "rules_version") val rulesVersion: Int,
+    @Json(name = "rules") val rules: List<RuleDTO>? = null,
+    @Json(name = "base_version") val baseVersion: Int? = null,
+    @Json(name = "upsert") val upsert: List<RuleDTO> = emptyList(),
+    @Json(name = "remove") val remove: List<Int> = emptyList(),
+    @Json(name = "settings_protection") val settingsProtection: String? = "full",
     @Json(name = "settings_exceptions") val settingsExceptions: String? = null
 )
 
+@JsonClass(generateAdapter = true)
+data class RulesPushMessage(
+    @Json(name = "type") val type: String,
+    @Json(name = "payload") val payload: RulesPushPayload
+)
+
 @JsonClass(generateAdapter = true)
 data class AgentUsageLogCreate(
     @Json(name = "app_name") val appName: String,
@@ -21,9 +21,18 @@ interface RuleDao {
     @Query("DELETE FROM rules")
     suspend fun deleteAll()
 
+    @Query("DELETE FROM rules WHERE id IN (:ids)")
+    suspend fun deleteByIds(ids: List<Int>)
+
     @Transaction
     suspend fun clearAndInsert(rules: List<RuleEntity>) {
         deleteAll()
         insertAll(rules)
     }
+
+    @Transaction
+    suspend fun applyDelta(upsert: List<RuleEntity>, removeIds: List<Int>) {
+        if (removeIds.isNotEmpty()) deleteByIds(removeIds)
+        insertAll(upsert)
+    }
 }
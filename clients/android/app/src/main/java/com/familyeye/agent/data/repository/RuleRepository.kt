@@ -1,10 +1,17 @@
 package com.familyeye.agent.data.repository
 
 import com.familyeye.agent.data.api.dto.RuleDTO
+import com.familyeye.agent.data.api.dto.RulesPushPayload
 import kotlinx.coroutines.flow.Flow
 
 interface RuleRepository {
     fun getRules(): Flow<List<RuleDTO>>
     suspend fun refreshRules()
     suspend fun getLocalRules(): List<RuleDTO>
+
+    /**
+     * Apply a rule set pushed over WebSocket.
+     * @return false if it cannot be applied (delta against an unknown version) - caller should refresh
+     */
+    suspend fun applyRulesPush(push: RulesPushPayload): Boolean
 }
@@ -2,6 +2,7 @@ package com.familyeye.agent.data.repository
 
 import com.familyeye.agent.data.api.FamilyEyeApi
 import com.familyeye.agent.data.api.dto.RuleDTO
+import com.familyeye.agent.data.api.dto.RulesPushPayload
 import com.familyeye.agent.data.local.RuleDao
 import com.familyeye.agent.data.local.toDTO
 import com.familyeye.agent.data.local.toEntity
@@ -21,6 +22,10 @@ class RuleRepositoryImpl @Inject constructor(
     private val usageRepository: UsageRepository
 ) : RuleRepository {
 
+    // Backend rules_version of the rules in the local DB (null until the first fetch / full push)
+    @Volatile
+    private var rulesVersion: Int? = null
+
     override fun getRules(): Flow<List<RuleDTO>> {
         return ruleDao.getAllRulesConfig().map { entities ->
             entities.map { it.toDTO() }
@@ -49,6 +54,7 @@ class RuleRepositoryImpl @Inject constructor(
                     // Save to local DB
                     val entities = rulesResponse.rules.map { it.toEntity() }
                     ruleDao.clearAndInsert(entities)
+                    rulesVersion = rulesResponse.rulesVersion
                     
                     // Save settings protection level
                     configRepository.saveSettingsProtection(
@@ -73,6 +79,27 @@ class RuleRepositoryImpl @Inject constructor(
         }
     }
 
+    override suspend fun applyRulesPush(push: RulesPushPayload): Boolean {
+        val current = rulesVersion
+        if (current != null && push.rulesVersion <= current) {
+            Timber.d("Ignoring rules push ${push.rulesVersion} (have $current)")
+            return true
+        }
+        when {
+            push.rules != null -> ruleDao.clearAndInsert(push.rules.map { it.toEntity() })
+            push.baseVersion != null && push.baseVersion == current ->
+                ruleDao.applyDelta(push.upsert.map { it.toEntity() }, push.remove)
+            else -> {
+                Timber.i("Rules delta base ${push.baseVersion} != $current - refresh needed")
+                return false
+            }
+        }
+        rulesVersion = push.rulesVersion
+        configRepository.saveSettingsProtection(push.settingsProtection ?: "full", push.settingsExceptions)
+        Timber.i("Applied rules push: version ${push.rulesVersion}")
+        return true
+    }
+
     override suspend fun getLocalRules(): List<RuleDTO> {
         return ruleDao.getAllRulesSnapshot().map { it.toDTO() }
     }
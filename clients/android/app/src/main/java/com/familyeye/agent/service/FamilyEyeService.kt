@@ -332,6 +332,17 @@ class FamilyEyeService : Service(), ScreenStateListener {
     }
 
     private fun startCommandListening() {
+        serviceScope.launch {
+            webSocketClient.rulePushes.collect { push ->
+                if (!ruleRepository.applyRulesPush(push)) {
+                    fetchRules()
+                }
+                // Same as REFRESH_RULES / UNLOCK_NOW: drop the overlay, UsageTracker re-shows it if still blocked
+                launch(Dispatchers.Main) {
+                    blockOverlayManager.hide()
+                }
+            }
+        }
         serviceScope.launch {
              webSocketClient.commands.collect { command ->
                  Timber.i("Received WebSocket Command: ${command.command}")
@@ -96,8 +96,13 @@ class BackendAPIClient:
         url = config.get("backend_url", "https://localhost:8000")
         return url.rstrip('/')
 
-    def fetch_rules(self) -> Optional[Dict]:
-        """Fetch latest rules from backend."""
+    def fetch_rules(self, known_version: Optional[int] = None) -> Optional[Dict]:
+        """
+        Fetch latest rules from backend.
+
+        With known_version (rules_version of the last response) an unchanged
+        rule set comes back as {"unchanged": true, "rules": []} plus usage.
+        """
         try:
             url = f"{self._get_base_url()}/api/rules/agent/fetch"
             # Payload is redundant if headers are used, but keeping for compatibility
@@ -105,6 +110,8 @@ class BackendAPIClient:
                 "device_id": config.get("device_id"),
                 "api_key": config.get("api_key")
             }
+            if known_version is not None:
+                payload["known_version"] = known_version
             
             response = self.session.post(url, json=payload, timeout=10)
             
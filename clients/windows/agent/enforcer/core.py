@@ -72,6 +72,8 @@ class RuleEnforcer:
         self.current_pid = os.getpid()
         self._last_fetch_rules_time = 0
         self._needs_immediate_fetch = False
+        self.rules_version: Optional[int] = None  # backend rules_version of self.rules
+        self._pending_rules_push: Optional[Dict] = None  # set by the WebSocket thread, applied in update()
         
         # Device limits
         self.device_daily_limit: Optional[int] = None  # seconds
@@ -130,6 +132,42 @@ class RuleEnforcer:
         self.logger.info("Reconnection detected - triggering immediate rule fetch")
         self._needs_immediate_fetch = True
 
+    def apply_rules_push(self, payload: Dict):
+        """Queue a rule set pushed over WebSocket (called from the WebSocket thread)."""
+        self._pending_rules_push = payload
+
+    def _apply_pending_push(self):
+        """Apply a pushed rule set or delta; fall back to a fetch if it does not fit."""
+        payload, self._pending_rules_push = self._pending_rules_push, None
+        if not payload:
+            return
+        version = payload.get("rules_version")
+        if version is None:
+            self._needs_immediate_fetch = True
+            return
+        if self.rules_version is not None and version <= self.rules_version:
+            self.logger.debug(f"Ignoring rules push {version} (have {self.rules_version})")
+            return
+
+        if "rules" in payload:
+            self.rules = payload["rules"]
+        elif payload.get("base_version") == self.rules_version:
+            removed = set(payload.get("remove", []))
+            by_id = {r.get("id"): r for r in self.rules if r.get("id") not in removed}
+            for rule in payload.get("upsert", []):
+                by_id[rule.get("id")] = rule
+            self.rules = sorted(by_id.values(), key=lambda r: r.get("id") or 0)
+        else:
+            # Delta against a version we do not have (missed push, fresh start)
+            self.logger.info(f"Rules delta base {payload.get('base_version')} != {self.rules_version} - fetching")
+            self._needs_immediate_fetch = True
+            return
+
+        self.rules_version = version
+        self._update_blocked_apps()
+        self._save_rules_cache()
+        self.logger.info(f"Rules pushed: version {version}, {len(self.rules)} rules")
+
     def _fetch_rules(self):
         """Fetch rules from backend using API Client."""
         try:
@@ -145,7 +183,7 @@ class RuleEnforcer:
                 except Exception as e:
                     self.logger.warning(f"Failed to sync usage before fetch: {e}")
 
-            rules_data = api_client.fetch_rules()
+            rules_data = api_client.fetch_rules(self.rules_version)
             
             if rules_data:
                 self._process_rules_response(rules_data)
@@ -165,7 +203,10 @@ class RuleEnforcer:
         if isinstance(rules_data, list):
             self.rules = rules_data
         elif isinstance(rules_data, dict) and "rules" in rules_data:
-            self.rules = rules_data["rules"]
+            # Unchanged rule set: keep the current rules, refresh usage and time only
+            if not rules_data.get("unchanged"):
+                self.rules = rules_data["rules"]
+            self.rules_version = rules_data.get("rules_version")
             self.usage_by_app = rules_data.get("usage_by_app", {})
             self.device_today_usage = rules_data.get("daily_usage", 0)
             
@@ -353,6 +394,10 @@ class RuleEnforcer:
         """Update enforcement - main loop entry point."""
         # Fetch rules periodically
         current_time = time.monotonic()
+
+        # Rules pushed over WebSocket since the last tick
+        if self._pending_rules_push is not None:
+            self._apply_pending_push()
         
         # Dynamic Polling Strategy
         # If WS connected -> 5 min (300s) interval
@@ -273,6 +273,10 @@ class FamilyEyeAgent:
             # Or if payload has explicit override, we should handle it.
             # Currently backend updates DB then sends command, so fetch is correct.
             self.enforcer.trigger_immediate_fetch()
+
+        elif command.command == 'RULES':
+            # Rule set pushed by the backend - applied by the enforcer loop, no fetch
+            self.enforcer.apply_rules_push(command.payload or {})
             
         elif command.command == 'SCREENSHOT_NOW':
             # Trigger screenshot via IPC to ChildAgent (if user session active)
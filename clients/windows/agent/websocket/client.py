@@ -116,7 +116,9 @@ class WebSocketClient:
             headers = {
                 "X-API-Key": api_key,
                 "X-Device-ID": device_id,
-                "User-Agent": "FamilyEye-WindowsAgent/2.0"
+                "User-Agent": "FamilyEye-WindowsAgent/2.0",
+                # Rule changes arrive as {"type": "rules"} messages instead of REFRESH_RULES
+                "X-Agent-Features": "rules-push,rules-delta"
             }
 
             try:
@@ -193,9 +195,14 @@ class WebSocketClient:
                 # self.logger.debug("Pong received")
                 return
                 
-            if msg.type == 'command':
-                self.logger.info(f"Received Command: {msg.cmd}")
-                cmd_obj = WebSocketCommand(command=msg.cmd, payload=msg.payload)
+            if msg.type in ('command', 'rules'):
+                if msg.type == 'rules':
+                    # Pushed rule set / delta - handled like a command with the rules as payload
+                    cmd_obj = WebSocketCommand(command='RULES', payload=msg.payload)
+                    self.logger.info(f"Received Rules (version {(msg.payload or {}).get('rules_version')})")
+                else:
+                    self.logger.info(f"Received Command: {msg.cmd}")
+                    cmd_obj = WebSocketCommand(command=msg.cmd, payload=msg.payload)
                 
                 # Dispatch to callbacks
                 for callback in self._command_callbacks: